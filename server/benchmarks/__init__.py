@@ -0,0 +1,3 @@
+"""
+Performance benchmarks of the server. Run them with [python -m benchmarks --help] from the server folder.
+"""
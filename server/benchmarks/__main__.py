@@ -0,0 +1,38 @@
+import argparse
+import importlib
+import sys
+
+from ._harness import write_report
+
+# Name of each suite and the module implementing it (with [add_arguments(parser)] and [run(args) -> results])
+_SUITES = {
+    "data": "data_structures",
+    "latency": "latency",
+    "soak": "soak",
+    "compression": "compression",
+}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="Performance benchmarks of the server")
+    subparsers = parser.add_subparsers(dest="suite", required=True)
+    for suite, module_name in _SUITES.items():
+        module = importlib.import_module(f".{module_name}", package=__package__)
+        subparser = subparsers.add_parser(suite, help=module.__doc__.strip().split("\n")[0])
+        subparser.add_argument("--output", default=None, help="Path of the JSON report to write")
+        module.add_arguments(subparser)
+        subparser.set_defaults(module=module)
+
+    args = parser.parse_args()
+    results = args.module.run(args)
+    if args.output is not None:
+        write_report(suite=args.suite, results=results, path=args.output)
+        print(f"Report written to {args.output}")
+
+    # Suites checking bounds (e.g. the soak) mark their results as passed or not
+    if any(result.get("passed") is False for result in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
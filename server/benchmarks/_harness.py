@@ -0,0 +1,105 @@
+from datetime import datetime
+import json
+import platform
+import statistics
+import time
+from typing import Any, Callable
+
+import numpy as np
+
+from stimwalker import __version__
+
+
+def measure(function: Callable[[], Any], repeat: int = 5, min_time: float = 0.05) -> dict[str, Any]:
+    """Time a function.
+
+    The function is called in a loop long enough to last at least [min_time] seconds (so the timer resolution does not
+    matter), and this loop is repeated [repeat] times.
+
+    Parameters
+    ----------
+    function : Callable[[], Any]
+        The function to time.
+    repeat : int
+        Number of times the loop is timed.
+    min_time : float
+        Minimum duration (in seconds) of one loop.
+
+    Returns
+    -------
+    out : dict[str, Any]
+        The time per call (min, median and mean over the repetitions, in seconds) and the number of calls per loop.
+    """
+    # Calibrate the number of calls per loop (this also warms up the function)
+    number = 1
+    while True:
+        started_at = time.perf_counter()
+        for _ in range(number):
+            function()
+        elapsed = time.perf_counter() - started_at
+        if elapsed >= min_time or number >= 1_000_000:
+            break
+        number *= 10 if elapsed < min_time / 10 else 2
+
+    timings = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        for _ in range(number):
+            function()
+        timings.append((time.perf_counter() - started_at) / number)
+
+    return {
+        "min": min(timings),
+        "median": statistics.median(timings),
+        "mean": statistics.fmean(timings),
+        "number": number,
+        "repeat": repeat,
+    }
+
+
+def percentiles(values: list[float] | np.ndarray) -> dict[str, float]:
+    """Summarize a distribution (e.g. of latencies) by its count, mean, p50, p90, p99 and max"""
+    values = np.asarray(values, dtype=float)
+    if values.size == 0:
+        return {"count": 0}
+    return {
+        "count": int(values.size),
+        "mean": float(np.mean(values)),
+        "p50": float(np.percentile(values, 50)),
+        "p90": float(np.percentile(values, 90)),
+        "p99": float(np.percentile(values, 99)),
+        "max": float(np.max(values)),
+    }
+
+
+def metadata() -> dict[str, Any]:
+    """Describe the environment the benchmarks ran in, so reports can be compared"""
+    return {
+        "date": datetime.now().isoformat(),
+        "stimwalker": __version__,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+    }
+
+
+def write_report(suite: str, results: list[dict[str, Any]], path: str) -> None:
+    """Write the results of a suite as JSON"""
+    with open(path, "w") as f:
+        json.dump({"suite": suite, "metadata": metadata(), "results": results}, f, indent=2)
+
+
+def print_results(results: list[dict[str, Any]], key: str) -> None:
+    """Print one line per result: its name, its parameters and the statistic [key]"""
+    for result in results:
+        params = ", ".join(f"{name}={value}" for name, value in result["params"].items())
+        values = result[key]
+        summary = ", ".join(f"{name}={_format(value)}" for name, value in values.items() if name not in ("repeat",))
+        print(f"{result['benchmark']:<40} [{params}] {summary}")
+
+
+def _format(value: Any) -> str:
+    if isinstance(value, float):
+        return f"{value:.3g}"
+    return str(value)
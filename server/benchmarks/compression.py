@@ -0,0 +1,134 @@
+"""
+Compression of the fetch payloads on the data channel: ratio and CPU time of each codec (zlib, lzma), level and delta
+encoding of the samples, on a recorded trial (or a synthetic Lokomat-like one), for fetches of increasing length.
+"""
+
+import argparse
+import json
+from typing import Any
+
+import numpy as np
+
+from stimwalker.common.data import Data
+from stimwalker.nidaq.synthetic import NiDaqSynthetic
+from stimwalker.runner import protocol
+
+from ._harness import measure, print_results
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--recording",
+        default=None,
+        help="Path of a trial saved with Data.save (by default, a synthetic trial of --channels at --frame-rate)",
+    )
+    parser.add_argument("--channels", type=int, default=25, help="Number of channels of the synthetic trial")
+    parser.add_argument("--frame-rate", type=int, default=1000, help="Frame rate of the synthetic trial (Hz)")
+    parser.add_argument("--noise", type=float, default=0.01, help="White noise of the synthetic trial")
+    parser.add_argument("--block-duration", type=float, default=0.1, help="Duration of a NiDaq block (s)")
+    parser.add_argument(
+        "--fetch-seconds", type=float, nargs="+", default=[1, 10], help="Durations of data fetched at once (s)"
+    )
+    parser.add_argument("--codecs", nargs="+", default=["zlib", "lzma"], help="Codecs to compare")
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 6], help="Compression levels to compare")
+    parser.add_argument("--sample-type", default="float32", help="Type of the samples sent (float32 or float64)")
+    parser.add_argument("--repeat", type=int, default=5, help="Number of timed repetitions")
+    parser.add_argument("--min-time", type=float, default=0.05, help="Minimum duration of a repetition (s)")
+
+
+def run(args: argparse.Namespace) -> list[dict[str, Any]]:
+    t, samples = _recording(args)
+    frame_rate = 1 / np.median(np.diff(t))
+    dtype = protocol.sample_type(args.sample_type)
+
+    results = []
+    for fetch_seconds in args.fetch_seconds:
+        data = _fetch(t, samples, n_samples=int(fetch_seconds * frame_rate), block_duration=args.block_duration)
+        payloads = {
+            "json": (protocol.MessageType.JSON, [json.dumps(data.serialize(to_json=True)).encode()]),
+            "binary": (protocol.MessageType.DATA, protocol.encode_data(data, dtype)),
+        }
+        for encoding, (message_type, payload) in payloads.items():
+            for codec in args.codecs:
+                for level in args.levels:
+                    for delta in (False, True) if encoding == "binary" else (False,):
+                        results.append(
+                            _benchmark(message_type, payload, encoding, codec, level, delta, fetch_seconds, args)
+                        )
+
+    print_results(results, key="compression")
+    return results
+
+
+def _benchmark(
+    message_type: protocol.MessageType,
+    payload: list,
+    encoding: str,
+    codec: str,
+    level: int,
+    delta: bool,
+    fetch_seconds: float,
+    args: argparse.Namespace,
+) -> dict[str, Any]:
+    compression = protocol.Compression.from_parameters([codec, "0", str(level), str(int(delta))])
+    compressed_type, compressed = compression.compress(message_type, payload)
+    original_size = sum(len(buffer) for buffer in payload)
+    compressed_size = sum(len(buffer) for buffer in compressed)
+    compressed_payload = b"".join(compressed)
+
+    compress = measure(lambda: compression.compress(message_type, payload), repeat=args.repeat, min_time=args.min_time)
+    if compressed_type == protocol.MessageType.COMPRESSED:
+        decompress = measure(
+            lambda: protocol.decompress(compressed_payload), repeat=args.repeat, min_time=args.min_time
+        )
+    else:
+        decompress = {"min": 0.0}
+
+    return {
+        "benchmark": f"compression.{encoding}",
+        "params": {"codec": codec, "level": level, "delta": delta, "fetch_seconds": fetch_seconds},
+        "compression": {
+            "original_bytes": original_size,
+            "compressed_bytes": compressed_size,
+            "ratio": original_size / compressed_size,
+            "compress_ms": compress["min"] * 1000,
+            "decompress_ms": decompress["min"] * 1000,
+            "compress_mb_per_s": original_size / compress["min"] / 1e6,
+        },
+        "seconds_per_call": compress,
+    }
+
+
+def _recording(args: argparse.Namespace) -> tuple[np.ndarray, np.ndarray]:
+    """The time and samples [channels x time] of the trial to fetch from"""
+    if args.recording is not None:
+        nidaq = Data.load(args.recording).nidaq
+        return np.concatenate(nidaq._t), np.concatenate(nidaq._data, axis=1)
+
+    # Enough samples for the longest fetch, read block by block as the synthetic device would acquire them
+    n_samples = int(max(args.fetch_seconds) * args.frame_rate)
+    device = NiDaqSynthetic(
+        num_channels=args.channels,
+        frame_rate=args.frame_rate,
+        time_between_samples=args.block_duration,
+        noise=args.noise,
+    )
+    block_size = int(args.block_duration * args.frame_rate)
+    samples = np.empty((args.channels, n_samples))
+    for first in range(0, n_samples, block_size):
+        device._read_into(samples[:, first : first + block_size], first)
+    return 1_700_000_000.0 + np.arange(n_samples) / args.frame_rate, samples
+
+
+def _fetch(t: np.ndarray, samples: np.ndarray, n_samples: int, block_duration: float) -> Data:
+    """What a fetch of the first [n_samples] samples of the trial sends, split in blocks as the device acquires them"""
+    if n_samples > t.shape[0]:
+        raise ValueError(f"The recording only has {t.shape[0]} samples, {n_samples} are fetched")
+    frame_rate = 1 / np.median(np.diff(t))
+    block_size = max(int(block_duration * frame_rate), 1)
+
+    data = Data()
+    for first in range(0, n_samples, block_size):
+        last = min(first + block_size, n_samples)
+        data.nidaq.add(t[first:last], samples[:, first:last])
+    return data
@@ -0,0 +1,224 @@
+"""
+Micro-benchmarks of the data structures that grow with the session (NiDaqData, RehastimData, Data) and of the
+analysis done on them at each scheduler tick. Each benchmark is run on sessions of increasing length, so the O(n)
+paths show up as a time per call growing with the session.
+"""
+
+import argparse
+from datetime import datetime
+import os
+import tempfile
+from typing import Any, Callable
+
+import numpy as np
+
+from stimwalker.common.data import Data
+from stimwalker.nidaq.data import NiDaqData
+from stimwalker.rehastim.data import Channel, RehastimData
+from stimwalker.scheduler.data_analyser import DataAnalyser, Side
+
+from ._harness import measure, print_results
+
+_BENCHMARKS: dict[str, Callable[["_Session"], Callable[[], Any]]] = {}
+
+
+def _benchmark(name: str):
+    """Register a benchmark. It receives a session and returns the function to time."""
+
+    def decorator(setup: Callable[["_Session"], Callable[[], Any]]):
+        _BENCHMARKS[name] = setup
+        return setup
+
+    return decorator
+
+
+class _Session:
+    """A recorded session of [minutes] minutes, as the server would hold it"""
+
+    def __init__(
+        self,
+        minutes: float,
+        num_channels: int,
+        frame_rate: int,
+        block_duration: float,
+        stimulations_per_second: float,
+        folder: str,
+        n_stimulation_channels: int = 8,
+    ) -> None:
+        self.minutes = minutes
+        self.folder = folder  # Where the benchmarks can write files
+        self.t0 = 1_700_000_000.0
+        block_size = int(block_duration * frame_rate)
+        n_blocks = max(int(minutes * 60 / block_duration), 2)
+
+        rng = np.random.default_rng(0)
+        self.block = rng.standard_normal((num_channels, block_size))
+        self.t = [self.t0 + (i * block_size + np.arange(block_size)) / frame_rate for i in range(n_blocks)]
+        self.data = [self.block.copy() for _ in range(n_blocks)]
+        self.next_t = self.t[-1] + block_duration
+
+        duration = n_blocks * block_duration
+        n_events = max(int(duration * stimulations_per_second), 2)
+        self.channels = tuple(Channel(i, 0.0) for i in range(n_stimulation_channels))
+        self.events = [
+            (
+                self.t0 + i / stimulations_per_second,
+                0.5 / stimulations_per_second,
+                tuple(Channel(c, float(i % 50)) for c in range(n_stimulation_channels)),
+            )
+            for i in range(n_events)
+        ]
+        self.duration = duration
+
+    def nidaq(self) -> NiDaqData:
+        """A new NiDaqData holding the session (the blocks are shared, the lists are not)"""
+        return NiDaqData(t0=datetime.fromtimestamp(self.t0), t=list(self.t), data=list(self.data))
+
+    def rehastim(self) -> RehastimData:
+        """A new RehastimData holding the stimulations of the session"""
+        return RehastimData(t0=datetime.fromtimestamp(self.t0), data=list(self.events))
+
+    def full(self) -> Data:
+        """A new Data holding the whole session"""
+        return Data(nidaq=self.nidaq(), rehastim=self.rehastim(), t0=datetime.fromtimestamp(self.t0))
+
+
+@_benchmark("nidaq.add_sample_block")
+def _nidaq_add_sample_block(session: _Session):
+    data = session.nidaq()
+    t = session.t[-1]
+    block = session.block
+    return lambda: data.add_sample_block(t, block)
+
+
+@_benchmark("nidaq.time")
+def _nidaq_time(session: _Session):
+    data = session.nidaq()
+    return lambda: data.time
+
+
+@_benchmark("nidaq.as_array")
+def _nidaq_as_array(session: _Session):
+    data = session.nidaq()
+    return lambda: data.as_array
+
+
+@_benchmark("nidaq.sample_block[-1]")
+def _nidaq_sample_block_last(session: _Session):
+    data = session.nidaq()
+    return lambda: data.sample_block(-1)
+
+
+@_benchmark("nidaq.sample_block[-10:]")
+def _nidaq_sample_block_last_ten(session: _Session):
+    data = session.nidaq()
+    return lambda: data.sample_block(slice(-10, None))
+
+
+@_benchmark("nidaq.copy")
+def _nidaq_copy(session: _Session):
+    data = session.nidaq()
+    return lambda: data.copy
+
+
+@_benchmark("nidaq.serialize(to_json=True)")
+def _nidaq_serialize_to_json(session: _Session):
+    data = session.nidaq()
+    return lambda: data.serialize(to_json=True)
+
+
+@_benchmark("rehastim.add")
+def _rehastim_add(session: _Session):
+    data = session.rehastim()
+    channels = session.channels
+    now = session.next_t
+    return lambda: data.add(now, 0.1, channels)
+
+
+@_benchmark("rehastim.sample_block_between[last 10 s]")
+def _rehastim_sample_block_between(session: _Session):
+    data = session.rehastim()
+    tf = session.t0 + session.duration
+    return lambda: data.sample_block_between(t0=tf - 10, tf=tf)
+
+
+@_benchmark("rehastim.amplitude_as_array")
+def _rehastim_amplitude_as_array(session: _Session):
+    data = session.rehastim()
+    return lambda: data.amplitude_as_array
+
+
+@_benchmark("data.save")
+def _data_save(session: _Session):
+    data = session.full()
+    path = os.path.join(session.folder, "save.pkl")
+    return lambda: data.save(path)
+
+
+@_benchmark("data.load")
+def _data_load(session: _Session):
+    path = os.path.join(session.folder, "load.pkl")
+    session.full().save(path)
+    return lambda: Data.load(path)
+
+
+@_benchmark("data_analyser.percentage_of_stride")
+def _data_analyser_percentage_of_stride(session: _Session):
+    data = session.full()
+    return lambda: DataAnalyser.percentage_of_stride(data, Side.LEFT)
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--minutes",
+        type=float,
+        nargs="+",
+        default=[1, 4, 16],
+        help="Lengths of the sessions (in minutes) the benchmarks are run on",
+    )
+    parser.add_argument("--channels", type=int, default=25, help="Number of NiDaq channels")
+    parser.add_argument("--frame-rate", type=int, default=1000, help="NiDaq frame rate (Hz)")
+    parser.add_argument("--block-duration", type=float, default=1.0, help="Duration of a NiDaq block (s)")
+    parser.add_argument("--stimulations-per-second", type=float, default=2, help="Rate of stimulation events")
+    parser.add_argument("--repeat", type=int, default=5, help="Number of timed repetitions")
+    parser.add_argument("--min-time", type=float, default=0.05, help="Minimum duration of a repetition (s)")
+    parser.add_argument("--filter", default=None, help="Only run the benchmarks whose name contains this string")
+
+
+def run(args: argparse.Namespace) -> list[dict[str, Any]]:
+    names = [name for name in _BENCHMARKS if args.filter is None or args.filter in name]
+
+    results = []
+    for minutes in args.minutes:
+        with tempfile.TemporaryDirectory(prefix="stimwalker_benchmark_") as folder:
+            results += _run_session(names, minutes, folder, args)
+    return results
+
+
+def _run_session(names: list[str], minutes: float, folder: str, args: argparse.Namespace) -> list[dict[str, Any]]:
+    session = _Session(
+        minutes=minutes,
+        num_channels=args.channels,
+        frame_rate=args.frame_rate,
+        block_duration=args.block_duration,
+        stimulations_per_second=args.stimulations_per_second,
+        folder=folder,
+    )
+
+    results = []
+    for name in names:
+        function = _BENCHMARKS[name](session)
+        timing = measure(function, repeat=args.repeat, min_time=args.min_time)
+        results.append(
+            {
+                "benchmark": name,
+                "params": {
+                    "session_minutes": minutes,
+                    "nidaq_blocks": len(session.t),
+                    "stimulation_events": len(session.events),
+                },
+                "seconds_per_call": timing,
+            }
+        )
+        print_results(results[-1:], key="seconds_per_call")
+    return results
@@ -0,0 +1,153 @@
+"""
+End-to-end latency from the acquisition of a hip-angle block to the matching stimulation command being written to the
+Rehastim, through the real pipeline (NiDaqLokomatMock -> data ready subscriptions -> Scheduler -> RehastimLokomatMock).
+"""
+
+import argparse
+import itertools
+import time
+from typing import Any
+
+import numpy as np
+
+from stimwalker.nidaq.mocks import NiDaqLokomatMock
+from stimwalker.rehastim.mocks import PortMock, RehastimLokomatMock
+from stimwalker.runner.runner_generic import RunnerGeneric
+from stimwalker.scheduler.automatic_stimulation_rule import AutomaticStimulationRule
+
+from ._harness import percentiles, print_results
+
+
+class _TimestampedPortMock(PortMock):
+    """Port that records when each command is written"""
+
+    def __init__(self, port: str):
+        super().__init__(port=port)
+        self.writes: list[float] = []
+
+    def write(self, command: bytes):
+        self.writes.append(time.perf_counter())
+
+
+class _TimestampedNiDaqMock(NiDaqLokomatMock):
+    """NiDaq that records when each block is acquired"""
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.acquired_at: list[float] = []
+
+    def _acquire_fake_samples(self, n_samples: int) -> None:
+        self.acquired_at.append(time.perf_counter())
+        super()._acquire_fake_samples(n_samples)
+
+
+class _LatencyRunner(RunnerGeneric):
+    """Runner without interface, recording which writes to the port belong to each stimulation command"""
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.commands: list[tuple[float, int, int]] = []  # (called at, first write, last write + 1)
+
+    def _exec(self) -> None:
+        pass
+
+    def start_stimulation(self, duration: float | None = None):
+        port: _TimestampedPortMock = self._rehastim._device.port
+        called_at = time.perf_counter()
+        first_write = len(port.writes)
+        super().start_stimulation(duration)
+        self.commands.append((called_at, first_write, len(port.writes)))
+
+
+def _rules(n_rules: int, n_channels: int) -> list[AutomaticStimulationRule]:
+    """Rules stimulating from a point of the stride up to its end, staggered along the stride so each of them starts
+    and stops once per stride"""
+    rules = []
+    for i in range(n_rules):
+        rules.append(
+            AutomaticStimulationRule.from_json(
+                {
+                    "name": f"Latency rule {i}",
+                    "pulse": {"channels": [i % n_channels], "amplitudes": [10]},
+                    "start_stimulating_rule": {
+                        "side": "left",
+                        "comparison": ">=",
+                        "gait_percentage": (i + 0.5) / n_rules,
+                    },
+                    "continue_stimulating_rule": {"side": "left", "comparison": "<=", "gait_percentage": 1.0},
+                }
+            )
+        )
+    return rules
+
+
+def _measure_configuration(
+    block_duration: float, n_rules: int, n_subscribers: int, duration: float
+) -> tuple[list[float], int]:
+    """Run the pipeline for [duration] seconds and return the latency of each stimulation command (s) and the number of
+    blocks acquired"""
+    nidaq = _TimestampedNiDaqMock(time_between_samples=block_duration)
+    rehastim = RehastimLokomatMock(port="NoPort")
+    rehastim.initialize_stimulation()  # So the first command does not pay for the initialization
+    port = _TimestampedPortMock(port="NoPort")
+    rehastim._device.port = port
+
+    runner = _LatencyRunner(rehastim=rehastim, nidaq=nidaq)
+    for rule in _rules(n_rules, rehastim.nb_channels):
+        runner.schedule_stimulation(rule)
+
+    # Other consumers of the data (e.g. a plot and a recording)
+    subscribers = [lambda t, data: np.mean(data[0]) for _ in range(n_subscribers)]
+    for subscriber in subscribers:
+        nidaq.register_to_data_ready(subscriber)
+
+    try:
+        runner.start_nidaq()
+        time.sleep(duration)
+    finally:
+        runner._scheduler.dispose()
+        runner.stop_nidaq()
+        rehastim.dispose()
+
+    # The block that triggered a command is the last one acquired before it was sent
+    acquired_at = np.array(nidaq.acquired_at)
+    latencies = []
+    for called_at, first_write, last_write in runner.commands:
+        block = np.searchsorted(acquired_at, called_at, side="right") - 1
+        if block < 1 or last_write == first_write:
+            continue  # Triggered before the stride could be known, or nothing was written
+        latencies.append(port.writes[last_write - 1] - acquired_at[block])
+    return latencies, len(acquired_at)
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--block-durations",
+        type=float,
+        nargs="+",
+        default=[0.01, 0.1],
+        help="Durations of the NiDaq blocks (s)",
+    )
+    parser.add_argument("--rules", type=int, nargs="+", default=[1, 8], help="Numbers of stimulation rules")
+    parser.add_argument(
+        "--subscribers", type=int, nargs="+", default=[0, 8], help="Numbers of additional data ready subscribers"
+    )
+    parser.add_argument("--duration", type=float, default=10, help="Duration (s) of the run of each configuration")
+
+
+def run(args: argparse.Namespace) -> list[dict[str, Any]]:
+    results = []
+    for block_duration, n_rules, n_subscribers in itertools.product(args.block_durations, args.rules, args.subscribers):
+        latencies, n_blocks = _measure_configuration(
+            block_duration=block_duration, n_rules=n_rules, n_subscribers=n_subscribers, duration=args.duration
+        )
+        results.append(
+            {
+                "benchmark": "acquisition_to_stimulation",
+                "params": {"block_duration": block_duration, "rules": n_rules, "subscribers": n_subscribers},
+                "blocks": n_blocks,
+                "latency": percentiles(latencies),
+            }
+        )
+        print_results(results[-1:], key="latency")
+    return results
@@ -0,0 +1,242 @@
+"""
+Soak test: run the mock stack (NiDaqLokomatMock -> Scheduler -> RehastimLokomatMock, with recorded trials and the
+continuous data being fetched like a client would) for simulated hours on a virtual clock, while sampling the memory
+(RSS and, optionally, the top tracemalloc allocators), the threads and their CPU time. It fails when the growth
+exceeds the given bounds.
+"""
+
+import argparse
+import os
+import threading
+import time
+import tracemalloc
+from typing import Any
+
+from stimwalker.common.clock import VirtualClock
+from stimwalker.nidaq.data import NiDaqData
+from stimwalker.nidaq.mocks import NiDaqLokomatMock
+from stimwalker.rehastim.mocks import RehastimLokomatMock
+from stimwalker.runner.runner_generic import RunnerGeneric
+from stimwalker.scheduler.scheduler import Scheduler
+
+
+class _SoakRunner(RunnerGeneric):
+    """Runner without interface"""
+
+    def _exec(self) -> None:
+        pass
+
+
+def _rss_bytes() -> int:
+    """Resident set size of the process"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # Not Linux: fall back on the peak RSS, which is the best the standard library offers
+        import resource
+
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _cpu_per_thread() -> dict[str, float]:
+    """CPU time (user + system, in seconds) of each thread of the process, by thread name"""
+    names = {thread.native_id: thread.name for thread in threading.enumerate()}
+    out = {}
+    try:
+        ticks_per_second = os.sysconf("SC_CLK_TCK")
+        for tid in os.listdir("/proc/self/task"):
+            with open(f"/proc/self/task/{tid}/stat") as f:
+                # The name (2nd field) can hold spaces, so count the fields from the closing parenthesis
+                fields = f.read().rsplit(")", 1)[1].split()
+            cpu = (int(fields[11]) + int(fields[12])) / ticks_per_second
+            name = names.get(int(tid), f"native {tid}")
+            out[name] = out.get(name, 0) + cpu
+    except OSError:
+        out["process"] = time.process_time()
+    return out
+
+
+def _retained_data_bytes(*data: NiDaqData) -> int:
+    """Bytes of the NiDaq blocks held by the data (a block held by several of them is counted once)"""
+    arrays = {}
+    for nidaq_data in data:
+        for array in (*nidaq_data._t, *nidaq_data._data):
+            base = array if array.base is None else array.base
+            arrays[id(base)] = base.nbytes
+    return sum(arrays.values())
+
+
+def _sample(simulated_seconds: float, started_at: float, runner: _SoakRunner, nidaq: NiDaqLokomatMock) -> dict:
+    trial_data = runner.last_trial.nidaq if runner.last_trial is not None else NiDaqData()
+    return {
+        "simulated_hours": simulated_seconds / 3600,
+        "wall_seconds": time.perf_counter() - started_at,
+        "rss_bytes": _rss_bytes(),
+        "retained_data_bytes": _retained_data_bytes(runner._continuous_data.nidaq, trial_data, nidaq._data),
+        "rehastim_events": len(runner._continuous_data.rehastim),
+        "threads": threading.active_count(),
+    }
+
+
+def _top_allocators(first: tracemalloc.Snapshot, last: tracemalloc.Snapshot, n: int) -> list[dict[str, Any]]:
+    return [
+        {"where": str(stat.traceback), "size_diff_bytes": stat.size_diff, "count_diff": stat.count_diff}
+        for stat in last.compare_to(first, "lineno")[:n]
+    ]
+
+
+def _soak(args: argparse.Namespace) -> dict[str, Any]:
+    clock = VirtualClock(start=1_700_000_000.0)
+    nidaq = NiDaqLokomatMock(time_between_samples=args.block_duration, clock=clock)
+    rehastim = RehastimLokomatMock(port="NoPort", clock=clock)
+    runner = _SoakRunner(rehastim=rehastim, nidaq=nidaq)
+
+    # Check the rules at the requested rate of simulated time (the default of the scheduler is every millisecond)
+    runner._scheduler.dispose()
+    runner._scheduler = Scheduler(
+        runner=runner, data=runner._continuous_data, clock=clock, virtual_tick_period=args.scheduler_tick
+    )
+    for schedule in runner.available_schedules[: args.rules]:
+        runner.schedule_stimulation(schedule)
+
+    if args.tracemalloc:
+        tracemalloc.start()
+
+    runner.start_nidaq()
+    clock.advance(args.warmup_minutes * 60)
+
+    started_at = time.perf_counter()
+    first_snapshot = tracemalloc.take_snapshot() if args.tracemalloc else None
+    first_cpu = _cpu_per_thread()
+    samples = [_sample(0, started_at, runner, nidaq)]
+
+    # A clinic day: trials separated by rests, with a client fetching the continuous data all along
+    duration = args.hours * 3600
+    trial_period = (args.trial_minutes + args.rest_minutes) * 60
+    next_sample = args.sample_minutes * 60
+    elapsed = 0.0
+    while elapsed < duration:
+        in_trial = (elapsed % trial_period) < args.trial_minutes * 60
+        if in_trial and not runner._is_recording:
+            runner.start_recording()
+        elif not in_trial and runner._is_recording:
+            runner.stop_recording()
+
+        clock.advance(args.fetch_interval)
+        elapsed += args.fetch_interval
+        runner._fetch_continuous_data()
+
+        if elapsed >= next_sample:
+            samples.append(_sample(elapsed, started_at, runner, nidaq))
+            next_sample += args.sample_minutes * 60
+
+    if runner._is_recording:
+        runner.stop_recording()
+    last_cpu = _cpu_per_thread()
+    top = _top_allocators(first_snapshot, tracemalloc.take_snapshot(), args.top) if args.tracemalloc else []
+    if args.tracemalloc:
+        tracemalloc.stop()
+
+    runner._scheduler.dispose()
+    runner.stop_nidaq()
+    rehastim.dispose()
+
+    return {
+        "samples": samples,
+        "cpu": {name: cpu - first_cpu.get(name, 0) for name, cpu in last_cpu.items()},
+        "top": top,
+    }
+
+
+def _check(samples: list[dict], args: argparse.Namespace) -> tuple[dict[str, float], list[str]]:
+    """Summarize the growth and compare it with the bounds"""
+    first, last = samples[0], samples[-1]
+    hours = max(last["simulated_hours"] - first["simulated_hours"], 1e-9)
+    rss_growth = last["rss_bytes"] - first["rss_bytes"]
+    retained_growth = last["retained_data_bytes"] - first["retained_data_bytes"]
+    unexplained_growth = rss_growth - retained_growth
+    summary = {
+        "rss_growth_mb": rss_growth / 1e6,
+        "rss_growth_mb_per_hour": rss_growth / 1e6 / hours,
+        "retained_data_growth_mb": retained_growth / 1e6,
+        "unexplained_growth_mb": unexplained_growth / 1e6,
+        "thread_growth": last["threads"] - first["threads"],
+        "simulated_hours_per_wall_second": hours / max(last["wall_seconds"], 1e-9),
+    }
+
+    failures = []
+    if args.max_growth_mb_per_hour is not None and summary["rss_growth_mb_per_hour"] > args.max_growth_mb_per_hour:
+        failures.append(
+            f"RSS grew by {summary['rss_growth_mb_per_hour']:.1f} MB per hour "
+            f"(bound: {args.max_growth_mb_per_hour} MB per hour)"
+        )
+    if summary["unexplained_growth_mb"] > args.max_unexplained_mb:
+        failures.append(
+            f"RSS grew by {summary['unexplained_growth_mb']:.1f} MB more than the data retained "
+            f"(bound: {args.max_unexplained_mb} MB)"
+        )
+    if summary["thread_growth"] > args.max_thread_growth:
+        failures.append(f"{summary['thread_growth']} threads were leaked (bound: {args.max_thread_growth})")
+    return summary, failures
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--hours", type=float, default=1, help="Simulated duration of the soak")
+    parser.add_argument("--block-duration", type=float, default=1.0, help="Duration of a NiDaq block (s)")
+    parser.add_argument("--rules", type=int, default=2, help="Number of default stimulation rules to schedule")
+    parser.add_argument("--scheduler-tick", type=float, default=0.01, help="Period (simulated s) of the scheduler")
+    parser.add_argument("--trial-minutes", type=float, default=10, help="Duration of a recorded trial")
+    parser.add_argument("--rest-minutes", type=float, default=2, help="Duration of the rest between trials")
+    parser.add_argument("--fetch-interval", type=float, default=1, help="Period (simulated s) of the client fetches")
+    parser.add_argument("--warmup-minutes", type=float, default=1, help="Simulated time before measuring")
+    parser.add_argument("--sample-minutes", type=float, default=5, help="Period (simulated) of the samples")
+    parser.add_argument("--tracemalloc", action="store_true", help="Report the top allocators (slower)")
+    parser.add_argument("--top", type=int, default=10, help="Number of top allocators to report")
+    parser.add_argument(
+        "--max-growth-mb-per-hour",
+        type=float,
+        default=None,
+        help="Fail if the RSS grows faster than this, whatever retains the memory (unchecked by default)",
+    )
+    parser.add_argument(
+        "--max-unexplained-mb",
+        type=float,
+        default=64,
+        help="Fail if the RSS grows by more than this on top of the NiDaq data retained by the server",
+    )
+    parser.add_argument("--max-thread-growth", type=int, default=0, help="Fail if more threads than this are leaked")
+
+
+def run(args: argparse.Namespace) -> list[dict[str, Any]]:
+    soak = _soak(args)
+    summary, failures = _check(soak["samples"], args)
+
+    print(f"Soaked {args.hours} simulated hours in {soak['samples'][-1]['wall_seconds']:.1f} s")
+    for name, value in summary.items():
+        print(f"  {name}: {value:.3g}")
+    for name, cpu in sorted(soak["cpu"].items(), key=lambda item: -item[1]):
+        print(f"  CPU of {name}: {cpu:.2f} s")
+    for allocator in soak["top"]:
+        print(f"  {allocator['size_diff_bytes'] / 1e6:+.2f} MB at {allocator['where']}")
+    for failure in failures:
+        print(f"FAILED: {failure}")
+
+    return [
+        {
+            "benchmark": "soak",
+            "params": {
+                "hours": args.hours,
+                "block_duration": args.block_duration,
+                "rules": args.rules,
+                "trial_minutes": args.trial_minutes,
+                "rest_minutes": args.rest_minutes,
+            },
+            "summary": summary,
+            "passed": not failures,
+            "failures": failures,
+            "samples": soak["samples"],
+            "cpu_seconds_per_thread": soak["cpu"],
+            "top_allocators": soak["top"],
+        }
+    ]
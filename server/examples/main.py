@@ -2,7 +2,7 @@ import logging
 from time import sleep
 
 import numpy as np
-from stimwalker import setup_logger, RunnerTcp, Side, Data
+from stimwalker import setup_logger, RunnerAsyncTcp, RunnerTcp, Side, Data, DropPolicy
 from stimwalker.lokomat import NiDaqLokomat, RehastimLokomat
 
 # If you want to use the real devices, comment the following lines
@@ -30,6 +30,7 @@ def __main__() -> None:
     nidaq = NiDaqLokomat(time_between_samples=0.1, frame_rate=1000)
     # runner = RunnerConsole(rehastim, nidaq)
     runner = RunnerTcp(rehastim=rehastim, nidaq=nidaq)
+    # runner = RunnerAsyncTcp(rehastim=rehastim, nidaq=nidaq)  # To serve several clients (one controller, observers)
 
     # Load the stimulation rules
     # runner.schedule_stimulation(runner.available_schedules[0])
@@ -37,8 +38,9 @@ def __main__() -> None:
     # Plan some stimulations based on where we are in the stride cycle
     # runner.schedule_stimulation(StrideBasedStimulation.stimulate_in_swing_phase(side=Side.LEFT))
 
-    # This is to monitor the data. Note you can do that even when using exec() to monitor data while using the Runner
-    # nidaq.register_to_data_ready(_received_data)
+    # This is to monitor the data. Note you can do that even when using exec() to monitor data while using the Runner.
+    # As a monitor does not need every block, it only receives the latest one so it never slows down the recording
+    # nidaq.register_to_data_ready(_received_data, drop_policy=DropPolicy.LATEST_ONLY)
 
     # Start the runner (blocking)
     runner.exec()
@@ -14,7 +14,7 @@ setup(
     description="Helps physical rehab using the functional electric stimulation using the Lokomat",
     long_description=long_description,
     url="https://github.com/cr-crme/stimwalker",
-    packages=find_packages(),
+    packages=find_packages(exclude=["benchmarks", "benchmarks.*"]),
     license="LICENSE",
     keywords=[
         "Functional electric stimulation",
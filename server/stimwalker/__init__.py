@@ -1,5 +1,8 @@
 from .common.logger import setup_logger
 from .common import __version__
 from .common.data import Data
-from .runner import RunnerConsole, RunnerTcp
+from .common.dispatcher import DropPolicy
+from .common.metrics import metrics
+from .common.tracing import tracer
+from .runner import RunnerAsyncTcp, RunnerConsole, RunnerTcp
 from .scheduler.automatic_stimulation_rule import AutomaticStimulationRule, Side
@@ -0,0 +1,165 @@
+from abc import ABC, abstractmethod
+from datetime import datetime
+import heapq
+import itertools
+import threading
+import time
+from typing import Callable
+
+
+class TimerHandle:
+    """Handle on a callback scheduled with [Clock.call_later]"""
+
+    def __init__(self, cancel: Callable[[], None] | None = None) -> None:
+        self._cancel = cancel
+        self._is_cancelled = False
+
+    @property
+    def is_cancelled(self) -> bool:
+        """Whether the callback was cancelled"""
+        return self._is_cancelled
+
+    def cancel(self) -> None:
+        """Cancel the callback (this has no effect if it was already called)"""
+        self._is_cancelled = True
+        if self._cancel is not None:
+            self._cancel()
+
+
+class Clock(ABC):
+    """Source of time of the devices, the scheduler and the runners.
+
+    Everything that reads the time or waits goes through a clock, so the same code can run in wall-clock time
+    ([SystemClock]) or in a simulated time that advances as fast as the CPU allows ([VirtualClock]).
+    """
+
+    @property
+    @abstractmethod
+    def is_virtual(self) -> bool:
+        """Whether the time is simulated. When it is, nothing should wait on threads for the time to pass: the waits
+        are expressed with [call_later] and the time is advanced by the owner of the clock"""
+
+    @abstractmethod
+    def now(self) -> float:
+        """Get the current time (in datetime.timestamp() units, i.e. seconds since the epoch)"""
+
+    @abstractmethod
+    def perf_counter(self) -> float:
+        """Get a monotonic time (in seconds) suited to measure durations"""
+
+    @abstractmethod
+    def sleep(self, seconds: float) -> None:
+        """Wait for [seconds] seconds"""
+
+    @abstractmethod
+    def call_later(self, delay: float, callback: Callable[[], None]) -> TimerHandle:
+        """Call [callback] in [delay] seconds.
+
+        Parameters
+        ----------
+        delay : float
+            Time to wait (in seconds) before calling the callback.
+        callback : Callable[[], None]
+            The function to call.
+
+        Returns
+        -------
+        out : TimerHandle
+            A handle to cancel the call.
+        """
+
+
+class SystemClock(Clock):
+    """The wall clock of the host"""
+
+    @property
+    def is_virtual(self) -> bool:
+        return False
+
+    def now(self) -> float:
+        return datetime.now().timestamp()
+
+    def perf_counter(self) -> float:
+        return time.perf_counter()
+
+    def sleep(self, seconds: float) -> None:
+        time.sleep(seconds)
+
+    def call_later(self, delay: float, callback: Callable[[], None]) -> TimerHandle:
+        timer = threading.Timer(delay, callback)
+        timer.daemon = True
+        timer.start()
+        return TimerHandle(cancel=timer.cancel)
+
+
+class VirtualClock(Clock):
+    """A simulated clock. The time only moves when [advance] (or [sleep]) is called, and the callbacks that fall due are
+    then called, in order of their due time, from the thread that advances the clock. A whole session can therefore
+    run deterministically and as fast as the CPU allows.
+    """
+
+    def __init__(self, start: float = 0.0) -> None:
+        """
+        Parameters
+        ----------
+        start : float
+            The initial time (in datetime.timestamp() units).
+        """
+        self._start = start
+        self._time = start
+        self._timers: list[tuple[float, int, TimerHandle, Callable[[], None]]] = []
+        self._sequence = itertools.count()  # Keeps the callbacks due at the same time in the order they were scheduled
+        self._mutex = threading.Lock()
+
+    @property
+    def is_virtual(self) -> bool:
+        return True
+
+    def now(self) -> float:
+        return self._time
+
+    def perf_counter(self) -> float:
+        return self._time - self._start
+
+    def sleep(self, seconds: float) -> None:
+        """Advance the time by [seconds] seconds (a sleeping scenario thus runs instantly)"""
+        self.advance(seconds)
+
+    def call_later(self, delay: float, callback: Callable[[], None]) -> TimerHandle:
+        handle = TimerHandle()
+        self._mutex.acquire()
+        heapq.heappush(self._timers, (self._time + max(delay, 0), next(self._sequence), handle, callback))
+        self._mutex.release()
+        return handle
+
+    @property
+    def pending_calls(self) -> int:
+        """Number of callbacks that are scheduled (including the cancelled ones that did not fall due yet)"""
+        return len(self._timers)
+
+    def advance(self, duration: float) -> None:
+        """Move the time forward, calling the callbacks as they fall due (a callback can schedule other callbacks, they
+        are called too if they fall due before the end of the advance).
+
+        Parameters
+        ----------
+        duration : float
+            The time (in seconds) to move forward.
+        """
+        if duration < 0:
+            raise ValueError("The time cannot go backward")
+
+        target = self._time + duration
+        while True:
+            self._mutex.acquire()
+            if not self._timers or self._timers[0][0] > target:
+                self._mutex.release()
+                break
+            due, _, handle, callback = heapq.heappop(self._timers)
+            self._mutex.release()
+
+            if handle.is_cancelled:
+                continue
+            self._time = max(self._time, due)
+            callback()
+        self._time = target
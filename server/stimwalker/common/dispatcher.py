@@ -0,0 +1,517 @@
+from collections import deque
+from enum import Enum, auto
+import logging
+import queue
+import threading
+import time
+from typing import Any, Callable
+
+from .metrics import metrics
+from .tracing import tracer
+
+_logger = logging.getLogger("lokomat_fes")
+
+
+class DropPolicy(Enum):
+    """What a subscription does with a new block when its queue is full."""
+
+    LOSSLESS = auto()  # Block the dispatcher until the subscriber made room in the queue (no block is ever lost)
+    LATEST_ONLY = auto()  # Only keep the newest block, replacing (coalescing) the one waiting to be delivered, if any
+    DROP_OLDEST = auto()  # Discard the oldest queued block to make room for the new one
+    DROP_NEWEST = auto()  # Discard the new block and keep the queued ones
+
+
+class _SpscRingBuffer:
+    """Bounded single-producer/single-consumer ring buffer.
+
+    Only the producer writes [_tail] and only the consumer writes [_head]. As reading and writing these counters is
+    atomic under the GIL, neither side ever needs to take a lock (the producer is never blocked by the consumer).
+    """
+
+    def __init__(self, capacity: int) -> None:
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        self._capacity = capacity
+        self._items: list[Any] = [None] * capacity
+        self._head = 0  # Index of the next item to read (consumer only)
+        self._tail = 0  # Index of the next item to write (producer only)
+
+    def __len__(self) -> int:
+        return self._tail - self._head
+
+    @property
+    def capacity(self) -> int:
+        return self._capacity
+
+    def push(self, item: Any) -> bool:
+        """Push an item. Returns False (and does nothing) if the buffer is full."""
+        if self._tail - self._head >= self._capacity:
+            return False
+        self._items[self._tail % self._capacity] = item
+        self._tail += 1
+        return True
+
+    def pop(self) -> tuple[bool, Any]:
+        """Pop the oldest item. Returns (False, None) if the buffer is empty."""
+        if self._head == self._tail:
+            return False, None
+        index = self._head % self._capacity
+        item = self._items[index]
+        self._items[index] = None  # Do not keep a reference to delivered data
+        self._head += 1
+        return True, item
+
+
+class Subscription:
+    """A subscriber to a [DataDispatcher] with its own bounded queue and statistics.
+
+    Besides the blocks, the dispatcher carries events (e.g. the gaps of an acquisition), which go through the same
+    queue so they reach the subscriber in order with the blocks. The events take room in the queue like the blocks, but
+    they are never dropped (the blocks are dropped instead) nor decimated, and only the subscriptions with an
+    [event_callback] receive them.
+
+    Attributes
+    ----------
+    offered : int
+        Number of blocks that were pushed to the dispatcher while subscribed.
+    delivered : int
+        Number of blocks that were passed to the callback.
+    dropped : int
+        Number of blocks that were discarded because the queue was full.
+    coalesced : int
+        Number of blocks that were replaced by a newer one before being delivered (LATEST_ONLY policy).
+    decimated : int
+        Number of blocks that were skipped because of the decimation.
+    events : int
+        Number of events that were passed to the event callback.
+    errors : int
+        Number of times the callback raised an exception.
+    max_queue_depth : int
+        Highest number of blocks that were waiting in the queue at the same time.
+    """
+
+    def __init__(
+        self,
+        callback: Callable[..., None] | None,
+        queue_size: int = 64,
+        drop_policy: DropPolicy = DropPolicy.LOSSLESS,
+        decimation: int = 1,
+        event_callback: Callable[..., None] | None = None,
+    ) -> None:
+        """
+        Parameters
+        ----------
+        callback : Callable[..., None] | None
+            The function to call with each block (None for a subscription to the events only).
+        queue_size : int
+            Maximum number of blocks waiting to be delivered to this subscriber (ignored for LATEST_ONLY, which only
+            ever keeps one).
+        drop_policy : DropPolicy
+            What to do with a new block when the queue is full.
+        decimation : int
+            Only every [decimation]th block is offered to the subscriber (1 means every block).
+        event_callback : Callable[..., None] | None
+            The function to call with each event ([default] ignores the events).
+        """
+        if callback is None and event_callback is None:
+            raise ValueError("A subscription needs a callback or an event callback")
+        if queue_size < 1:
+            raise ValueError("queue_size must be at least 1")
+        if decimation < 1:
+            raise ValueError("decimation must be at least 1")
+
+        self._callback = callback
+        self._event_callback = event_callback
+        subscriber = callback if callback is not None else event_callback
+        callback_name = getattr(subscriber, "__qualname__", type(subscriber).__name__)
+        self._span_name = f"subscriber {callback_name}"
+        self._callback_time_histogram = metrics.histogram(
+            "stimwalker_subscriber_callback_seconds",
+            "Time spent in the data subscriber callbacks",
+            labels={"subscriber": callback_name},
+        )
+        self._drop_policy = drop_policy
+        self._queue_size = 1 if drop_policy == DropPolicy.LATEST_ONLY else queue_size
+        self._decimation = decimation
+        self._queue: deque[tuple[float, tuple, bool]] = deque()  # (pushed at, block or event, is event)
+        self._is_active = True
+
+        # Whether the subscription is waiting in (or being serviced from) the ready queue of the dispatcher
+        self._is_scheduled = False
+        self._schedule_mutex = threading.Lock()
+        self._space_available = threading.Condition(self._schedule_mutex)
+
+        self.offered = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.decimated = 0
+        self.events = 0
+        self.errors = 0
+        self.max_queue_depth = 0
+        self._total_callback_time = 0.0
+        self._max_callback_time = 0.0
+        self._total_latency = 0.0
+        self._max_latency = 0.0
+
+    @property
+    def callback(self) -> Callable[..., None] | None:
+        return self._callback
+
+    @property
+    def event_callback(self) -> Callable[..., None] | None:
+        return self._event_callback
+
+    @property
+    def queue_size(self) -> int:
+        return self._queue_size
+
+    @property
+    def drop_policy(self) -> DropPolicy:
+        return self._drop_policy
+
+    @property
+    def decimation(self) -> int:
+        return self._decimation
+
+    @property
+    def pending(self) -> int:
+        """Number of blocks waiting to be delivered"""
+        return len(self._queue)
+
+    @property
+    def statistics(self) -> dict[str, float]:
+        """Delivery statistics of the subscription. Times are in seconds."""
+        delivered = max(self.delivered, 1)
+        return {
+            "offered": self.offered,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "decimated": self.decimated,
+            "events": self.events,
+            "errors": self.errors,
+            "pending": self.pending,
+            "queue_size": self._queue_size,
+            "max_queue_depth": self.max_queue_depth,
+            "mean_callback_time": self._total_callback_time / delivered,
+            "max_callback_time": self._max_callback_time,
+            "mean_latency": self._total_latency / delivered,
+            "max_latency": self._max_latency,
+        }
+
+    def _offer(self, pushed_at: float, block: tuple, is_event: bool = False) -> bool:
+        """Queue a block or an event for delivery (fan-out thread only).
+
+        Returns
+        -------
+        out : bool
+            True if the subscription must be put in the ready queue of the dispatcher.
+        """
+        if is_event:
+            if self._event_callback is None:
+                return False
+            return self._enqueue(pushed_at, block, is_event=True)  # Never dropped, there are few of them
+
+        if self._callback is None or self._skip_by_decimation():
+            return False
+
+        if len(self._queue) >= self._queue_size:
+            if self._drop_policy == DropPolicy.LOSSLESS:
+                with self._space_available:
+                    while len(self._queue) >= self._queue_size and self._is_active:
+                        self._space_available.wait(timeout=0.1)
+                if not self._is_active:
+                    return False
+            elif self._drop_policy == DropPolicy.DROP_NEWEST:
+                self.dropped += 1
+                return False
+            elif self._drop_oldest_block():
+                if self._drop_policy == DropPolicy.LATEST_ONLY:
+                    self.coalesced += 1
+                else:
+                    self.dropped += 1
+        return self._enqueue(pushed_at, block, is_event=False)
+
+    def _drop_oldest_block(self) -> bool:
+        """Remove the oldest block waiting (the events stay). Returns False if the worker emptied the queue."""
+        with self._schedule_mutex:  # So the worker does not pop in the meantime
+            for index, (_, _, is_event) in enumerate(self._queue):
+                if not is_event:
+                    del self._queue[index]
+                    return True
+        return False
+
+    def _enqueue(self, pushed_at: float, item: tuple, is_event: bool) -> bool:
+        self._queue.append((pushed_at, item, is_event))
+        self.max_queue_depth = max(self.max_queue_depth, len(self._queue))
+
+        with self._schedule_mutex:
+            if self._is_scheduled:
+                return False
+            self._is_scheduled = True
+            return True
+
+    def _skip_by_decimation(self) -> bool:
+        """Count the offered block and tell whether it must be skipped because of the decimation."""
+        self.offered += 1
+        if (self.offered - 1) % self._decimation != 0:
+            self.decimated += 1
+            return True
+        return False
+
+    def _deliver_pending(self) -> None:
+        """Deliver all the queued blocks (worker thread only)."""
+        while True:
+            with self._schedule_mutex:
+                if not self._queue:
+                    self._is_scheduled = False
+                    return
+                pushed_at, block, is_event = self._queue.popleft()
+            if self._drop_policy == DropPolicy.LOSSLESS:
+                with self._space_available:
+                    self._space_available.notify()
+            if is_event:
+                self._deliver_event(block)
+            else:
+                self._deliver(pushed_at, block)
+
+    def _deactivate(self) -> None:
+        """Discard the pending blocks and release the dispatcher if it waits for room in the queue."""
+        self._is_active = False
+        self._queue.clear()
+        with self._space_available:
+            self._space_available.notify_all()
+
+    def _deliver_event(self, event: tuple) -> None:
+        """Call the event callback (worker thread only)."""
+        try:
+            self._event_callback(*event)
+        except Exception:
+            self.errors += 1
+            _logger.exception(f"Error in event subscriber {self._event_callback}")
+        self.events += 1
+
+    def _deliver(self, pushed_at: float, block: tuple) -> None:
+        """Call the callback and update the timing statistics."""
+        started_at = time.perf_counter()
+        try:
+            with tracer.span(self._span_name, category="dispatcher"):
+                self._callback(*block)
+        except Exception:
+            self.errors += 1
+            _logger.exception(f"Error in data subscriber {self._callback}")
+        finished_at = time.perf_counter()
+
+        self.delivered += 1
+        callback_time = finished_at - started_at
+        self._callback_time_histogram.observe(callback_time)
+        self._total_callback_time += callback_time
+        self._max_callback_time = max(self._max_callback_time, callback_time)
+        latency = finished_at - pushed_at
+        self._total_latency += latency
+        self._max_latency = max(self._max_latency, latency)
+
+
+class DataDispatcher:
+    """Fan out data blocks from a producer (e.g. the acquisition callback) to any number of subscribers.
+
+    The producer only pushes the block into a bounded lock-free ring buffer, so it never waits for the subscribers.
+    A fan-out thread moves each block into the queue of every subscription, and a pool of worker threads calls the
+    subscribers. A subscription is serviced by one worker at a time (so blocks arrive in order), while a slow subscriber
+    only ties up one worker. Note that a full LOSSLESS subscription blocks the fan-out thread (hence all the other
+    subscriptions), so slow consumers that can afford losing blocks should use another [DropPolicy].
+    If the dispatcher is not started, the blocks are delivered synchronously by [push].
+    """
+
+    def __init__(self, name: str = "dispatcher", capacity: int = 64, num_workers: int = 2) -> None:
+        """
+        Parameters
+        ----------
+        name : str
+            Name of the dispatcher (used to name the threads).
+        capacity : int
+            Maximum number of blocks waiting to be fanned out. When full, new blocks are dropped at the source.
+        num_workers : int
+            Number of threads that call the subscribers.
+        """
+        if num_workers < 1:
+            raise ValueError("num_workers must be at least 1")
+
+        self._name = name
+        self._num_workers = num_workers
+        self._ring = _SpscRingBuffer(capacity)
+        self._has_data = threading.Event()
+
+        self._subscriptions: tuple[Subscription, ...] = ()  # Copy-on-write, so the fan-out can iterate without lock
+        self._subscriptions_mutex = threading.Lock()
+
+        self._ready: queue.SimpleQueue[Subscription | None] = queue.SimpleQueue()
+        self._fan_out_thread: threading.Thread | None = None
+        self._worker_threads: list[threading.Thread] = []
+        self._exit_flag = False
+
+        self.pushed = 0
+        self.dropped_at_source = 0
+
+    @property
+    def is_running(self) -> bool:
+        """Whether the dispatcher threads are running"""
+        return self._fan_out_thread is not None
+
+    @property
+    def subscriptions(self) -> tuple[Subscription, ...]:
+        return self._subscriptions
+
+    @property
+    def pending(self) -> int:
+        """Number of blocks waiting to be fanned out"""
+        return len(self._ring)
+
+    @property
+    def capacity(self) -> int:
+        """Maximum number of blocks waiting to be fanned out before new blocks are dropped at the source"""
+        return self._ring.capacity
+
+    def subscribe(self, subscription: Subscription) -> Subscription:
+        """Add a subscription. Returns the subscription for convenience."""
+        with self._subscriptions_mutex:
+            self._subscriptions = self._subscriptions + (subscription,)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        """Remove a subscription. Blocks that are still queued for it are not delivered."""
+        with self._subscriptions_mutex:
+            self._subscriptions = tuple(s for s in self._subscriptions if s is not subscription)
+        subscription._deactivate()
+
+    def push(self, *block: Any) -> bool:
+        """Push a block to be delivered to all the subscribers. This never blocks.
+
+        Returns
+        -------
+        out : bool
+            False if the block was dropped because the dispatcher is overrun.
+        """
+        self.pushed += 1
+        pushed_at = time.perf_counter()
+
+        if not self.is_running:
+            for subscription in self._subscriptions:
+                if subscription.callback is not None and not subscription._skip_by_decimation():
+                    subscription._deliver(pushed_at, block)
+            return True
+
+        if not self._ring.push((pushed_at, block, False)):
+            self.dropped_at_source += 1
+            return False
+        self._has_data.set()
+        return True
+
+    def push_event(self, *event: Any) -> None:
+        """Push an event to be delivered to the subscribers with an event callback, in order with the blocks pushed
+        before and after it. Contrary to the blocks, an event is never dropped: if the ring is full, this waits for the
+        fan-out thread to make room."""
+        if not self.is_running:
+            for subscription in self._subscriptions:
+                if subscription.event_callback is not None:
+                    subscription._deliver_event(event)
+            return
+
+        while not self._ring.push((time.perf_counter(), event, True)) and self.is_running:
+            self._has_data.set()
+            time.sleep(0.0005)
+        self._has_data.set()
+
+    def start(self) -> None:
+        """Start the fan-out and worker threads"""
+        if self.is_running:
+            raise RuntimeError("The dispatcher is already running")
+
+        self._exit_flag = False
+        self._worker_threads = [
+            threading.Thread(target=self._run_worker, name=f"{self._name} worker {i}", daemon=True)
+            for i in range(self._num_workers)
+        ]
+        for thread in self._worker_threads:
+            thread.start()
+        self._fan_out_thread = threading.Thread(target=self._run_fan_out, name=f"{self._name} fan-out", daemon=True)
+        self._fan_out_thread.start()
+
+    def stop(self, timeout: float | None = 1.0) -> None:
+        """Deliver the pending blocks (waiting at most [timeout] seconds) and stop the threads"""
+        if not self.is_running:
+            return
+
+        self.flush(timeout=timeout)
+        self._exit_flag = True
+        self._has_data.set()
+        self._fan_out_thread.join()
+        for _ in self._worker_threads:
+            self._ready.put(None)
+        for thread in self._worker_threads:
+            thread.join()
+
+        self._fan_out_thread = None
+        self._worker_threads = []
+
+    def flush(self, timeout: float | None = None) -> bool:
+        """Wait until all the pushed blocks are delivered.
+
+        Parameters
+        ----------
+        timeout : float | None
+            Maximum time to wait in seconds. If None, wait forever.
+
+        Returns
+        -------
+        out : bool
+            True if everything was delivered, False on timeout or if called from a dispatcher thread (which would
+            otherwise wait for itself).
+        """
+        if not self.is_running:
+            return True
+        if threading.current_thread() in (self._fan_out_thread, *self._worker_threads):
+            return False
+
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        while len(self._ring) > 0 or any(s.pending or s._is_scheduled for s in self._subscriptions):
+            if deadline is not None and time.perf_counter() > deadline:
+                return False
+            time.sleep(0.0005)
+        return True
+
+    @property
+    def statistics(self) -> dict[str, Any]:
+        """Statistics of the dispatcher and of each subscription"""
+        return {
+            "pushed": self.pushed,
+            "dropped_at_source": self.dropped_at_source,
+            "pending": self.pending,
+            "capacity": self.capacity,
+            "subscriptions": [subscription.statistics for subscription in self._subscriptions],
+        }
+
+    def _run_fan_out(self) -> None:
+        """Move the blocks from the ring buffer to the queue of each subscription"""
+        while not self._exit_flag:
+            self._has_data.wait(timeout=0.1)
+            self._has_data.clear()  # Clear before draining, so a push during the draining wakes us up again
+
+            while True:
+                has_item, item = self._ring.pop()
+                if not has_item:
+                    break
+                pushed_at, block, is_event = item
+                for subscription in self._subscriptions:
+                    if subscription._offer(pushed_at, block, is_event):
+                        self._ready.put(subscription)
+                del item, block  # Do not hold on to the last block while waiting for the next one
+
+    def _run_worker(self) -> None:
+        """Deliver the blocks of the subscriptions that are ready"""
+        while True:
+            subscription = self._ready.get()
+            if subscription is None:
+                break
+            subscription._deliver_pending()
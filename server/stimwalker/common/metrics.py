@@ -0,0 +1,400 @@
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import logging
+import math
+import threading
+from typing import Any, Callable
+import weakref
+
+_logger = logging.getLogger("lokomat_fes")
+
+# Upper bounds (in seconds) of the buckets of the histograms of durations, from 10 us to 1 s
+DEFAULT_TIME_BUCKETS = (1e-5, 5e-5, 1e-4, 5e-4, 1e-3, 2e-3, 5e-3, 1e-2, 2e-2, 5e-2, 0.1, 0.2, 0.5, 1.0)
+
+
+class _Metric(ABC):
+    """Base of the metrics: a name, a description and optional labels"""
+
+    kind = ""
+
+    def __init__(self, name: str, description: str, labels: dict[str, str] | None = None) -> None:
+        self._name = name
+        self._description = description
+        self._labels = dict(labels) if labels else {}
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @property
+    def description(self) -> str:
+        return self._description
+
+    @property
+    def labels(self) -> dict[str, str]:
+        return self._labels
+
+    @property
+    def is_orphan(self) -> bool:
+        """Whether the metric was read from an object that no longer exists"""
+        return False
+
+    @abstractmethod
+    def _samples(self) -> list[tuple[str, dict[str, str], float]]:
+        """The (name, labels, value) of each sample of the metric"""
+
+
+class _ValueMetric(_Metric):
+    """Base of the metrics holding a single value, either kept by the metric or read from a [function].
+
+    A function reading the state of an [owner] (e.g. a runner) is called with the owner, which is only referenced
+    weakly: the registry does not keep the owner alive, and forgets the metric once the owner is garbage collected.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        labels: dict[str, str] | None = None,
+        function: Callable[..., float] | None = None,
+        owner: Any = None,
+    ) -> None:
+        super().__init__(name, description, labels)
+        self._value = 0
+        self._function = None
+        self._owner = None
+        self._set_function(function, owner)
+
+    def _set_function(self, function: Callable[..., float] | None, owner: Any) -> None:
+        self._function = function
+        self._owner = weakref.ref(owner) if owner is not None else None
+
+    @property
+    def value(self) -> float:
+        if self._function is None:
+            return self._value
+        if self._owner is None:
+            return self._function()
+        owner = self._owner()
+        if owner is None:
+            return self._value
+        return self._function(owner)
+
+    @property
+    def is_orphan(self) -> bool:
+        return self._owner is not None and self._owner() is None
+
+    def _samples(self) -> list[tuple[str, dict[str, str], float]]:
+        return [(self._name, self._labels, self.value)]
+
+
+class Counter(_ValueMetric):
+    """A value that only goes up (e.g. the number of blocks acquired).
+
+    It is either incremented where the event happens (an addition, cheap enough for the hot path), or read from a
+    [function] when the metrics are collected (for the counters the components already keep).
+    """
+
+    kind = "counter"
+
+    def inc(self, amount: float = 1) -> None:
+        """Increment the counter by [amount]"""
+        self._value += amount
+
+
+class Gauge(_ValueMetric):
+    """A value that goes up and down (e.g. the number of blocks waiting to be delivered).
+
+    It is either set where the value changes, or read from a [function] when the metrics are collected.
+    """
+
+    kind = "gauge"
+
+    def set(self, value: float) -> None:
+        """Set the value of the gauge"""
+        self._value = value
+
+    def inc(self, amount: float = 1) -> None:
+        """Increment the gauge by [amount] (which can be negative)"""
+        self._value += amount
+
+
+class Histogram(_Metric):
+    """The distribution of observed values (e.g. the duration of the callbacks) in fixed buckets.
+
+    Observing a value is a binary search in the bounds of the buckets and two additions.
+    """
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        labels: dict[str, str] | None = None,
+        buckets: tuple[float, ...] = DEFAULT_TIME_BUCKETS,
+    ) -> None:
+        super().__init__(name, description, labels)
+        if list(buckets) != sorted(buckets) or len(buckets) == 0:
+            raise ValueError("The buckets must be a non-empty sorted sequence of upper bounds")
+        self._bounds = tuple(float(bound) for bound in buckets)
+        self._counts = [0] * (len(self._bounds) + 1)  # The last one is for the values above the last bound
+        self._sum = 0.0
+
+    def observe(self, value: float) -> None:
+        """Record a value"""
+        self._counts[bisect_left(self._bounds, value)] += 1
+        self._sum += value
+
+    @property
+    def count(self) -> int:
+        """Number of values observed"""
+        return sum(self._counts)
+
+    @property
+    def sum(self) -> float:
+        """Sum of the values observed"""
+        return self._sum
+
+    @property
+    def buckets(self) -> dict[float, int]:
+        """Cumulative number of values observed below or at each bound (the last bound is infinity)"""
+        out = {}
+        total = 0
+        for bound, count in zip((*self._bounds, math.inf), list(self._counts)):
+            total += count
+            out[bound] = total
+        return out
+
+    def _samples(self) -> list[tuple[str, dict[str, str], float]]:
+        samples = [
+            (f"{self._name}_bucket", {**self._labels, "le": _format_value(bound)}, count)
+            for bound, count in self.buckets.items()
+        ]
+        count = samples[-1][2]  # The +Inf bucket, so the count is consistent with the buckets
+        samples.append((f"{self._name}_sum", self._labels, self._sum))
+        samples.append((f"{self._name}_count", self._labels, count))
+        return samples
+
+
+class MetricsRegistry:
+    """The runtime metrics of the server (counters, gauges and histograms), by name and labels.
+
+    Asking for a metric that already exists returns it, so the components can ask for their metrics without caring
+    about who created them first. Asking again for a metric read from a function replaces the function (e.g. the
+    metrics of a new runner replace the ones of the previous runner). A metric read from an owner is forgotten once
+    its owner is garbage collected.
+
+    The metrics can be rendered in the Prometheus text format (for the HTTP endpoint) or as a dictionary.
+    """
+
+    def __init__(self) -> None:
+        self._metrics: dict[tuple[str, tuple[tuple[str, str], ...]], _Metric] = {}
+        self._mutex = threading.Lock()
+
+    def counter(
+        self,
+        name: str,
+        description: str,
+        labels: dict[str, str] | None = None,
+        function: Callable[..., float] | None = None,
+        owner: Any = None,
+    ) -> Counter:
+        """Get (or create) a counter, see [Counter] ([function] is called with [owner] if one is given)"""
+        return self._get_or_create(Counter, name, description, labels, function=function, owner=owner)
+
+    def gauge(
+        self,
+        name: str,
+        description: str,
+        labels: dict[str, str] | None = None,
+        function: Callable[..., float] | None = None,
+        owner: Any = None,
+    ) -> Gauge:
+        """Get (or create) a gauge, see [Gauge] ([function] is called with [owner] if one is given)"""
+        return self._get_or_create(Gauge, name, description, labels, function=function, owner=owner)
+
+    def histogram(
+        self,
+        name: str,
+        description: str,
+        labels: dict[str, str] | None = None,
+        buckets: tuple[float, ...] = DEFAULT_TIME_BUCKETS,
+    ) -> Histogram:
+        """Get (or create) a histogram, see [Histogram]"""
+        return self._get_or_create(Histogram, name, description, labels, buckets=buckets)
+
+    def unregister(self, name: str, labels: dict[str, str] | None = None) -> None:
+        """Remove a metric (does nothing if it does not exist)"""
+        self._mutex.acquire()
+        self._metrics.pop(_key(name, labels), None)
+        self._mutex.release()
+
+    def clear(self) -> None:
+        """Remove all the metrics"""
+        self._mutex.acquire()
+        self._metrics.clear()
+        self._mutex.release()
+
+    def get(self, name: str, labels: dict[str, str] | None = None) -> _Metric | None:
+        """Get a metric, or None if it does not exist"""
+        metric = self._metrics.get(_key(name, labels))
+        return None if metric is None or metric.is_orphan else metric
+
+    def _get_or_create(self, cls, name: str, description: str, labels: dict[str, str] | None, **kwargs) -> Any:
+        key = _key(name, labels)
+        self._mutex.acquire()
+        try:
+            metric = self._metrics.get(key)
+            if metric is None or metric.is_orphan:
+                metric = cls(name, description, labels, **kwargs)
+                self._metrics[key] = metric
+            elif not isinstance(metric, cls):
+                raise ValueError(f"The metric {name} already exists as a {metric.kind}")
+            elif kwargs.get("function") is not None:
+                metric._set_function(kwargs["function"], kwargs.get("owner"))
+        finally:
+            self._mutex.release()
+        return metric
+
+    def _sorted_metrics(self) -> list[_Metric]:
+        self._mutex.acquire()
+        for key in [key for key, metric in self._metrics.items() if metric.is_orphan]:
+            del self._metrics[key]
+        metrics = sorted(self._metrics.values(), key=lambda metric: (metric.name, sorted(metric.labels.items())))
+        self._mutex.release()
+        return metrics
+
+    def serialize(self) -> dict[str, Any]:
+        """The value of each metric, by name (the metrics with labels are lists of {labels, value})"""
+        out = {}
+        for metric in self._sorted_metrics():
+            if isinstance(metric, Histogram):
+                value = {
+                    "count": metric.count,
+                    "sum": metric.sum,
+                    "buckets": {_format_value(bound): count for bound, count in metric.buckets.items()},
+                }
+            else:
+                value = _safe_value(metric)
+            if metric.labels:
+                out.setdefault(metric.name, []).append({"labels": metric.labels, "value": value})
+            else:
+                out[metric.name] = value
+        return out
+
+    def render_text(self) -> str:
+        """The metrics in the Prometheus text exposition format"""
+        lines = []
+        described = set()
+        for metric in self._sorted_metrics():
+            if metric.name not in described:
+                described.add(metric.name)
+                lines.append(f"# HELP {metric.name} {metric.description}")
+                lines.append(f"# TYPE {metric.name} {metric.kind}")
+            try:
+                samples = metric._samples()
+            except Exception:
+                _logger.exception(f"Error while collecting the metric {metric.name}")
+                continue
+            for name, labels, value in samples:
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+class MetricsHttpServer:
+    """Local HTTP endpoint serving the metrics in the Prometheus text format (GET /metrics), from a daemon thread"""
+
+    def __init__(self, registry: MetricsRegistry | None = None, host: str = "localhost", port: int = 9042) -> None:
+        """
+        Parameters
+        ----------
+        registry : MetricsRegistry | None
+            The metrics to serve ([default] is the metrics of the server).
+        host : str
+            The address to listen on (keep it local, the metrics are not authenticated).
+        port : int
+            The port to listen on (0 picks a free port).
+        """
+        self._registry = registry if registry is not None else metrics
+        self._host = host
+        self._port = port
+        self._server: ThreadingHTTPServer | None = None
+        self._thread: threading.Thread | None = None
+
+    @property
+    def port(self) -> int:
+        """The port listened on (the one picked if 0 was asked)"""
+        return self._server.server_address[1] if self._server is not None else self._port
+
+    @property
+    def is_running(self) -> bool:
+        return self._server is not None
+
+    def start(self) -> None:
+        if self.is_running:
+            raise RuntimeError("The metrics server is already running")
+
+        registry = self._registry
+
+        class _Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = registry.render_text().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args) -> None:
+                _logger.debug(f"Metrics server: {format % args}")
+
+        self._server = ThreadingHTTPServer((self._host, self._port), _Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, name="MetricsHttpServer", daemon=True)
+        self._thread.start()
+        _logger.info(f"Serving the metrics on http://{self._host}:{self.port}/metrics")
+
+    def stop(self) -> None:
+        if not self.is_running:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+        self._server = None
+        self._thread = None
+
+
+def _key(name: str, labels: dict[str, str] | None) -> tuple[str, tuple[tuple[str, str], ...]]:
+    return name, tuple(sorted(labels.items())) if labels else ()
+
+
+def _safe_value(metric: Counter | Gauge) -> float | None:
+    """The value of a metric, or None if the function reading it fails (e.g. the device is gone)"""
+    try:
+        return metric.value
+    except Exception:
+        _logger.exception(f"Error while collecting the metric {metric.name}")
+        return None
+
+
+def _format_labels(labels: dict[str, str]) -> str:
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in labels.values())
+    return "{" + ",".join(f'{key}="{value}"' for key, value in zip(labels.keys(), escaped)) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return str(value)
+
+
+# The metrics of the server, shared by all the instrumented components
+metrics = MetricsRegistry()
@@ -0,0 +1,267 @@
+from collections import Counter
+import logging
+import marshal
+import os
+import sys
+import threading
+import time
+from types import FrameType
+from typing import Any
+
+_logger = logging.getLogger("lokomat_fes")
+
+
+def find_thread(name: str) -> threading.Thread:
+    """Find a running thread by its name (case insensitive, as the console lowers the commands)
+
+    Parameters
+    ----------
+    name : str
+        The name of the thread.
+    """
+    for thread in threading.enumerate():
+        if thread.name.lower() == name.lower():
+            return thread
+    names = ", ".join(thread.name for thread in threading.enumerate())
+    raise ValueError(f"There is no thread named {name} (the threads are: {names})")
+
+
+class ThreadProfiler:
+    """Deterministic profiler of one running thread (e.g. the scheduler), attached to and detached from the live process.
+
+    Since Python 3.12, cProfile sees the calls of every thread, so it cannot tell the thread of interest apart. Instead,
+    a profiling function is installed on all the threads, which immediately removes itself from every thread but the
+    profiled one. Each call and return of the profiled thread is then timed, which gives exact call counts but slows
+    that thread down (the other threads run at full speed).
+
+    The stats are written in the format of [pstats], so they can be read with [pstats.Stats] or tools like snakeviz.
+    """
+
+    def __init__(self, thread: threading.Thread | str) -> None:
+        """
+        Parameters
+        ----------
+        thread : threading.Thread | str
+            The thread to profile (or its name).
+        """
+        self._thread = find_thread(thread) if isinstance(thread, str) else thread
+        self._is_running = False
+        self._started_at: float | None = None
+        self._duration = 0.0
+
+        # Stats by function: [primitive calls, calls, own time, cumulative time, {caller: calls}]
+        self.stats: dict[tuple[str, int, str], Any] = {}
+        self._entries: dict[tuple[str, int, str], list] = {}
+        self._stack: list[list] = []  # [function, started at, time spent in the sub-calls]
+        self._active: Counter = Counter()  # Number of times each function is on the stack (to detect recursion)
+
+    @property
+    def thread_name(self) -> str:
+        return self._thread.name
+
+    @property
+    def is_running(self) -> bool:
+        return self._is_running
+
+    def start(self) -> None:
+        if self._is_running:
+            raise RuntimeError("The profiler is already running")
+        if not self._thread.is_alive():
+            raise RuntimeError(f"The thread {self._thread.name} is not running")
+
+        _logger.info(f"Starting to profile the thread {self._thread.name}")
+        target = self._thread.ident
+
+        def install(frame: FrameType, event: str, arg: Any) -> None:
+            if threading.get_ident() == target:
+                sys.setprofile(self._dispatch)
+                self._dispatch(frame, event, arg)
+            else:
+                sys.setprofile(None)
+
+        # Fresh stacks, the calls that did not return during the previous session are left out
+        self._stack = []
+        self._active = Counter()
+        self._started_at = time.perf_counter()
+        self._is_running = True
+        threading.setprofile_all_threads(install)
+
+    def stop(self) -> None:
+        if not self._is_running:
+            return
+        threading.setprofile_all_threads(None)
+        self._is_running = False
+        self._duration += time.perf_counter() - self._started_at
+        self.create_stats()
+        _logger.info(f"Stopped profiling the thread {self._thread.name}")
+
+    def create_stats(self) -> None:
+        """Convert the measures to the format of [pstats] (called by [pstats.Stats])"""
+        self.stats = {
+            function: (primitive_calls, calls, own_time, cumulative_time, dict(callers))
+            for function, (primitive_calls, calls, own_time, cumulative_time, callers) in list(self._entries.items())
+        }
+
+    @property
+    def statistics(self) -> dict[str, Any]:
+        """A summary of the session"""
+        return {
+            "thread": self._thread.name,
+            "duration": self._duration,
+            "functions": len(self._entries),
+            "calls": sum(entry[1] for entry in list(self._entries.values())),
+        }
+
+    def write(self, path: str) -> None:
+        """Write the stats to [path] in the format of [pstats] (stop the profiler first)
+
+        Parameters
+        ----------
+        path : str
+            The path of the file to write.
+        """
+        if self._is_running:
+            raise RuntimeError("Stop the profiler before writing its stats")
+        with open(path, "wb") as f:
+            marshal.dump(self.stats, f)
+        _logger.info(f"Profile of the thread {self._thread.name} written to {path}")
+
+    def _dispatch(self, frame: FrameType, event: str, arg: Any) -> None:
+        now = time.perf_counter()
+        if event == "call":
+            code = frame.f_code
+            self._push((code.co_filename, code.co_firstlineno, code.co_qualname), now)
+        elif event == "c_call":
+            self._push(("~", 0, f"<built-in method {getattr(arg, '__qualname__', arg)}>"), now)
+        elif self._stack:  # A return (of a call that started after the profiling, otherwise the stack is empty)
+            function, started_at, sub_calls_time = self._stack.pop()
+            self._active[function] -= 1
+            elapsed = now - started_at
+
+            entry = self._entries.get(function)
+            if entry is None:
+                entry = self._entries[function] = [0, 0, 0.0, 0.0, {}]
+            entry[1] += 1
+            entry[2] += elapsed - sub_calls_time
+            if self._active[function] == 0:
+                # Only the outermost call of a recursion counts as primitive and in the cumulative time
+                entry[0] += 1
+                entry[3] += elapsed
+            if self._stack:
+                caller = self._stack[-1]
+                caller[2] += elapsed
+                entry[4][caller[0]] = entry[4].get(caller[0], 0) + 1
+
+    def _push(self, function: tuple[str, int, str], now: float) -> None:
+        self._active[function] += 1
+        self._stack.append([function, now, 0.0])
+
+
+class SamplingProfiler:
+    """Statistical profiler of all the threads, with a low overhead on the profiled threads.
+
+    A daemon thread takes a snapshot of the stack of every thread every [interval] seconds, and counts how many times
+    each stack was seen. The stacks are written in the "folded" format (one line per stack, from the thread down to the
+    function running, with the number of times it was seen), which flame graph tools (flamegraph.pl, speedscope,
+    https://www.speedscope.app) read directly.
+    """
+
+    def __init__(self, interval: float = 0.001) -> None:
+        """
+        Parameters
+        ----------
+        interval : float
+            Time between two samples in seconds.
+        """
+        if interval <= 0:
+            raise ValueError("The interval must be positive")
+
+        self._interval = interval
+        self._thread: threading.Thread | None = None
+        self._exit_flag = threading.Event()
+        self._stacks: Counter = Counter()
+        self._n_samples = 0
+        self._duration = 0.0
+
+    @property
+    def is_running(self) -> bool:
+        return self._thread is not None
+
+    def start(self) -> None:
+        if self.is_running:
+            raise RuntimeError("The profiler is already running")
+
+        _logger.info(f"Starting to sample the threads every {self._interval * 1000:g} ms")
+        self._exit_flag.clear()
+        self._thread = threading.Thread(target=self._run, name="SamplingProfiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if not self.is_running:
+            return
+        self._exit_flag.set()
+        self._thread.join()
+        self._thread = None
+        _logger.info(f"Stopped sampling the threads ({self._n_samples} samples)")
+
+    @property
+    def stacks(self) -> dict[str, int]:
+        """Number of times each stack was seen, in the folded format ("thread;outer function;...;inner function")"""
+        return dict(self._stacks)
+
+    @property
+    def statistics(self) -> dict[str, Any]:
+        """A summary of the session"""
+        return {
+            "samples": self._n_samples,
+            "duration": self._duration,
+            "interval": self._interval,
+            "achieved_interval": self._duration / self._n_samples if self._n_samples else None,
+            "stacks": len(self._stacks),
+        }
+
+    def write(self, path: str) -> None:
+        """Write the stacks to [path] in the folded format (stop the profiler first)
+
+        Parameters
+        ----------
+        path : str
+            The path of the file to write.
+        """
+        if self.is_running:
+            raise RuntimeError("Stop the profiler before writing its stacks")
+        with open(path, "w") as f:
+            for stack, count in self._stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        _logger.info(f"Sampled stacks written to {path}")
+
+    def _run(self) -> None:
+        own_ident = threading.get_ident()
+        started_at = time.perf_counter()
+        next_sample = started_at
+        while not self._exit_flag.is_set():
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                self._stacks[_fold(names.get(ident, f"thread {ident}"), frame)] += 1
+            self._n_samples += 1
+
+            # Sample on a fixed grid, skipping the samples the process was too busy to take
+            next_sample += self._interval
+            now = time.perf_counter()
+            if next_sample < now:
+                next_sample = now
+            self._exit_flag.wait(next_sample - now)
+        self._duration += time.perf_counter() - started_at
+
+
+def _fold(thread_name: str, frame: FrameType | None) -> str:
+    """The stack of [frame] in the folded format"""
+    functions = []
+    while frame is not None:
+        code = frame.f_code
+        functions.append(f"{code.co_qualname} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    functions.append(thread_name.replace(";", ":"))
+    return ";".join(reversed(functions))
@@ -0,0 +1,206 @@
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any
+
+_logger = logging.getLogger("lokomat_fes")
+
+
+class _NoOpSpan:
+    """Span returned while the tracer is disabled (shared, so disabled tracing allocates nothing)"""
+
+    __slots__ = ()
+
+    def __enter__(self) -> "_NoOpSpan":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        pass
+
+
+_NO_OP_SPAN = _NoOpSpan()
+
+
+class _Span:
+    """Span being measured, recorded in the ring of its tracer when it exits"""
+
+    __slots__ = ("_tracer", "_name", "_category", "_args", "_start")
+
+    def __init__(self, tracer: "Tracer", name: str, category: str, args: dict[str, Any] | None) -> None:
+        self._tracer = tracer
+        self._name = name
+        self._category = category
+        self._args = args
+        self._start = 0
+
+    def __enter__(self) -> "_Span":
+        self._start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._tracer._record(self._name, self._category, self._start, time.perf_counter_ns(), self._args)
+
+
+class Tracer:
+    """Record spans (named intervals of time, e.g. the reading of a block or a scheduler tick) of the server in a
+    fixed-size in-memory ring, to find where the time goes when a latency spike happens.
+
+    Tracing is disabled by default. A disabled tracer only costs a check of a flag per span. When enabled, a span costs
+    two reads of the performance counter and the write of one slot of the ring: once the ring is full, the oldest spans
+    are overwritten. The spans can be exported on demand to the Chrome trace-event JSON format, which can be opened in
+    chrome://tracing or https://ui.perfetto.dev.
+
+    Usage:
+        with tracer.span("nidaq.read", category="nidaq", n_samples=100):
+            ...
+    """
+
+    def __init__(self, capacity: int = 65536) -> None:
+        """
+        Parameters
+        ----------
+        capacity : int
+            Number of spans kept in the ring.
+        """
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+
+        self._capacity = capacity
+        self._is_enabled = False
+        self._ring: list[tuple | None] = [None] * capacity
+        self._next_slot = itertools.count()  # Thread-safe without a lock (the increment is atomic)
+        self._thread_names: dict[int, str] = {}
+
+    @property
+    def capacity(self) -> int:
+        """Number of spans kept in the ring"""
+        return self._capacity
+
+    @property
+    def is_enabled(self) -> bool:
+        """Whether the spans are recorded"""
+        return self._is_enabled
+
+    def enable(self) -> None:
+        """Start recording the spans"""
+        _logger.info("Tracing enabled")
+        self._is_enabled = True
+
+    def disable(self) -> None:
+        """Stop recording the spans (the spans already recorded are kept)"""
+        _logger.info("Tracing disabled")
+        self._is_enabled = False
+
+    def clear(self) -> None:
+        """Discard the spans recorded so far"""
+        self._ring = [None] * self._capacity
+        self._next_slot = itertools.count()
+
+    def span(self, name: str, category: str = "stimwalker", **args) -> _Span | _NoOpSpan:
+        """Measure the duration of the [with] block.
+
+        Parameters
+        ----------
+        name : str
+            The name of the span.
+        category : str
+            The category of the span (e.g. the device), to filter the spans in the viewer.
+        **args
+            Values attached to the span (e.g. the number of samples).
+        """
+        if not self._is_enabled:
+            return _NO_OP_SPAN
+        return _Span(self, name, category, args or None)
+
+    def record(self, name: str, start: int, category: str = "stimwalker", **args) -> None:
+        """Record a span that started at [start] and ends now, for an interval only worth keeping once it is over (e.g.
+        a check that is repeated continuously but rarely does something).
+
+        Parameters
+        ----------
+        name : str
+            The name of the span.
+        start : int
+            When the span started, in nanoseconds of the performance counter ([time.perf_counter_ns]).
+        category : str
+            The category of the span (e.g. the device), to filter the spans in the viewer.
+        **args
+            Values attached to the span (e.g. the number of samples).
+        """
+        if not self._is_enabled:
+            return
+        self._record(name, category, start, time.perf_counter_ns(), args or None)
+
+    def _record(self, name: str, category: str, start: int, end: int, args: dict[str, Any] | None) -> None:
+        thread_id = threading.get_ident()
+        if thread_id not in self._thread_names:
+            self._thread_names[thread_id] = threading.current_thread().name
+        self._ring[next(self._next_slot) % self._capacity] = (name, category, start, end - start, thread_id, args)
+
+    @property
+    def spans(self) -> list[dict[str, Any]]:
+        """The spans in the ring, from the oldest to the newest (times in nanoseconds of the performance counter)"""
+        spans = [span for span in list(self._ring) if span is not None]
+        spans.sort(key=lambda span: span[2])
+        return [
+            {
+                "name": name,
+                "category": category,
+                "start": start,
+                "duration": duration,
+                "thread": self._thread_names.get(thread_id, str(thread_id)),
+                "args": args or {},
+            }
+            for name, category, start, duration, thread_id, args in spans
+        ]
+
+    def to_chrome_trace(self) -> dict[str, Any]:
+        """The spans in the Chrome trace-event format (complete events, with microsecond timestamps)"""
+        pid = os.getpid()
+        spans = [span for span in list(self._ring) if span is not None]
+        spans.sort(key=lambda span: span[2])
+
+        events = [
+            {"name": "thread_name", "ph": "M", "pid": pid, "tid": thread_id, "args": {"name": thread_name}}
+            for thread_id, thread_name in list(self._thread_names.items())
+        ]
+        for name, category, start, duration, thread_id, args in spans:
+            event = {
+                "name": name,
+                "cat": category,
+                "ph": "X",
+                "ts": start / 1000,
+                "dur": duration / 1000,
+                "pid": pid,
+                "tid": thread_id,
+            }
+            if args:
+                event["args"] = {key: _to_json(value) for key, value in args.items()}
+            events.append(event)
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def export_chrome_trace(self, path: str) -> None:
+        """Write the spans to [path] in the Chrome trace-event JSON format
+
+        Parameters
+        ----------
+        path : str
+            The path of the file to write.
+        """
+        with open(path, "w") as f:
+            json.dump(self.to_chrome_trace(), f)
+        _logger.info(f"Trace exported to {path}")
+
+
+def _to_json(value: Any) -> Any:
+    """Make a value attached to a span serializable"""
+    if isinstance(value, (bool, int, float, str)) or value is None:
+        return value
+    return str(value)
+
+
+# The tracer of the server, shared by all the instrumented components
+tracer = Tracer()
@@ -1,3 +1,6 @@
 from .data import NiDaqData
+from .decimation import MinMaxDecimator
 from .devices import NiDaqGeneric
 from .lokomat_nidaq import NiDaqLokomat
+from .replay import NiDaqReplay
+from .synthetic import NiDaqSynthetic
@@ -19,6 +19,8 @@ class NiDaqData:
         List of time vectors.
     _data : list[np.ndarray]
         List of data vectors.
+    _gaps : list[tuple[float, int]]
+        List of the gaps in the data, each being (time of the first missing sample, number of missing samples).
     """
 
     def __init__(
@@ -26,6 +28,7 @@ class NiDaqData:
         t0: datetime | None = None,
         t: list[np.ndarray] | None = None,
         data: list[np.ndarray] | None = None,
+        gaps: list[tuple[float, int]] | None = None,
     ) -> None:
         """
         Parameters
@@ -36,12 +39,15 @@ class NiDaqData:
             List of time vectors.
         data : list[np.ndarray] | None
             List of data vectors.
+        gaps : list[tuple[float, int]] | None
+            List of the gaps in the data (time of the first missing sample, number of missing samples).
         """
         self._t0: float = None
         self.set_t0(new_t0=t0)
 
         self._t: list[np.ndarray] = [] if t is None else t
         self._data: list[np.ndarray] = [] if data is None else data
+        self._gaps: list[tuple[float, int]] = [] if gaps is None else gaps
 
     def set_t0(self, new_t0: datetime | None = None) -> None:
         """Reset the starting time of the recording.
@@ -84,6 +90,29 @@ class NiDaqData:
         self._t.append(t)
         self._data.append(data)
 
+    def add_gap(self, t: float, n_samples: int) -> None:
+        """Record that some samples were lost by the acquisition (e.g. the device buffer overran).
+
+        Parameters
+        ----------
+        t : float
+            Time of the first missing sample.
+        n_samples : int
+            Number of missing samples (per channel).
+        """
+        self._gaps.append((t, n_samples))
+
+    @property
+    def gaps(self) -> list[tuple[float, int]]:
+        """Get the gaps in the data.
+
+        Returns
+        -------
+        out : list[tuple[float, int]]
+            List of (time of the first missing sample, number of missing samples).
+        """
+        return list(self._gaps)
+
     def __len__(self) -> int:
         """Get the number of data blocks.
 
@@ -94,6 +123,17 @@ class NiDaqData:
         """
         return len(self._t)
 
+    @property
+    def nbytes(self) -> int:
+        """Get the memory held by the samples and their timestamps.
+
+        Returns
+        -------
+        out : int
+            Number of bytes.
+        """
+        return sum(t.nbytes for t in list(self._t)) + sum(data.nbytes for data in list(self._data))
+
     @property
     def has_data(self) -> bool:
         """Check if the data contains data.
@@ -109,6 +149,7 @@ class NiDaqData:
         """Clear the data."""
         self._t = []
         self._data = []
+        self._gaps = []
 
     def sample_block(self, index: int | slice, unsafe: bool = False) -> tuple[np.ndarray | None, np.ndarray | None]:
         """Get a block of data.
@@ -228,6 +269,7 @@ class NiDaqData:
         out._t0 = deepcopy(self._t0)
         out._t = deepcopy(self._t)
         out._data = deepcopy(self._data)
+        out._gaps = list(self._gaps)
         return out
 
     def save(self, path: str) -> None:
@@ -283,7 +325,7 @@ class NiDaqData:
             t = self._t
             data = self._data
 
-        return {"t0": self._t0, "t": t, "data": data}
+        return {"t0": self._t0, "t": t, "data": data, "gaps": [list(gap) for gap in self._gaps]}
 
     @classmethod
     def deserialize(cls, data: dict) -> "NiDaqData":
@@ -303,4 +345,5 @@ class NiDaqData:
         out._t0 = data["t0"]
         out._t = data["t"]
         out._data = data["data"]
+        out._gaps = [tuple(gap) for gap in data.get("gaps", [])]  # Files saved before gaps were recorded have none
         return out
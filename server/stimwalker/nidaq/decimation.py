@@ -0,0 +1,138 @@
+from typing import Sequence
+
+import numpy as np
+
+
+class MinMaxDecimator:
+    """Reduce the NiDaq blocks to a min/max envelope for display, incrementally as the blocks arrive.
+
+    The time is cut into buckets of [bucket_duration] seconds, and each bucket is summarized by two samples: the
+    minimum of each channel (at the time of the first sample of the bucket) followed by the maximum (at the time of the
+    last sample). Contrary to keeping one sample out of n, the peaks are never lost, whatever the decimation factor.
+
+    A bucket is only sent once a sample of a later bucket arrives (the blocks rarely end on a bucket boundary), so the
+    last bucket waits in the decimator until the next block, or until [flush] is called.
+
+    Attributes
+    ----------
+    samples_in : int
+        Number of samples (per channel) received.
+    samples_out : int
+        Number of samples (per channel) produced.
+    """
+
+    def __init__(self, bucket_duration: float, channels: Sequence[int] | None = None) -> None:
+        """
+        Parameters
+        ----------
+        bucket_duration : float
+            Duration summarized by each min/max pair in seconds.
+        channels : Sequence[int] | None
+            The channels to keep, in that order ([default] keeps all of them).
+        """
+        if bucket_duration <= 0:
+            raise ValueError("bucket_duration must be positive")
+        if channels is not None and len(channels) == 0:
+            raise ValueError("At least one channel must be kept")
+
+        self._bucket_duration = bucket_duration
+        self._channels = None if channels is None else list(channels)
+
+        # The bucket still receiving samples: (bucket index, first time, last time, minima, maxima)
+        self._pending: tuple[int, np.ndarray, np.ndarray, np.ndarray, np.ndarray] | None = None
+
+        self.samples_in = 0
+        self.samples_out = 0
+
+    @classmethod
+    def from_points_per_second(
+        cls, points_per_second: float, channels: Sequence[int] | None = None
+    ) -> "MinMaxDecimator":
+        """Create a decimator producing about [points_per_second] samples per second (two per bucket)"""
+        if points_per_second <= 0:
+            raise ValueError("points_per_second must be positive")
+        return cls(bucket_duration=2 / points_per_second, channels=channels)
+
+    @property
+    def bucket_duration(self) -> float:
+        return self._bucket_duration
+
+    def add(self, t: np.ndarray, data: np.ndarray) -> tuple[np.ndarray, np.ndarray] | None:
+        """Add a block to the decimator.
+
+        Parameters
+        ----------
+        t : np.ndarray
+            Time vector of the block.
+        data : np.ndarray
+            Data of the block [channels x time].
+
+        Returns
+        -------
+        out : tuple[np.ndarray, np.ndarray] | None
+            The envelope (time, [channels x time]) of the buckets completed by this block, None if none was.
+        """
+        if t.size == 0:
+            return None
+        if self._channels is not None:
+            data = data[self._channels, :]
+        self.samples_in += t.size
+
+        # Summarize each bucket of the block at once
+        buckets = np.floor(t / self._bucket_duration).astype(np.int64)
+        starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+        ends = np.r_[starts[1:] - 1, t.size - 1]
+        first_t = t[starts]
+        last_t = t[ends]
+        minima = np.minimum.reduceat(data, starts, axis=1)
+        maxima = np.maximum.reduceat(data, starts, axis=1)
+
+        completed = []
+        if self._pending is not None:
+            bucket, pending_first_t, _, pending_minima, pending_maxima = self._pending
+            if bucket == buckets[0]:
+                # The block continues the pending bucket
+                first_t[0] = pending_first_t[0]
+                minima[:, 0] = np.minimum(minima[:, 0], pending_minima[:, 0])
+                maxima[:, 0] = np.maximum(maxima[:, 0], pending_maxima[:, 0])
+            else:
+                completed.append(self._pending[1:])
+
+        # The last bucket may continue in the next block
+        completed.append((first_t[:-1], last_t[:-1], minima[:, :-1], maxima[:, :-1]))
+        self._pending = (int(buckets[-1]), first_t[-1:], last_t[-1:], minima[:, -1:], maxima[:, -1:])
+        return self._envelope(completed)
+
+    def flush(self) -> tuple[np.ndarray, np.ndarray] | None:
+        """Get the envelope of the bucket still waiting for more samples (e.g. when the stream stops)
+
+        Returns
+        -------
+        out : tuple[np.ndarray, np.ndarray] | None
+            The envelope (time, [channels x time]) of the pending bucket, None if there was none.
+        """
+        if self._pending is None:
+            return None
+        pending = self._pending[1:]
+        self._pending = None
+        return self._envelope([pending])
+
+    def _envelope(
+        self, buckets: list[tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]]
+    ) -> tuple[np.ndarray, np.ndarray] | None:
+        """Interleave the minima and maxima of the buckets into a single block"""
+        first_t = np.concatenate([bucket[0] for bucket in buckets])
+        if first_t.size == 0:
+            return None
+        last_t = np.concatenate([bucket[1] for bucket in buckets])
+        minima = np.concatenate([bucket[2] for bucket in buckets], axis=1)
+        maxima = np.concatenate([bucket[3] for bucket in buckets], axis=1)
+
+        t = np.empty(first_t.size * 2, dtype=first_t.dtype)
+        t[0::2] = first_t
+        t[1::2] = last_t
+        data = np.empty((minima.shape[0], t.size), dtype=minima.dtype)
+        data[:, 0::2] = minima
+        data[:, 1::2] = maxima
+        self.samples_out += t.size
+        return t, data
@@ -1,17 +1,29 @@
 from abc import ABC, abstractmethod
 from datetime import datetime
+import logging
 import threading
 from typing import Callable, Any
 
 import numpy as np
 
 from .data import NiDaqData
+from .timebase import Timebase
+from ..common.clock import Clock, SystemClock
+from ..common.dispatcher import DataDispatcher, DropPolicy, Subscription
+from ..common.tracing import tracer
 
-_mutex = threading.Lock()
+_logger = logging.getLogger("lokomat_fes")
 
 
 class NiDaqGeneric(ABC):
-    def __init__(self, num_channels: int, frame_rate: int, time_between_samples: int = 1) -> None:
+    def __init__(
+        self,
+        num_channels: int,
+        frame_rate: int,
+        time_between_samples: int = 1,
+        input_buffer_blocks: int = 10,
+        clock: Clock | None = None,
+    ) -> None:
         """
         Parameters
         ----------
@@ -21,25 +33,48 @@ class NiDaqGeneric(ABC):
             Frames per second
         time_between_samples : int
             Time between samples in seconds (this determines the number of samples per frame)
+        input_buffer_blocks : int
+            Size (in blocks) of the buffer of the device. If the reading falls behind by more than that, the oldest
+            samples are lost (and a gap is recorded in the data)
+        clock : Clock | None
+            The clock giving the host time ([default] is the system clock). With a virtual clock, the data ready
+            callbacks are called synchronously, so a simulated session stays deterministic
         """
+        self._clock = clock if clock is not None else SystemClock()
         self._num_channels = num_channels
 
         self._frame_rate = frame_rate  # Frames per second (Hz)
         self._time_between_samples = time_between_samples  # Time between block of samples in seconds
         self._n_samples_per_block = int(self._time_between_samples * self._frame_rate)  # Number of samples per block
+        self._input_buffer_size = input_buffer_blocks * self._n_samples_per_block  # Number of samples per channel
+
+        # Running sample counters (in samples since the start of the task), used to catch up and to detect gaps
+        self._next_sample_to_read = 0
+        self._next_sample_expected = 0
+        self._acquisition_statistics = _AcquisitionStatistics()
+
+        # Host timestamps of the samples, corrected for the drift between the clock of the device and the host
+        self._timebase = Timebase(frame_rate=self._frame_rate)
 
         # Data releated variables
         self._data: NiDaqData = None
 
         # Callback function that is called when new data are added
         self._is_recording: bool = False
+        self._mutex = threading.Lock()
         self._on_start_recording_callback: dict[Any, Callable[[], None]] = {}
-        self._on_data_ready_callback: dict[Any, Callable[[np.ndarray, np.ndarray], None]] = {}
         self._on_stop_recording_callback: dict[Any, Callable[[NiDaqData], None]] = {}
 
+        # The new data are dispatched to the data ready callbacks from dedicated threads, so a slow callback never delays
+        # the reading of the next block. The gaps go through the same dispatcher, so they arrive in order with the blocks
+        self._data_ready_dispatcher = DataDispatcher(name=f"{type(self).__name__} dispatcher")
+        self._on_data_ready_subscriptions: dict[Any, Subscription] = {}
+        self._on_gap_detected_subscriptions: dict[Any, Subscription] = {}
+
         # Setup the NiDaq task
         self._is_connected = False
         self._task = None
+        self._reader = None
         self._setup_task()
 
     @property
@@ -47,6 +82,11 @@ class NiDaqGeneric(ABC):
         """Number of channels connected to the NiDaq"""
         return self._num_channels
 
+    @property
+    def clock(self) -> Clock:
+        """The clock giving the host time"""
+        return self._clock
+
     @property
     def frame_rate(self) -> int:
         """Frames per second"""
@@ -60,45 +100,128 @@ class NiDaqGeneric(ABC):
     def register_to_start_recording(self, callback: Callable[[], None]) -> None:
         """Register a callback function that is called when the recording starts"""
         if hash(callback) not in self._on_start_recording_callback:
-            _mutex.acquire()
+            self._mutex.acquire()
             self._on_start_recording_callback[hash(callback)] = callback
-            _mutex.release()
+            self._mutex.release()
 
     def unregister_to_start_recording(self, callback: Callable[[], None]) -> None:
         """Unregister a callback function that is called when the recording starts"""
 
         if hash(callback) in self._on_start_recording_callback:
-            _mutex.acquire()
+            self._mutex.acquire()
             del self._on_start_recording_callback[hash(callback)]
-            _mutex.release()
+            self._mutex.release()
+
+    def register_to_data_ready(
+        self,
+        callback: Callable[[np.ndarray, np.ndarray], None],
+        queue_size: int = 64,
+        drop_policy: DropPolicy = DropPolicy.LOSSLESS,
+        decimation: int = 1,
+        on_gap: Callable[[float, int], None] | None = None,
+    ) -> Subscription:
+        """Register a callback function that is called (from a dispatcher thread) when new data are ready.
+        Each callback chooses how it copes with being slower than the acquisition: recordings should stay LOSSLESS,
+        while visualization feeds should rather use LATEST_ONLY or a [decimation] so they never stall the others.
 
-    def register_to_data_ready(self, callback: Callable[[np.ndarray, np.ndarray], None]) -> None:
-        """Register a callback function that is called when new data are ready"""
-        if hash(callback) not in self._on_data_ready_callback:
-            _mutex.acquire()
-            self._on_data_ready_callback[hash(callback)] = callback
-            _mutex.release()
+        Parameters
+        ----------
+        callback : Callable[[np.ndarray, np.ndarray], None]
+            The function to call with the time vector and the data of each new block.
+        queue_size : int
+            Maximum number of blocks waiting to be delivered to this callback.
+        drop_policy : DropPolicy
+            What to do with a new block when [queue_size] blocks are already waiting.
+        decimation : int
+            Only every [decimation]th block is sent to the callback.
+        on_gap : Callable[[float, int], None] | None
+            The function to call when samples were lost (with the time of the first missing sample and the number of
+            missing samples), in order with the blocks: it is called after the blocks that came before the gap and
+            before those that came after. Use it rather than [register_to_gap_detected] when the order matters.
+
+        Returns
+        -------
+        out : Subscription
+            The subscription of the callback, which keeps the count of delivered, dropped and coalesced blocks.
+        """
+        self._mutex.acquire()
+        if hash(callback) not in self._on_data_ready_subscriptions:
+            subscription = Subscription(
+                callback, queue_size=queue_size, drop_policy=drop_policy, decimation=decimation, event_callback=on_gap
+            )
+            self._on_data_ready_subscriptions[hash(callback)] = self._data_ready_dispatcher.subscribe(subscription)
+        subscription = self._on_data_ready_subscriptions[hash(callback)]
+        self._mutex.release()
+        return subscription
 
     def unregister_to_data_ready(self, callback: Callable[[np.ndarray, np.ndarray], None]) -> None:
         """Unregister a callback function that is called when new data are ready"""
-        if hash(callback) in self._on_data_ready_callback:
-            _mutex.acquire()
-            del self._on_data_ready_callback[hash(callback)]
-            _mutex.release()
+        if hash(callback) in self._on_data_ready_subscriptions:
+            self._mutex.acquire()
+            self._data_ready_dispatcher.unsubscribe(self._on_data_ready_subscriptions.pop(hash(callback)))
+            self._mutex.release()
+
+    def wait_for_data_ready_callbacks(self, timeout: float | None = None) -> bool:
+        """Wait until all the data acquired so far are delivered to the data ready callbacks
+
+        Parameters
+        ----------
+        timeout : float | None
+            Maximum time to wait in seconds. If None, wait forever.
+
+        Returns
+        -------
+        out : bool
+            True if everything was delivered, False otherwise.
+        """
+        return self._data_ready_dispatcher.flush(timeout=timeout)
+
+    @property
+    def data_ready_statistics(self) -> dict[str, Any]:
+        """Statistics of the dispatching of the data to the data ready callbacks"""
+        return self._data_ready_dispatcher.statistics
 
     def register_to_stop_recording(self, callback: Callable[[NiDaqData], None]) -> None:
         """Register a callback function that is called when the recording stops"""
         if hash(callback) not in self._on_stop_recording_callback:
-            _mutex.acquire()
+            self._mutex.acquire()
             self._on_stop_recording_callback[hash(callback)] = callback
-            _mutex.release()
+            self._mutex.release()
 
     def unregister_to_stop_recording(self, callback: Callable[[NiDaqData], None]) -> None:
         """Unregister a callback function that is called when the recording stops"""
         if hash(callback) in self._on_stop_recording_callback:
-            _mutex.acquire()
+            self._mutex.acquire()
             del self._on_stop_recording_callback[hash(callback)]
-            _mutex.release()
+            self._mutex.release()
+
+    def register_to_gap_detected(self, callback: Callable[[float, int], None]) -> None:
+        """Register a callback function that is called (from a dispatcher thread) when samples were lost. The callback
+        takes the time of the first missing sample and the number of missing samples. To receive the gaps in order with
+        the blocks, pass the callback as the [on_gap] of [register_to_data_ready] instead"""
+        self._mutex.acquire()
+        if hash(callback) not in self._on_gap_detected_subscriptions:
+            subscription = Subscription(None, event_callback=callback)
+            self._on_gap_detected_subscriptions[hash(callback)] = self._data_ready_dispatcher.subscribe(subscription)
+        self._mutex.release()
+
+    def unregister_to_gap_detected(self, callback: Callable[[float, int], None]) -> None:
+        """Unregister a callback function that is called when samples were lost"""
+        if hash(callback) in self._on_gap_detected_subscriptions:
+            self._mutex.acquire()
+            self._data_ready_dispatcher.unsubscribe(self._on_gap_detected_subscriptions.pop(hash(callback)))
+            self._mutex.release()
+
+    @property
+    def acquisition_statistics(self) -> dict[str, int]:
+        """Counters of the acquisition (blocks and samples read, catch-up reads, gaps, samples lost, read errors)"""
+        return self._acquisition_statistics.serialize()
+
+    @property
+    def clock_statistics(self) -> dict[str, float]:
+        """Drift (ppm) between the clock of the device and the host clock, jitter (s) of the data arrival and total
+        correction (s) applied to the timestamps"""
+        return self._timebase.statistics
 
     @property
     def is_connected(self) -> bool:
@@ -109,7 +232,12 @@ class NiDaqGeneric(ABC):
         """Connect the NiDaq"""
         if self._is_connected:
             raise RuntimeError("Cannot connect the device while it is already connected")
-        self._data = NiDaqData()
+        self._data = NiDaqData(t0=datetime.fromtimestamp(self._clock.now()))
+        self._next_sample_to_read = 0
+        self._next_sample_expected = 0
+        self._timebase.reset()
+        if not self._clock.is_virtual:
+            self._data_ready_dispatcher.start()
         self._start_task()
         self._is_connected = True
 
@@ -118,6 +246,7 @@ class NiDaqGeneric(ABC):
         if not self._is_connected:
             raise RuntimeError("Cannot disconnect the device while it is not connected")
         self._stop_task()
+        self._data_ready_dispatcher.stop()
         self._is_connected = False
 
     def start_recording(self) -> None:
@@ -128,10 +257,10 @@ class NiDaqGeneric(ABC):
         if self._is_recording:
             raise RuntimeError("Cannot start recording while already recording")
 
-        _mutex.acquire()
+        self._mutex.acquire()
         for key in self._on_start_recording_callback.keys():
             self._on_start_recording_callback[key]()
-        _mutex.release()
+        self._mutex.release()
 
         self._reset_data()
         self._is_recording = True
@@ -142,10 +271,13 @@ class NiDaqGeneric(ABC):
             # If we are not currently recording, we don't need to stop the recording
             return
 
-        _mutex.acquire()
+        # Make sure the callbacks received everything that was recorded
+        self.wait_for_data_ready_callbacks(timeout=1.0)
+
+        self._mutex.acquire()
         for key in self._on_stop_recording_callback.keys():
             self._on_stop_recording_callback[key](self._data)
-        _mutex.release()
+        self._mutex.release()
 
         self._is_recording = False
 
@@ -168,43 +300,137 @@ class NiDaqGeneric(ABC):
 
     def _reset_data(self) -> None:
         """Reset data to start a new trial"""
-        self._data = NiDaqData()
+        self._data = NiDaqData(t0=datetime.fromtimestamp(self._clock.now()))
 
     def _data_has_arrived(self, task_handle: int, event_type: int, num_samples: int, callback_data: Any) -> int:
-        """Callback function for reading signals"""
-        try:
-            data = self._task.read(number_of_samples_per_channel=self._n_samples_per_block)
-        except:
-            return 0
-        self._manage_new_data(np.array(data))
-        return 1  # Success
+        """Callback function for reading signals.
+        It reads all the whole blocks that are available, so the reading catches up if a previous call was late. If
+        the device already overwrote samples that were never read, the reading resumes at the oldest available sample
+        and the gap is recorded.
+        """
+        with tracer.span("nidaq.data_has_arrived", category="nidaq"):
+            statistics = self._acquisition_statistics
+            try:
+                acquired = self._samples_acquired()
+                self._timebase.observe(sample_index=acquired, host_time=self._clock.now())
+                self._skip_overwritten_samples(acquired)
+
+                n_blocks = (acquired - self._next_sample_to_read) // self._n_samples_per_block
+                if n_blocks > 1:
+                    statistics.catch_up_reads += 1
+                statistics.max_backlog_blocks = max(statistics.max_backlog_blocks, n_blocks)
+
+                while acquired - self._next_sample_to_read >= self._n_samples_per_block:
+                    # Each block is read into its own buffer: the block is kept as is by the consumers (the data,
+                    # the retention, ...), so the buffer can never be reused for another block
+                    data = np.empty((self._num_channels, self._n_samples_per_block), dtype=np.float64)
+                    statistics.buffers_allocated += 1
+                    first_sample = self._next_sample_to_read
+                    try:
+                        self._read_into(data, first_sample=first_sample)
+                    except Exception:
+                        # The device may have overwritten the samples since they were found available, they are then
+                        # lost (the gap is recorded with the next block) rather than a read error
+                        acquired = self._samples_acquired()
+                        if not self._skip_overwritten_samples(acquired):
+                            raise
+                        statistics.overwritten_reads += 1
+                        continue
+                    self._next_sample_to_read += self._n_samples_per_block
+                    self._manage_new_data(data, first_sample=first_sample)
+            except Exception:
+                statistics.read_errors += 1
+                _logger.exception("Error while reading the data from the NiDaq")
+                return 0
+            return 1  # Success
+
+    def _skip_overwritten_samples(self, acquired: int) -> bool:
+        """Resume the reading at the oldest sample still in the buffer of the device if the next one to read was
+        overwritten. Returns whether samples were skipped."""
+        oldest_available = acquired - self._input_buffer_size
+        if oldest_available <= self._next_sample_to_read:
+            return False
+        self._next_sample_to_read = oldest_available
+        return True
+
+    def _samples_acquired(self) -> int:
+        """Total number of samples (per channel) acquired by the device since the start of the task"""
+        return self._task.in_stream.total_samp_per_chan_acquired
+
+    def _read_into(self, buffer: np.ndarray, first_sample: int) -> int:
+        """Read a block of samples from the device directly into [buffer] (channels x samples), without going through
+        intermediate Python lists.
+
+        Parameters
+        ----------
+        buffer : np.ndarray
+            The C-contiguous float64 buffer to fill. Its number of columns is the number of samples to read.
+        first_sample : int
+            Index (since the start of the task) of the first sample to read.
+
+        Returns
+        -------
+        out : int
+            The number of samples read per channel.
+        """
+        self._task.in_stream.offset = first_sample
+        return self._reader.read_many_sample(buffer, number_of_samples_per_channel=buffer.shape[1], timeout=0)
 
-    def _manage_new_data(self, data: np.ndarray) -> int:
+    def _manage_new_data(self, data: np.ndarray, first_sample: int | None = None) -> int:
         """
         Callback function for reading signals.
         It automatically computes the time vector and calls the callback function if it exists.
-        """
-
-        n_frames = int(self.frame_rate * self._time_between_samples)
-        dt = self.dt  # This is so we finish the time vector one dt before the next sample
-
-        prev_t, _ = self._data.sample_block(index=-1, unsafe=True)
-        t0 = datetime.now().timestamp() - self._time_between_samples if prev_t is None else (prev_t[-1] + dt)
-        t = np.linspace(t0, t0 + self._time_between_samples - dt, n_frames)
 
-        self._data.add(t, data)
-
-        if self._on_data_ready_callback:
-            data_for_callbacks = self._data.sample_block(index=-1, unsafe=True)
-            _mutex.acquire()
-            for key in self._on_data_ready_callback.keys():
-                self._on_data_ready_callback[key](*data_for_callbacks)
-            _mutex.release()
+        Parameters
+        ----------
+        data : np.ndarray
+            The new block of data (channels x samples).
+        first_sample : int | None
+            Index (since the start of the task) of the first sample of the block. If it is past the end of the previous
+            block, the missing samples are recorded as a gap. If None, the block is assumed to follow the previous one.
+        """
+        with tracer.span("nidaq.manage_new_data", category="nidaq", n_samples=data.shape[1]):
+            n_frames = data.shape[1]
+            if first_sample is None:
+                # The last sample of the block was acquired (roughly) right now
+                first_sample = self._next_sample_expected
+                self._timebase.observe(sample_index=first_sample + n_frames, host_time=self._clock.now())
+
+            gap_time = None
+            if first_sample > self._next_sample_expected:
+                gap_time = self._time_of(self._next_sample_expected)
+            t = self._timestamps(first_sample=first_sample, n_samples=n_frames)
+            if gap_time is not None:
+                self._register_gap(t=gap_time, n_samples=first_sample - self._next_sample_expected)
+            self._next_sample_expected = first_sample + n_frames
+
+            self._acquisition_statistics.blocks_read += 1
+            self._acquisition_statistics.samples_read += n_frames
+            self._data.add(t, data)
+            self._data_ready_dispatcher.push(t, data)
+
+    def _timestamps(self, first_sample: int, n_samples: int) -> np.ndarray:
+        """Host time of each sample of the block starting at [first_sample]"""
+        return self._timebase.timestamps(first_sample=first_sample, n_samples=n_samples)
+
+    def _time_of(self, sample_index: int) -> float:
+        """Host time of the sample [sample_index] (used to date the gaps)"""
+        return self._timebase.time_of(sample_index)
+
+    def _register_gap(self, t: float, n_samples: int) -> None:
+        """Record that [n_samples] samples starting at time [t] were lost"""
+        _logger.warning(f"NiDaq overrun, {n_samples} samples were lost")
+        self._acquisition_statistics.gaps += 1
+        self._acquisition_statistics.samples_lost += n_samples
+
+        self._data.add_gap(t, n_samples)
+        self._data_ready_dispatcher.push_event(t, n_samples)
 
     def _setup_task(self) -> None:
         """Setup the NiDaq task"""
         import nidaqmx
-        from nidaqmx.constants import AcquisitionType
+        from nidaqmx.constants import AcquisitionType, OverwriteMode, ReadRelativeTo
+        from nidaqmx.stream_readers import AnalogMultiChannelReader
 
         self._task = nidaqmx.Task()  # This replaces the usual with statement
         for i in range(self.num_channels):
@@ -212,6 +438,13 @@ class NiDaqGeneric(ABC):
 
         self._task.timing.cfg_samp_clk_timing(self.frame_rate, sample_mode=AcquisitionType.CONTINUOUS)
 
+        # Keep acquiring when we fall behind (instead of stopping the task on an error), and read at explicit sample
+        # indices so we know exactly which samples were overwritten
+        self._task.in_stream.input_buf_size = self._input_buffer_size
+        self._task.in_stream.over_write = OverwriteMode.OVERWRITE_UNREAD_SAMPLES
+        self._task.in_stream.relative_to = ReadRelativeTo.FIRST_SAMPLE
+        self._reader = AnalogMultiChannelReader(self._task.in_stream)
+
         self._task.register_every_n_samples_acquired_into_buffer_event(
             self._n_samples_per_block,
             self._data_has_arrived,
@@ -227,3 +460,21 @@ class NiDaqGeneric(ABC):
 
     def _stop_task(self) -> None:
         self._task.stop()
+
+
+class _AcquisitionStatistics:
+    """Running counters of the acquisition"""
+
+    def __init__(self) -> None:
+        self.blocks_read = 0
+        self.samples_read = 0
+        self.buffers_allocated = 0  # One per block read, the blocks are never copied afterwards
+        self.catch_up_reads = 0  # Number of times more than one block was waiting
+        self.max_backlog_blocks = 0  # Highest number of blocks that were waiting at the same time
+        self.gaps = 0
+        self.samples_lost = 0
+        self.read_errors = 0
+        self.overwritten_reads = 0  # Reads whose samples were overwritten between the check and the read
+
+    def serialize(self) -> dict[str, int]:
+        return dict(vars(self))
@@ -12,7 +12,8 @@ class NiDaqLokomatMock(NiDaqLokomat):
     def __init__(self, *args, **kwargs) -> None:
         super().__init__(*args, **kwargs)
         self._timer: PerpetualTimer | None = None
-        self._timer_counter: int = 0
+        self._fake_samples_acquired: int = 0
+        self._timer_statistics: dict[str, float] = {}
 
     @override
     def _setup_task(self):
@@ -21,25 +22,41 @@ class NiDaqLokomatMock(NiDaqLokomat):
     @override
     def _start_task(self):
         """Simulate the start of the task by launching a timer that calls the callback function every dt seconds"""
-        self._timer = PerpetualTimer(self._time_between_samples, self._generate_fake_data)
-        self._timer_counter = 0
+        self._timer = PerpetualTimer(
+            self._time_between_samples, self._generate_fake_data, name="NiDaqLokomatMock", clock=self._clock
+        )
+        self._fake_samples_acquired = 0
         self._timer.start()
 
     @override
     def _stop_task(self):
         self._timer.cancel()
+        self._timer_statistics = self._timer.statistics
         self._timer = None
 
+    @property
+    def timer_statistics(self) -> dict[str, float]:
+        """Statistics of the timer emulating the device (achieved rate, jitter, ...) of the current or last acquisition"""
+        return self._timer.statistics if self._timer is not None else self._timer_statistics
+
     def _generate_fake_data(self):
         """Generate fake data and call the callback function, emulating the [_data_has_arrived] method"""
-        normalized_time = np.linspace(
-            self._timer_counter, self._timer_counter + self._time_between_samples, self._n_samples_per_block
-        )
+        self._acquire_fake_samples(self._n_samples_per_block)
+        self._data_has_arrived(task_handle=0, event_type=0, num_samples=self._n_samples_per_block, callback_data=None)
 
-        fake_data = np.zeros((self.num_channels, self._n_samples_per_block))
-        # First row is hip angle that resembles a sine wave which takes about 1 second to complete
-        fake_data[0, :] = np.sin(2 * np.pi * normalized_time)
+    def _acquire_fake_samples(self, n_samples: int) -> None:
+        """Emulate the device acquiring [n_samples] samples in its buffer (without notifying that they arrived)"""
+        self._fake_samples_acquired += n_samples
 
-        self._manage_new_data(fake_data)
+    @override
+    def _samples_acquired(self) -> int:
+        return self._fake_samples_acquired
+
+    @override
+    def _read_into(self, buffer: np.ndarray, first_sample: int) -> int:
+        normalized_time = (first_sample + np.arange(buffer.shape[1])) / self.frame_rate
 
-        self._timer_counter += self._time_between_samples
+        # First row is hip angle that resembles a sine wave which takes about 1 second to complete
+        buffer[1:, :] = 0
+        np.sin(2 * np.pi * normalized_time, out=buffer[0, :])
+        return buffer.shape[1]
@@ -1,23 +1,151 @@
-from threading import Timer
+import logging
+import math
+from threading import Event, Thread, current_thread
+from typing import Callable
+
+from ..common.clock import Clock, SystemClock, TimerHandle
+
+_logger = logging.getLogger("lokomat_fes")
 
 
 class PerpetualTimer:
-    def __init__(self, t, hFunction):
+    """Call a function every [t] seconds from a single persistent thread.
+
+    The thread sleeps to absolute deadlines (start + k * t on the perf_counter clock), so neither the execution time of
+    the function nor the wake-up latency accumulate: the achieved rate is the nominal one on average. When a call is
+    late by more than one period, the missed calls are either made back to back (catch_up=True, nothing is lost) or
+    skipped (catch_up=False, the timer simply resynchronizes on the next deadline).
+
+    With a virtual clock, no thread is used: each call is scheduled on the clock at its deadline.
+    """
+
+    def __init__(
+        self,
+        t: float,
+        hFunction: Callable[[], None],
+        catch_up: bool = True,
+        name: str | None = None,
+        clock: Clock | None = None,
+    ):
+        """
+        Parameters
+        ----------
+        t : float
+            The period (s) between two calls.
+        hFunction : Callable[[], None]
+            The function to call.
+        catch_up : bool
+            If the calls that were missed while late should be made (True) or skipped (False).
+        name : str | None
+            The name of the thread.
+        clock : Clock | None
+            The clock to follow ([default] is the system clock).
+        """
+        if t <= 0:
+            raise ValueError("The period of the timer must be positive")
+
         self.t = t
         self.hFunction = hFunction
-        self.thread = Timer(self.t, self.handle_function)
+        self._catch_up = catch_up
+        self._clock = clock if clock is not None else SystemClock()
 
-    def handle_function(self):
-        self.hFunction()
-        self.thread = Timer(self.t, self.handle_function)
-        try:
-            self.thread.start()
-        except RuntimeError:
-            # This should not happen, but it does when the user is in debug mode and blocked on a breakpoint
-            pass
+        self._cancelled = Event()
+        self.thread = Thread(target=self._run, name=name or "PerpetualTimer", daemon=True)
+        self._next_call: TimerHandle | None = None
+        self._next_index = 1
+
+        self._start_time: float | None = None
+        self._last_call_time: float | None = None
+        self._calls = 0
+        self._skipped = 0
+        self._late_calls = 0
+        self._mean_lateness = 0.0
+        self._lateness_sum_of_squares = 0.0
+        self._max_lateness = 0.0
 
     def start(self):
-        self.thread.start()
+        self._start_time = self._clock.perf_counter()
+        if self._clock.is_virtual:
+            self._schedule_next_call()
+        else:
+            self.thread.start()
 
     def cancel(self):
-        self.thread.cancel()
+        """Stop the timer, waiting for the call in progress (if any) to finish"""
+        self._cancelled.set()
+        if self._next_call is not None:
+            self._next_call.cancel()
+        if self.thread.is_alive() and self.thread is not current_thread():
+            self.thread.join()
+
+    @property
+    def statistics(self) -> dict[str, float]:
+        """Statistics of the timer: number of calls, calls skipped or made late (by more than one period), achieved
+        rate (Hz) and the jitter (standard deviation, s) and maximum of the lateness of the calls relative to their
+        deadline"""
+        elapsed = None if self._last_call_time is None else self._last_call_time - self._start_time
+        return {
+            "calls": self._calls,
+            "skipped": self._skipped,
+            "late_calls": self._late_calls,
+            "nominal_rate": 1 / self.t,
+            "achieved_rate": self._calls / elapsed if elapsed else 0.0,
+            "jitter": math.sqrt(self._lateness_sum_of_squares / self._calls) if self._calls > 1 else 0.0,
+            "mean_lateness": self._mean_lateness,
+            "max_lateness": self._max_lateness,
+        }
+
+    def _schedule_next_call(self):
+        deadline = self._start_time + self._next_index * self.t
+        self._next_call = self._clock.call_later(deadline - self._clock.perf_counter(), self._call_on_virtual_clock)
+
+    def _call_on_virtual_clock(self):
+        if self._cancelled.is_set():
+            return
+        self._record_call(self._clock.perf_counter(), 0.0)
+        try:
+            self.hFunction()
+        except Exception as e:
+            _logger.exception(f"The function called by the timer raised: {e}")
+        self._next_index += 1
+        if not self._cancelled.is_set():
+            self._schedule_next_call()
+
+    def _run(self):
+        index = 1
+        while True:
+            deadline = self._start_time + index * self.t
+            remaining = deadline - self._clock.perf_counter()
+            if remaining > 0 and self._cancelled.wait(remaining):
+                return
+            if self._cancelled.is_set():
+                return
+
+            now = self._clock.perf_counter()
+            lateness = now - deadline
+            self._record_call(now, lateness)
+            try:
+                self.hFunction()
+            except Exception as e:
+                # The timer must survive a failing call, otherwise the emulated device silently stops
+                _logger.exception(f"The function called by the timer raised: {e}")
+            index += 1
+
+            if lateness > self.t:
+                self._late_calls += 1
+            if not self._catch_up:
+                # Resynchronize on the next deadline that is still ahead
+                missed = int((self._clock.perf_counter() - self._start_time) / self.t) + 1 - index
+                if missed > 0:
+                    self._skipped += missed
+                    index += missed
+
+    def _record_call(self, now: float, lateness: float):
+        self._last_call_time = now
+        self._calls += 1
+
+        # Welford's running mean and variance of the lateness
+        delta = lateness - self._mean_lateness
+        self._mean_lateness += delta / self._calls
+        self._lateness_sum_of_squares += delta * (lateness - self._mean_lateness)
+        self._max_lateness = max(self._max_lateness, lateness)
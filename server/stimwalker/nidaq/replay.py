@@ -0,0 +1,222 @@
+import logging
+import threading
+import time
+from typing import override
+
+import numpy as np
+
+from .data import NiDaqData
+from .devices import NiDaqGeneric
+from .perpetual_timer import PerpetualTimer
+from ..common.clock import Clock, TimerHandle
+
+_logger = logging.getLogger("lokomat_fes")
+
+
+class NiDaqReplay(NiDaqGeneric):
+    """Device that replays the NiDaq blocks of a recorded trial through the same pipeline as a real acquisition.
+
+    The whole recording is preloaded in one contiguous [channels x samples] array and each block is emitted as a
+    (read-only) view of it, so emitting a block costs nothing but the consumers. The blocks are emitted at [speed]
+    times the recorded rate, or back to back as fast as the consumers take them. Their timestamps are the recorded
+    ones, moved to the start of the replay (and scaled by the speed), so the rest of the server sees a consistent
+    timeline. The recorded gaps are replayed too.
+    """
+
+    def __init__(
+        self,
+        source: "str | Data | NiDaqData",
+        speed: float | None = 1.0,
+        loop: bool = False,
+        clock: Clock | None = None,
+    ) -> None:
+        """
+        Parameters
+        ----------
+        source : str | Data | NiDaqData
+            The recorded trial (or the path of a file saved with [Data.save]).
+        speed : float | None
+            How many times faster than the recording the blocks are emitted. If None, they are emitted as fast as
+            possible and their timestamps follow the recording (at speed 1). On a virtual clock, where time costs
+            nothing, each block is then emitted when the clock reaches the time of its last sample.
+        loop : bool
+            Whether to start over when the end of the recording is reached (the timeline keeps going forward).
+        clock : Clock | None
+            The clock giving the host time ([default] is the system clock).
+        """
+        from ..common.data import Data
+
+        if speed is not None and speed <= 0:
+            raise ValueError("The speed of the replay must be positive")
+
+        if isinstance(source, str):
+            source = Data.load(source)
+        if isinstance(source, Data):
+            source = source.nidaq
+        if len(source) == 0:
+            raise ValueError("Cannot replay a recording without NiDaq data")
+
+        # Preload everything in one contiguous buffer and keep the blocks as views of it
+        self._recorded_time = np.ascontiguousarray(np.concatenate(source._t))
+        self._recorded_data = np.ascontiguousarray(np.concatenate(source._data, axis=1), dtype=np.float64)
+        self._recorded_data.flags.writeable = False
+        block_sizes = np.array([t.shape[0] for t in source._t])
+        self._block_starts = np.concatenate(([0], np.cumsum(block_sizes)))
+
+        # Sample index of the first sample of each block, accounting for the samples lost in the recorded gaps
+        self._block_first_samples = self._block_starts[:-1].copy()
+        for gap_time, n_samples in source.gaps:
+            self._block_first_samples[self._recorded_time[self._block_starts[:-1]] >= gap_time] += n_samples
+        self._recording_length = int(self._block_first_samples[-1] + block_sizes[-1])
+
+        recorded_dt = float(np.median(np.diff(self._recorded_time))) if self._recorded_time.shape[0] > 1 else 1.0
+        frame_rate = int(round(1 / recorded_dt))
+        self._speed = speed
+        self._loop = loop
+        self._recording_duration = self._recording_length / frame_rate
+
+        self._next_block = 0
+        self._n_loops = 0
+        self._replay_start_time: float | None = None
+        self._timer: PerpetualTimer | None = None
+        self._thread: threading.Thread | None = None
+        self._next_call: TimerHandle | None = None
+        self._is_replaying = False
+        self._finished = threading.Event()
+
+        super().__init__(
+            num_channels=self._recorded_data.shape[0],
+            frame_rate=frame_rate,
+            time_between_samples=float(np.median(block_sizes)) / frame_rate,
+            clock=clock,
+        )
+
+    @property
+    def speed(self) -> float | None:
+        """How many times faster than the recording the blocks are emitted (None is as fast as possible)"""
+        return self._speed
+
+    @property
+    def n_blocks(self) -> int:
+        """Number of blocks in the recording"""
+        return self._block_first_samples.shape[0]
+
+    @property
+    def is_finished(self) -> bool:
+        """Whether all the blocks were emitted (never True when looping)"""
+        return self._finished.is_set()
+
+    def wait_until_finished(self, timeout: float | None = None) -> bool:
+        """Wait until all the blocks are emitted. Returns False on timeout."""
+        return self._finished.wait(timeout)
+
+    @override
+    def _channel_name(self, channel: int) -> str:
+        return f"replay{channel}"
+
+    @override
+    def _setup_task(self) -> None:
+        pass
+
+    @override
+    def _start_task(self) -> None:
+        self._next_block = 0
+        self._n_loops = 0
+        self._finished.clear()
+        self._replay_start_time = self._clock.now()
+        self._is_replaying = True
+
+        if self._speed is not None:
+            self._timer = PerpetualTimer(
+                self._time_between_samples / self._speed, self._emit_next_block, name="NiDaqReplay", clock=self._clock
+            )
+            self._timer.start()
+        elif self._clock.is_virtual:
+            self._schedule_on_virtual_clock()
+        else:
+            self._thread = threading.Thread(target=self._emit_as_fast_as_possible, name="NiDaqReplay", daemon=True)
+            self._thread.start()
+
+    @override
+    def _stop_task(self) -> None:
+        self._is_replaying = False
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._next_call is not None:
+            self._next_call.cancel()
+            self._next_call = None
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _emit_as_fast_as_possible(self) -> None:
+        dispatcher = self._data_ready_dispatcher
+        while self._is_replaying:
+            # Go as fast as the consumers, but not faster: a full dispatcher would drop the blocks
+            if dispatcher.pending >= dispatcher.capacity // 2:
+                time.sleep(0.0005)
+                continue
+            if not self._emit_next_block():
+                break
+
+    def _emit_on_virtual_clock(self) -> None:
+        if self._is_replaying and self._emit_next_block():
+            self._schedule_on_virtual_clock()
+
+    def _schedule_on_virtual_clock(self) -> None:
+        """Schedule the next block at the time of its last sample on the timeline of the replay. On a virtual clock,
+        the time costs nothing, so each advance emits the blocks of the time advanced (at once), and a block is never
+        dated ahead of the clock (a looping replay would otherwise never let the advance return)."""
+        block, n_loops = self._next_block, self._n_loops
+        if block >= self.n_blocks:
+            if not self._loop:
+                self._emit_next_block()  # Marks the replay as finished
+                return
+            block, n_loops = 0, n_loops + 1
+
+        last_sample = self._recorded_time[self._block_starts[block + 1] - 1]
+        elapsed = last_sample - self._recorded_time[0] + n_loops * self._recording_duration
+        delay = self._replay_start_time + elapsed - self._clock.now()
+        self._next_call = self._clock.call_later(delay, self._emit_on_virtual_clock)
+
+    def _emit_next_block(self) -> bool:
+        """Emit the next block. Returns False when there is nothing left to emit."""
+        if self._next_block >= self.n_blocks:
+            if not self._loop:
+                if not self._finished.is_set():
+                    _logger.info("The replay reached the end of the recording")
+                    self._finished.set()
+                return False
+            self._next_block = 0
+            self._n_loops += 1
+
+        block = self._next_block
+        self._next_block += 1
+        data = self._recorded_data[:, self._block_starts[block] : self._block_starts[block + 1]]
+        first_sample = int(self._block_first_samples[block]) + self._n_loops * self._recording_length
+        self._manage_new_data(data, first_sample=first_sample)
+        return True
+
+    @override
+    def _timestamps(self, first_sample: int, n_samples: int) -> np.ndarray:
+        # The blocks are emitted in order, so the block being managed is the last one taken
+        block = self._next_block - 1
+        recorded = self._recorded_time[self._block_starts[block] : self._block_starts[block + 1]]
+        return self._replay_time(recorded)
+
+    @override
+    def _time_of(self, sample_index: int) -> float:
+        # Only called to date the samples lost right before the block being managed, so count back from that block
+        block = self._next_block - 1
+        index_in_recording = sample_index - self._n_loops * self._recording_length
+        samples_before = int(self._block_first_samples[block]) - index_in_recording
+        recorded = self._recorded_time[self._block_starts[block]] - samples_before * self.dt
+        return float(self._replay_time(recorded))
+
+    def _replay_time(self, recorded: np.ndarray) -> np.ndarray:
+        """Convert recorded times to the timeline of the replay"""
+        elapsed = recorded - self._recorded_time[0] + self._n_loops * self._recording_duration
+        if self._speed is not None:
+            elapsed = elapsed / self._speed
+        return self._replay_start_time + elapsed
@@ -0,0 +1,138 @@
+from typing import override
+
+import numpy as np
+
+from .devices import NiDaqGeneric
+from .perpetual_timer import PerpetualTimer
+from ..common.clock import Clock
+
+
+class NiDaqSynthetic(NiDaqGeneric):
+    """Synthetic acquisition device generating gait-like signals on any number of channels at any rate, to stress the
+    consumers of the data (e.g. 64 or 128 channels at 2-10 kHz).
+
+    Channel 0 is the hip angle, a sine wave of one cycle per stride (like [NiDaqLokomatMock]). The other channels are
+    periodic joint-angle-like signals (a fundamental at the stride frequency plus a few harmonics of random amplitude
+    and phase) with their own gain and offset. Optional white noise is added on top.
+
+    Everything is precomputed at construction: one stride of each signal (the wavetable) and a bank of noise, both
+    extended by one block so any block is a contiguous slice. Generating a block is then a single copy (and an addition
+    if there is noise) straight into the buffer the device reads into. The content of a sample only depends on its
+    index and on the seed, so the output is bit-reproducible whatever the timing of the reads.
+    """
+
+    def __init__(
+        self,
+        num_channels: int = 64,
+        frame_rate: int = 2000,
+        time_between_samples: float = 0.1,
+        seed: int = 0,
+        stride_frequency: float = 1.0,
+        n_harmonics: int = 3,
+        noise: float = 0.01,
+        noise_blocks: int = 7,
+        clock: Clock | None = None,
+    ) -> None:
+        """
+        Parameters
+        ----------
+        num_channels : int
+            Number of channels.
+        frame_rate : int
+            Frames per second.
+        time_between_samples : float
+            Time between blocks in seconds (this determines the number of samples per block).
+        seed : int
+            Seed of the random generator giving the shape of the signals and the noise.
+        stride_frequency : float
+            Number of strides per second (the stride is rounded to a whole number of samples).
+        n_harmonics : int
+            Number of harmonics of the stride frequency in the joint-angle-like signals.
+        noise : float
+            Standard deviation of the white noise added to the signals (0 for none).
+        noise_blocks : int
+            Length (in blocks) of the bank of noise that is cycled through. It is made coprime with the stride length so
+            the noise does not repeat in phase with the signals.
+        clock : Clock | None
+            The clock giving the host time ([default] is the system clock).
+        """
+        super().__init__(
+            num_channels=num_channels, frame_rate=frame_rate, time_between_samples=time_between_samples, clock=clock
+        )
+        self._seed = seed
+        self._timer: PerpetualTimer | None = None
+        self._synthetic_samples_acquired: int = 0
+
+        rng = np.random.default_rng(seed)
+        block_size = self._n_samples_per_block
+
+        # One stride of each signal, extended by one block so a block never wraps around
+        self._stride_length = max(int(round(frame_rate / stride_frequency)), 1)
+        phase = 2 * np.pi * np.arange(self._stride_length + block_size) / self._stride_length
+        harmonics = np.arange(1, n_harmonics + 1)
+        amplitudes = rng.uniform(0.1, 1.0, size=(num_channels, n_harmonics)) / harmonics
+        amplitudes[:, 0] = 1.0
+        phases = rng.uniform(0, 2 * np.pi, size=(num_channels, n_harmonics))
+        gains = rng.uniform(5, 30, size=(num_channels, 1))
+        offsets = rng.uniform(-10, 10, size=(num_channels, 1))
+
+        self._wavetable = np.zeros((num_channels, self._stride_length + block_size))
+        for k in range(n_harmonics):
+            self._wavetable += amplitudes[:, k : k + 1] * np.sin(harmonics[k] * phase + phases[:, k : k + 1])
+        self._wavetable = self._wavetable / np.sum(amplitudes, axis=1, keepdims=True) * gains + offsets
+        self._wavetable[0, :] = np.sin(phase)
+
+        # A bank of noise cycled through (its length is coprime with the stride, so the noise drifts over the signals)
+        self._noise_length = 0
+        self._noise_bank = None
+        if noise > 0:
+            self._noise_length = max(noise_blocks, 1) * block_size
+            while np.gcd(self._noise_length, self._stride_length) != 1:
+                self._noise_length += 1
+            self._noise_bank = rng.normal(0, noise, size=(num_channels, self._noise_length + block_size))
+
+    @property
+    def seed(self) -> int:
+        """The seed of the signals"""
+        return self._seed
+
+    @override
+    def _channel_name(self, channel: int) -> str:
+        return f"synthetic{channel}"
+
+    @override
+    def _setup_task(self):
+        pass
+
+    @override
+    def _start_task(self):
+        """Simulate the start of the task by launching a timer that acquires a block every [time_between_samples]"""
+        self._timer = PerpetualTimer(
+            self._time_between_samples, self._generate_synthetic_data, name="NiDaqSynthetic", clock=self._clock
+        )
+        self._synthetic_samples_acquired = 0
+        self._timer.start()
+
+    @override
+    def _stop_task(self):
+        self._timer.cancel()
+        self._timer = None
+
+    def _generate_synthetic_data(self):
+        """Acquire a block and notify it, emulating the device"""
+        self._synthetic_samples_acquired += self._n_samples_per_block
+        self._data_has_arrived(task_handle=0, event_type=0, num_samples=self._n_samples_per_block, callback_data=None)
+
+    @override
+    def _samples_acquired(self) -> int:
+        return self._synthetic_samples_acquired
+
+    @override
+    def _read_into(self, buffer: np.ndarray, first_sample: int) -> int:
+        n_samples = buffer.shape[1]
+        start = first_sample % self._stride_length
+        np.copyto(buffer, self._wavetable[:, start : start + n_samples])
+        if self._noise_bank is not None:
+            start = first_sample % self._noise_length
+            np.add(buffer, self._noise_bank[:, start : start + n_samples], out=buffer)
+        return n_samples
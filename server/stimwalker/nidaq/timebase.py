@@ -0,0 +1,177 @@
+import numpy as np
+
+
+class Timebase:
+    """Map the sample indices of the device to host timestamps, correcting for the drift between the sample clock of
+    the device and the host clock.
+
+    Each time the device notifies that samples arrived, the host time of the notification is paired with the number of
+    samples acquired so far. A running (exponentially forgetting) linear fit of these pairs gives the actual sampling
+    period and offset as seen by the host. The timestamps that are handed out are continuous from block to block: they
+    are only slewed toward the fit by a bounded amount per block, so a correction never makes the time jump or go back.
+    Everything is O(1) per block.
+    """
+
+    def __init__(
+        self,
+        frame_rate: float,
+        forgetting_factor: float = 0.99,
+        max_slew: float = 0.001,
+        max_drift_ppm: float = 1000,
+        min_observations: int = 3,
+    ) -> None:
+        """
+        Parameters
+        ----------
+        frame_rate : float
+            Nominal sampling rate of the device (Hz).
+        forgetting_factor : float
+            Weight ]0; 1] given to the previous observations at each new observation (the closer to 1, the longer the
+            memory of the fit and the smoother the correction).
+        max_slew : float
+            Maximum correction applied to the timestamps per block, as a fraction of the duration of the block (this is
+            also the maximum relative change of the sampling step).
+        max_drift_ppm : float
+            Maximum plausible drift between the clocks (in parts per million). The fitted period is clamped to it, so
+            outliers (e.g. the host being suspended) cannot derail the timestamps.
+        min_observations : int
+            Number of observations before the fitted period is trusted over the nominal one.
+        """
+        if not 0 < forgetting_factor <= 1:
+            raise ValueError("forgetting_factor must be in ]0; 1]")
+
+        self._nominal_period = 1 / frame_rate
+        self._forgetting_factor = forgetting_factor
+        self._max_slew = max_slew
+        self._max_drift = max_drift_ppm * 1e-6
+        self._min_observations = min_observations
+        self.reset()
+
+    def reset(self) -> None:
+        """Forget everything (e.g. when the acquisition restarts)"""
+        # Exponentially weighted running fit of host_time = intercept + period * sample_index, centered on the weighted
+        # means for numerical stability
+        self._weight = 0.0
+        self._mean_index = 0.0
+        self._mean_time = 0.0
+        self._covariance_index = 0.0
+        self._covariance_index_time = 0.0
+        self._n_observations = 0
+
+        # Jitter of the notifications around the fit
+        self._residual_variance = 0.0
+        self._max_residual = 0.0
+
+        # Timestamps handed out so far: [_last_time] is the time of the sample [_last_index]
+        self._last_index: int | None = None
+        self._last_time: float | None = None
+        self._period = self._nominal_period
+        self._total_correction = 0.0
+
+    @property
+    def period(self) -> float:
+        """Current estimate of the sampling period as seen by the host (s)"""
+        return self._period
+
+    def observe(self, sample_index: int, host_time: float) -> None:
+        """Add an observation of the clocks.
+
+        Parameters
+        ----------
+        sample_index : int
+            Number of samples acquired by the device so far (i.e. the index of the next sample).
+        host_time : float
+            Host time at which the device notified these samples.
+        """
+        if self._n_observations >= self._min_observations:
+            residual = host_time - self._fitted_time(sample_index)
+            self._residual_variance = (
+                self._forgetting_factor * self._residual_variance + (1 - self._forgetting_factor) * residual**2
+            )
+            self._max_residual = max(self._max_residual, abs(residual))
+
+        if self._n_observations == 0:
+            # Center everything on the first observation, so the sums stay small
+            self._index_origin = sample_index
+            self._time_origin = host_time
+        x = sample_index - self._index_origin
+        y = host_time - self._time_origin
+
+        self._weight = self._forgetting_factor * self._weight + 1
+        dx = x - self._mean_index
+        self._mean_index += dx / self._weight
+        self._mean_time += (y - self._mean_time) / self._weight
+        self._covariance_index = self._forgetting_factor * self._covariance_index + dx * (x - self._mean_index)
+        self._covariance_index_time = self._forgetting_factor * self._covariance_index_time + dx * (y - self._mean_time)
+        self._n_observations += 1
+
+        if self._n_observations >= self._min_observations and self._covariance_index > 0:
+            period = self._covariance_index_time / self._covariance_index
+            self._period = float(
+                np.clip(
+                    period,
+                    self._nominal_period * (1 - self._max_drift),
+                    self._nominal_period * (1 + self._max_drift),
+                )
+            )
+
+    def timestamps(self, first_sample: int, n_samples: int) -> np.ndarray:
+        """Get the timestamps of a block of samples.
+
+        Parameters
+        ----------
+        first_sample : int
+            Index of the first sample of the block.
+        n_samples : int
+            Number of samples in the block.
+
+        Returns
+        -------
+        out : np.ndarray
+            The host time of each sample.
+        """
+        if self._n_observations == 0:
+            raise RuntimeError("The timebase needs at least one observation before giving timestamps")
+
+        if self._last_index is None:
+            start = self._fitted_time(first_sample)
+            step = self._period
+        else:
+            # Continue from the previous block and spread a bounded correction toward the fit over the block, so the
+            # sampling step only changes by a tiny fraction
+            start = self._last_time + (first_sample - self._last_index) * self._period
+            target = self._fitted_time(first_sample + n_samples)
+            end = start + n_samples * self._period
+            max_correction = self._max_slew * n_samples * self._period
+            correction = float(np.clip(target - end, -max_correction, max_correction))
+            self._total_correction += correction
+            step = self._period + correction / n_samples
+
+        self._last_index = first_sample + n_samples
+        self._last_time = start + n_samples * step
+        return start + np.arange(n_samples) * step
+
+    def time_of(self, sample_index: int) -> float:
+        """Host time of a sample, according to the timestamps handed out so far"""
+        if self._last_index is None:
+            return self._fitted_time(sample_index)
+        return self._last_time + (sample_index - self._last_index) * self._period
+
+    @property
+    def statistics(self) -> dict[str, float]:
+        """Statistics of the clocks: drift (ppm) of the device clock relative to the host clock, jitter (s) of the
+        notifications around the fit, and the total correction (s) applied to the timestamps"""
+        return {
+            "observations": self._n_observations,
+            "period": self._period,
+            "drift_ppm": (self._period / self._nominal_period - 1) * 1e6,
+            "jitter": float(np.sqrt(self._residual_variance)),
+            "max_residual": self._max_residual,
+            "offset": 0.0 if self._last_index is None else self._fitted_time(self._last_index) - self._last_time,
+            "total_correction": self._total_correction,
+        }
+
+    def _fitted_time(self, sample_index: int) -> float:
+        """Host time of the sample [sample_index] according to the fit"""
+        x = sample_index - self._index_origin
+        return self._time_origin + self._mean_time + (x - self._mean_index) * self._period
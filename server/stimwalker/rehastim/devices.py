@@ -1,10 +1,11 @@
-from datetime import datetime
-from threading import Timer
 from typing import override, Any, Callable
 from abc import ABC, abstractproperty, abstractmethod
 
 from pyScienceMode import Channel, RehastimGeneric as pyScienceModeRehastimGeneric
 
+from ..common.clock import Clock, SystemClock
+from ..common.tracing import tracer
+
 
 class RehastimGeneric(ABC):
     """
@@ -12,9 +13,10 @@ class RehastimGeneric(ABC):
     devices in the pyScienceMode library.
     """
 
-    def __init__(self, port: str, show_log: bool = False) -> None:
+    def __init__(self, port: str, show_log: bool = False, clock: Clock | None = None) -> None:
         self.port = port
         self.show_log = show_log
+        self._clock = clock if clock is not None else SystemClock()
 
         self._device = self._get_initialized_device()
         self._on_stimulation_changed_callback: dict[Any, Callable[[], None]] = {}
@@ -53,18 +55,20 @@ class RehastimGeneric(ABC):
             The duration of the stimulation in seconds. If None, the stimulation will be performed up to the call of
             [stop_stimulation].
         """
-        channels = self._get_channel_list_for_stimulation()
+        with tracer.span("rehastim.start_stimulation", category="rehastim"):
+            channels = self._get_channel_list_for_stimulation()
 
-        self._device.start_stimulation(upd_list_channels=channels)
+            with tracer.span("rehastim.serial_write", category="rehastim"):
+                self._device.start_stimulation(upd_list_channels=channels)
 
-        # Notify the listeners that the stimulation is starting
-        channels = self._get_channels()
-        now = datetime.now().timestamp()
-        for callback in self._on_stimulation_changed_callback.values():
-            callback(now, duration, channels)
+            # Notify the listeners that the stimulation is starting
+            channels = self._get_channels()
+            now = self._clock.now()
+            for callback in self._on_stimulation_changed_callback.values():
+                callback(now, duration, channels)
 
-        if duration is not None:
-            Timer(duration, self.stop_stimulation).start()
+            if duration is not None:
+                self._clock.call_later(duration, self.stop_stimulation)
 
     @abstractmethod
     def set_pulse_amplitude(self, amplitudes: float | list[float]) -> None:
@@ -120,7 +124,7 @@ class RehastimGeneric(ABC):
         self._device.pause_stimulation()
 
         # Notify the listeners that the stimulation is stopping
-        now = datetime.now().timestamp()
+        now = self._clock.now()
         channels = self._get_channels()
         for callback in self._on_stimulation_changed_callback.values():
             callback(now, 0, channels)
@@ -267,7 +271,7 @@ class Rehastim2(RehastimGeneric):
 
 
 class RehastimP24(RehastimGeneric):
-    def __init__(self, port: str, show_log: bool = False) -> None:
+    def __init__(self, port: str, show_log: bool = False, clock: Clock | None = None) -> None:
         raise NotImplementedError("The RehastimP24Device is not implemented yet.")
 
     @override
@@ -1,3 +1,5 @@
 from .runner_generic import RunnerGeneric
 from .runner_console import RunnerConsole
 from .runner_tcp import RunnerTcp
+from .runner_async_tcp import RunnerAsyncTcp
+from .shared_memory_ring import SharedMemoryRingReader, SharedMemoryRingWriter
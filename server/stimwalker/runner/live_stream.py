@@ -0,0 +1,244 @@
+from collections import deque
+from datetime import datetime
+from enum import Enum, auto
+import logging
+import threading
+import time
+from typing import Any, Callable
+
+from pyScienceMode import Channel as pyScienceModeChannel
+import numpy as np
+
+from ..common.data import Data
+from ..common.dispatcher import DropPolicy
+from ..common.tracing import tracer
+from ..nidaq import NiDaqGeneric, NiDaqData
+from ..nidaq.decimation import MinMaxDecimator
+from ..rehastim import RehastimGeneric, RehastimData
+from ..rehastim.data import Channel
+
+_logger = logging.getLogger("lokomat_fes")
+
+
+class _ItemKind(Enum):
+    BLOCK = auto()
+    GAP = auto()
+    STIMULATION = auto()
+
+
+class LiveStream:
+    """Push the new NiDaq blocks, gaps and stimulation events to a client as they arrive, instead of having the client
+    poll for them.
+
+    The device callbacks only append the items to a bounded queue (the oldest items are dropped when the client cannot
+    keep up, so the acquisition is never slowed down). A dedicated sender thread drains the queue, gathers the items in
+    a [Data] and hands it to [send]. With a [flush_interval], the sender waits for that long between two messages so
+    the items are sent in fewer, bigger messages (more latency, but less overhead per item). With a [decimator], the
+    blocks are reduced to their min/max envelope before being queued, for the clients that only display the data.
+    """
+
+    def __init__(
+        self,
+        nidaq: NiDaqGeneric,
+        rehastim: RehastimGeneric,
+        send: Callable[[Data], None],
+        t0: datetime,
+        queue_size: int = 256,
+        flush_interval: float = 0.0,
+        decimator: MinMaxDecimator | None = None,
+    ) -> None:
+        """
+        Parameters
+        ----------
+        nidaq : NiDaqGeneric
+            The device whose blocks and gaps are streamed.
+        rehastim : RehastimGeneric
+            The device whose stimulation events are streamed.
+        send : Callable[[Data], None]
+            The function sending a message to the client (called from the sender thread).
+        t0 : datetime
+            The time reference of the streamed data.
+        queue_size : int
+            Maximum number of items (blocks, gaps and events) waiting to be sent.
+        flush_interval : float
+            Minimum time between two messages in seconds (0 sends the items as soon as they arrive).
+        decimator : MinMaxDecimator | None
+            Reduces the blocks before they are queued ([default] sends every sample).
+        """
+        if queue_size < 1:
+            raise ValueError("queue_size must be at least 1")
+        if flush_interval < 0:
+            raise ValueError("flush_interval must be positive")
+
+        self._nidaq = nidaq
+        self._rehastim = rehastim
+        self._send = send
+        self._t0 = t0
+        self._queue_size = queue_size
+        self._flush_interval = flush_interval
+        self._decimator = decimator
+
+        self._queue: deque[tuple[_ItemKind, tuple]] = deque()
+        self._has_items = threading.Condition()
+        self._exit_flag = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._last_channels: tuple[Channel, ...] = ()
+
+        self.queued = 0
+        self.dropped = 0
+        self.messages_sent = 0
+        self.errors = 0
+
+    @property
+    def is_running(self) -> bool:
+        return self._thread is not None
+
+    @property
+    def pending(self) -> int:
+        """Number of items waiting to be sent"""
+        return len(self._queue)
+
+    @property
+    def statistics(self) -> dict[str, Any]:
+        """Counters of the stream"""
+        statistics = {
+            "queued": self.queued,
+            "dropped": self.dropped,
+            "pending": self.pending,
+            "messages_sent": self.messages_sent,
+            "errors": self.errors,
+            "queue_size": self._queue_size,
+            "flush_interval": self._flush_interval,
+        }
+        if self._decimator is not None:
+            statistics["samples_in"] = self._decimator.samples_in
+            statistics["samples_out"] = self._decimator.samples_out
+        return statistics
+
+    def start(self) -> None:
+        if self.is_running:
+            raise RuntimeError("The live stream is already running")
+
+        _logger.info(f"Starting the live stream (flush interval of {self._flush_interval * 1000:g} ms)")
+        self._exit_flag.clear()
+        self._thread = threading.Thread(target=self._run, name="LiveStream", daemon=True)
+        self._thread.start()
+
+        # The queue of the stream is the one that drops, the subscription only has to never stall the dispatcher
+        self._nidaq.register_to_data_ready(
+            self._on_data_ready,
+            queue_size=self._queue_size,
+            drop_policy=DropPolicy.DROP_OLDEST,
+            on_gap=self._on_gap_detected,
+        )
+        self._rehastim.register_to_on_stimulation_changed(self._on_stimulation_changed)
+
+    def stop(self) -> None:
+        """Stop streaming, the items still queued are sent first"""
+        if not self.is_running:
+            return
+
+        self._nidaq.unregister_to_data_ready(self._on_data_ready)
+        self._rehastim.unregister_to_on_stimulation_changed(self._on_stimulation_changed)
+        if self._decimator is not None and (envelope := self._decimator.flush()) is not None:
+            self._enqueue(_ItemKind.BLOCK, envelope)
+
+        self._exit_flag.set()
+        with self._has_items:
+            self._has_items.notify()
+        self._thread.join()
+        self._thread = None
+        _logger.info(f"Stopped the live stream ({self.messages_sent} messages sent, {self.dropped} items dropped)")
+
+    def _on_data_ready(self, t: np.ndarray, data: np.ndarray) -> None:
+        if self._decimator is not None:
+            envelope = self._decimator.add(t, data)
+            if envelope is None:
+                return  # The buckets of the block are not complete yet
+            t, data = envelope
+        self._enqueue(_ItemKind.BLOCK, (t, data))
+
+    def _on_gap_detected(self, t: float, n_samples: int) -> None:
+        self._enqueue(_ItemKind.GAP, (t, n_samples))
+
+    def _on_stimulation_changed(self, now: float, duration: float | None, channels: tuple[Channel, ...] | None) -> None:
+        # Resolve the channels now, as the client cannot know them if the previous event was in another message
+        self._last_channels = _resolve_channels(channels, self._last_channels)
+        self._enqueue(_ItemKind.STIMULATION, (now, duration, self._last_channels))
+
+    def _enqueue(self, kind: _ItemKind, item: tuple) -> None:
+        # The blocks and the events come from different threads, so making room and appending is done under the lock
+        with self._has_items:
+            if len(self._queue) >= self._queue_size:
+                self._queue.popleft()
+                self.dropped += 1
+            self._queue.append((kind, item))
+            self.queued += 1
+            self._has_items.notify()
+
+    def _run(self) -> None:
+        last_sent_at = time.perf_counter()
+        while True:
+            with self._has_items:
+                while not self._queue and not self._exit_flag.is_set():
+                    self._has_items.wait(timeout=0.1)
+            if not self._queue and self._exit_flag.is_set():
+                break
+
+            # Gather more items until the flush interval is over (the stop cuts it short)
+            if self._flush_interval > 0:
+                self._exit_flag.wait(self._flush_interval - (time.perf_counter() - last_sent_at))
+
+            message = self._drain()
+            try:
+                with tracer.span("stream.send", category="tcp", n_blocks=len(message.nidaq)):
+                    self._send(message)
+                self.messages_sent += 1
+            except Exception:
+                # The client is gone, the items are discarded until the stream is stopped
+                self.errors += 1
+                _logger.exception("Could not send the live stream to the client")
+            last_sent_at = time.perf_counter()
+
+    def _drain(self) -> Data:
+        """Move all the queued items into a [Data]"""
+        with self._has_items:
+            items = list(self._queue)
+            self._queue.clear()
+        return _to_data(items, self._t0)
+
+
+def _resolve_channels(
+    channels: tuple[Channel | pyScienceModeChannel, ...] | None, previous: tuple[Channel, ...]
+) -> tuple[Channel, ...]:
+    """The channels of a stimulation event as [Channel] (the [previous] ones if they did not change)"""
+    if channels is None:
+        return previous
+    return tuple(
+        (
+            Channel.from_pysciencemode(channel)
+            if isinstance(channel, pyScienceModeChannel)
+            else Channel(channel.channel_index, channel.amplitude)
+        )
+        for channel in channels
+    )
+
+
+def _to_data(items: list[tuple[_ItemKind, tuple]], t0: datetime) -> Data:
+    """Gather the blocks, gaps and stimulation events in a [Data]"""
+    t = []
+    data = []
+    gaps = []
+    events = []
+    for kind, item in items:
+        if kind == _ItemKind.BLOCK:
+            t.append(item[0])
+            data.append(item[1])
+        elif kind == _ItemKind.GAP:
+            gaps.append(item)
+        else:
+            events.append(item)
+
+    nidaq = NiDaqData(t0=t0, t=t, data=data, gaps=gaps)
+    rehastim = RehastimData(t0=t0, data=events)
+    return Data(nidaq=nidaq, rehastim=rehastim, t0=t0)
@@ -0,0 +1,568 @@
+"""
+Binary framing of the messages sent on the data socket.
+
+Each message is a frame: a header followed by [length] bytes of payload. All the numbers are little-endian.
+
+    header (8 bytes): magic "SW" (2 bytes), version (uint8), message type (uint8), payload length (uint32)
+
+Commands can also be sent framed on the command socket (instead of the unframed "command:parameter1,parameter2"), so
+several commands can be sent without waiting for the responses (which carry the id of their request):
+
+    COMMAND payload: request id (uint32), command (uint16), number of parameters (uint16), then for each parameter its
+        length (uint16) and its UTF-8 bytes
+    RESPONSE payload: request id (uint32), status (uint8: 0 is OK, 1 is ERROR), then what the command replied (the
+        messages it would have sent on the data socket, if any)
+
+The payload of a SEQUENCED_DATA message (what fetch_since returns) is the sequence number of the first and of the last
+item sent (int64 each), followed by a DATA payload.
+
+The payload of a JSON message is UTF-8 encoded JSON. The payload of a DATA message (what a fetch returns) is made of
+the following sections, one after the other, each column being a contiguous array:
+
+    summary (34 bytes): t0 (float64), sample type (uint8: 4 is float32, 8 is float64), timebase kind (uint8),
+        number of channels (uint32), of blocks (uint32), of samples (uint32), of gaps (uint32), of stimulation
+        events (uint32), of stimulation channels over all the events (uint32)
+    timebase: number of samples of each block (uint32[blocks]), then
+        if the kind is UNIFORM: time of the first sample (float64[blocks]) and step (float64[blocks]) of each block
+        if the kind is EXPLICIT: time of each sample (float64[samples])
+    samples: channels x samples (sample type), each channel being contiguous
+    gaps: time of the first missing sample (float64[gaps]), number of missing samples (int64[gaps])
+    stimulation events: time (float64[events]), duration (float64[events], NaN if None), number of channels of each
+        event (uint16[events]), then for all the channels of all the events: channel index (uint16[channels]),
+        amplitude (float32[channels])
+
+Once a client asked for it (compression command), the messages whose payload is at least [threshold] bytes are sent
+compressed, unless compressing does not make them smaller:
+
+    COMPRESSED payload: codec (uint8: 1 is zlib, 2 is lzma), flags (uint8: 1 if the samples are delta encoded), type
+        of the original message (uint8), reserved (1 byte), length of the original payload (uint32), then the original
+        payload compressed
+
+The samples of a delta encoded DATA (or SEQUENCED_DATA) payload are, for each channel, its first sample followed by
+the difference between each sample and the previous one. The differences are taken on the bits of the samples read as
+unsigned integers (modulo 2^32 or 2^64), so the encoding is lossless, and the slowly varying signals give small
+differences whose upper bytes are mostly zeros, which compress a lot better than the raw samples.
+"""
+
+from datetime import datetime
+from enum import IntEnum
+import lzma
+import struct
+import threading
+import time
+import zlib
+
+import numpy as np
+
+from ..common.data import Data
+from ..nidaq.data import NiDaqData
+from ..rehastim.data import Channel, RehastimData
+
+MAGIC = b"SW"
+PROTOCOL_VERSION = 1
+JSON_PROTOCOL_VERSION = 0  # The unframed JSON messages, kept for the clients that do not negotiate
+SUPPORTED_VERSIONS = (JSON_PROTOCOL_VERSION, PROTOCOL_VERSION)
+
+_HEADER = struct.Struct("<2sBBI")
+_SUMMARY = struct.Struct("<dBBIIIIII")
+_COMMAND = struct.Struct("<IHH")
+_PARAMETER_LENGTH = struct.Struct("<H")
+_RESPONSE = struct.Struct("<IB")
+_SEQUENCES = struct.Struct("<qq")
+_COMPRESSED = struct.Struct("<BBBxI")
+_DELTA_ENCODED = 1
+HEADER_SIZE = _HEADER.size
+MAX_COMMAND_SIZE = 1 << 16  # A command frame announcing a longer payload is not trusted
+
+# The blocks whose timestamps are within this fraction of their step of a uniform grid are sent as (first time, step)
+_UNIFORM_TOLERANCE = 1e-6
+
+
+class MessageType(IntEnum):
+    JSON = 0
+    DATA = 1
+    COMMAND = 2
+    RESPONSE = 3
+    SEQUENCED_DATA = 4
+    COMPRESSED = 5
+
+
+class Status(IntEnum):
+    OK = 0
+    ERROR = 1
+
+
+class TimebaseKind(IntEnum):
+    UNIFORM = 0
+    EXPLICIT = 1
+
+
+class Codec(IntEnum):
+    NONE = 0
+    ZLIB = 1
+    LZMA = 2
+
+
+_SAMPLE_TYPES = {"float32": np.dtype("<f4"), "float64": np.dtype("<f8")}
+
+
+def sample_type(name: str) -> np.dtype:
+    """The type of the samples from its name ("float32" or "float64")"""
+    if name not in _SAMPLE_TYPES:
+        raise ValueError(f"Unknown sample type {name}, it must be one of {', '.join(_SAMPLE_TYPES)}")
+    return _SAMPLE_TYPES[name]
+
+
+def encode_frame(message_type: MessageType, payload: bytes | bytearray | memoryview) -> bytes:
+    """Prepend the header to a payload"""
+    return _HEADER.pack(MAGIC, PROTOCOL_VERSION, message_type, len(payload)) + payload
+
+
+def decode_header(header: bytes) -> tuple[MessageType, int]:
+    """The type and payload length of a frame from its header"""
+    magic, version, message_type, length = _HEADER.unpack(header)
+    if magic != MAGIC:
+        raise ValueError("Not a frame of the stimwalker protocol")
+    if version != PROTOCOL_VERSION:
+        raise ValueError(f"Unsupported version {version} of the protocol")
+    return MessageType(message_type), length
+
+
+def encode_command(request_id: int, command: int, parameters: list[str] | tuple[str, ...] = ()) -> bytes:
+    """A complete COMMAND frame (what a client sends)"""
+    payload = [_COMMAND.pack(request_id, command, len(parameters))]
+    for parameter in parameters:
+        encoded = parameter.encode()
+        payload.append(_PARAMETER_LENGTH.pack(len(encoded)))
+        payload.append(encoded)
+    return encode_frame(MessageType.COMMAND, b"".join(payload))
+
+
+def decode_command(payload: bytes | memoryview) -> tuple[int, int, list[str]]:
+    """The request id, command and parameters of a COMMAND payload. Raises a ValueError if the payload is not exactly
+    a command (truncated, or with bytes after the last parameter)."""
+    payload = memoryview(payload)
+    if len(payload) < _COMMAND.size:
+        raise ValueError("Truncated command")
+    request_id, command, n_parameters = _COMMAND.unpack_from(payload)
+    offset = _COMMAND.size
+    parameters = []
+    for _ in range(n_parameters):
+        if offset + _PARAMETER_LENGTH.size > len(payload):
+            raise ValueError("Truncated command parameters")
+        (length,) = _PARAMETER_LENGTH.unpack_from(payload, offset)
+        offset += _PARAMETER_LENGTH.size
+        if offset + length > len(payload):
+            raise ValueError("Truncated command parameters")
+        parameters.append(bytes(payload[offset : offset + length]).decode())
+        offset += length
+    if offset != len(payload):
+        raise ValueError(f"{len(payload) - offset} unexpected bytes after the command parameters")
+    return request_id, command, parameters
+
+
+def encode_response(request_id: int, success: bool, payload: bytes | bytearray | memoryview = b"") -> bytes:
+    """A complete RESPONSE frame (what the server answers to a COMMAND frame)"""
+    status = Status.OK if success else Status.ERROR
+    return encode_frame(MessageType.RESPONSE, _RESPONSE.pack(request_id, status) + payload)
+
+
+def decode_response(payload: bytes | memoryview) -> tuple[int, bool, bytes]:
+    """The request id, success and reply of a RESPONSE payload"""
+    if len(payload) < _RESPONSE.size:
+        raise ValueError("Truncated response")
+    request_id, status = _RESPONSE.unpack_from(payload)
+    return request_id, status == Status.OK, bytes(payload[_RESPONSE.size :])
+
+
+class FrameReader:
+    """Split a stream of bytes into frames, whatever the way the bytes were segmented (several frames in one read, or
+    a frame over several reads)"""
+
+    def __init__(self, max_payload: int | None = None) -> None:
+        """
+        Parameters
+        ----------
+        max_payload : int | None
+            The longest payload accepted, a longer one raises a ValueError (None accepts any length).
+        """
+        self._buffer = bytearray()
+        self._max_payload = max_payload
+
+    def __len__(self) -> int:
+        """Number of bytes buffered"""
+        return len(self._buffer)
+
+    def feed(self, data: bytes) -> None:
+        self._buffer += data
+
+    def starts_with_frame(self) -> bool:
+        """Whether the bytes buffered start like a frame (so the unframed messages can be told apart)"""
+        return MAGIC.startswith(bytes(self._buffer[: len(MAGIC)]))
+
+    def next_frame(self) -> tuple[MessageType, bytes] | None:
+        """The next complete frame (type, payload), or None if more bytes are needed"""
+        if len(self._buffer) < HEADER_SIZE:
+            return None
+        message_type, length = decode_header(bytes(self._buffer[:HEADER_SIZE]))
+        if self._max_payload is not None and length > self._max_payload:
+            raise ValueError(f"Frame of {length} bytes, the maximum is {self._max_payload}")
+        if len(self._buffer) < HEADER_SIZE + length:
+            return None
+        payload = bytes(self._buffer[HEADER_SIZE : HEADER_SIZE + length])
+        del self._buffer[: HEADER_SIZE + length]
+        return message_type, payload
+
+    def take(self) -> bytes:
+        """Take all the bytes buffered (for the messages that are not framed)"""
+        out = bytes(self._buffer)
+        self._buffer.clear()
+        return out
+
+
+def encode_data(data: Data, dtype: np.dtype = _SAMPLE_TYPES["float32"]) -> list[bytes | memoryview]:
+    """Encode the payload of a DATA message. It is returned as a list of buffers (so the arrays are not copied once more
+    to be joined), which can be joined or written one after the other.
+
+    Parameters
+    ----------
+    data : Data
+        The data to encode.
+    dtype : np.dtype
+        The type of the samples.
+    """
+    nidaq = data.nidaq
+    t_blocks = list(nidaq._t)
+    data_blocks = list(nidaq._data)[: len(t_blocks)]
+    n_channels = data_blocks[0].shape[0] if data_blocks else 0
+    counts = np.array([t.shape[0] for t in t_blocks], dtype="<u4")
+    n_samples = int(counts.sum())
+
+    # Timebase: (first time, step) of each block, unless a block is not uniformly sampled
+    starts = np.array([t[0] if t.shape[0] else np.nan for t in t_blocks], dtype="<f8")
+    steps = np.array([(t[-1] - t[0]) / (t.shape[0] - 1) if t.shape[0] > 1 else 0.0 for t in t_blocks], dtype="<f8")
+    is_uniform = all(t.shape[0] < 3 or _is_uniform(t, step) for t, step in zip(t_blocks, steps))
+    if is_uniform:
+        timebase = [counts, starts, steps]
+    else:
+        timebase = [counts, np.concatenate(t_blocks).astype("<f8", copy=False) if t_blocks else np.zeros(0)]
+
+    samples = np.concatenate(data_blocks, axis=1) if data_blocks else np.zeros((0, 0))
+    samples = np.ascontiguousarray(samples, dtype=dtype)
+
+    gaps = nidaq.gaps
+    gap_times = np.array([gap[0] for gap in gaps], dtype="<f8")
+    gap_counts = np.array([gap[1] for gap in gaps], dtype="<i8")
+
+    events = list(data.rehastim._data)
+    event_times = np.array([event[0] for event in events], dtype="<f8")
+    event_durations = np.array([np.nan if event[1] is None else event[1] for event in events], dtype="<f8")
+    channels = [event[2] if event[2] is not None else () for event in events]
+    channel_counts = np.array([len(event_channels) for event_channels in channels], dtype="<u2")
+    channel_indices = np.array([channel.channel_index for c in channels for channel in c], dtype="<u2")
+    channel_amplitudes = np.array([channel.amplitude for c in channels for channel in c], dtype="<f4")
+
+    summary = _SUMMARY.pack(
+        data._t0,
+        dtype.itemsize,
+        TimebaseKind.UNIFORM if is_uniform else TimebaseKind.EXPLICIT,
+        n_channels,
+        len(t_blocks),
+        n_samples,
+        len(gaps),
+        len(events),
+        len(channel_indices),
+    )
+    arrays = [
+        *timebase,
+        samples,
+        gap_times,
+        gap_counts,
+        event_times,
+        event_durations,
+        channel_counts,
+        channel_indices,
+        channel_amplitudes,
+    ]
+    return [summary, *(memoryview(array).cast("B") for array in arrays if array.size > 0)]
+
+
+class Compression:
+    """The compression of the messages sent to a client, as it negotiated it (see the module for the COMPRESSED
+    messages). The messages are compressed by the thread encoding them (the one executing the command, or the sender
+    thread of the live stream), never by the acquisition or the scheduler.
+
+    Attributes
+    ----------
+    messages : int
+        Number of messages compressed.
+    bytes_in : int
+        Size of their original payloads in bytes.
+    bytes_out : int
+        Size of their compressed payloads in bytes (the messages sent uncompressed because compressing them did not
+        make them smaller count for their original size).
+    seconds : float
+        Time spent compressing them (CPU of the thread encoding them).
+    """
+
+    def __init__(
+        self, codec: Codec = Codec.NONE, threshold: int = 1024, level: int | None = None, delta: bool = False
+    ) -> None:
+        """
+        Parameters
+        ----------
+        codec : Codec
+            The compression algorithm (Codec.NONE sends the messages as they are).
+        threshold : int
+            The payloads smaller than this number of bytes are not compressed (it is not worth it).
+        level : int | None
+            The compression level (0 to 9 for both codecs, [default] is the default of the codec).
+        delta : bool
+            Whether to delta encode the samples of the DATA and SEQUENCED_DATA messages before compressing them.
+        """
+        codec = Codec(codec)
+        if threshold < 0:
+            raise ValueError("threshold must be positive")
+        if level is not None and not 0 <= level <= 9:
+            raise ValueError("level must be between 0 and 9")
+
+        self._codec = codec
+        self._threshold = threshold
+        self._level = level
+        self._delta = delta
+        self._mutex = threading.Lock()  # The live stream compresses from its thread, the commands from theirs
+
+        self.messages = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.seconds = 0.0
+
+    @classmethod
+    def from_parameters(cls, parameters: list[str]) -> "Compression":
+        """The compression from the parameters of the compression command: the codec ("none", "zlib" or "lzma"), then
+        optionally the threshold in bytes, the level and whether to delta encode the samples (0 or 1)"""
+        if not parameters or len(parameters) > 4:
+            raise ValueError("Expected the codec, then optionally the threshold, the level and the delta encoding")
+        names = {codec.name.lower(): codec for codec in Codec}
+        if parameters[0] not in names:
+            raise ValueError(f"Unknown codec {parameters[0]}, it must be one of {', '.join(names)}")
+
+        threshold = int(parameters[1]) if len(parameters) > 1 and parameters[1] else 1024
+        level = int(parameters[2]) if len(parameters) > 2 and parameters[2] else None
+        delta = bool(int(parameters[3])) if len(parameters) > 3 and parameters[3] else False
+        return cls(codec=names[parameters[0]], threshold=threshold, level=level, delta=delta)
+
+    @property
+    def codec(self) -> Codec:
+        return self._codec
+
+    @property
+    def threshold(self) -> int:
+        return self._threshold
+
+    @property
+    def level(self) -> int | None:
+        return self._level
+
+    @property
+    def delta(self) -> bool:
+        return self._delta
+
+    @property
+    def ratio(self) -> float:
+        """Size of the original payloads over the size sent, over all the messages compressed so far"""
+        return self.bytes_in / self.bytes_out if self.bytes_out else 1.0
+
+    def compress(
+        self, message_type: MessageType, payload: list[bytes | memoryview]
+    ) -> tuple[MessageType, list[bytes | memoryview]]:
+        """The message to send for a payload: compressed if it is worth it, the message itself otherwise"""
+        length = sum(len(buffer) for buffer in payload)
+        if self._codec == Codec.NONE or length < self._threshold:
+            return message_type, payload
+
+        started_at = time.perf_counter()
+        original = bytearray().join(payload)
+        flags = 0
+        if self._delta and message_type in (MessageType.DATA, MessageType.SEQUENCED_DATA):
+            offset = _SEQUENCES.size if message_type == MessageType.SEQUENCED_DATA else 0
+            _delta_samples(original, offset, encode=True)
+            flags |= _DELTA_ENCODED
+        if self._codec == Codec.ZLIB:
+            compressed = zlib.compress(original, -1 if self._level is None else self._level)
+        else:
+            compressed = lzma.compress(original, preset=6 if self._level is None else self._level)
+        is_smaller = len(compressed) + _COMPRESSED.size < length
+
+        self._mutex.acquire()
+        try:
+            self.messages += 1
+            self.bytes_in += length
+            self.bytes_out += len(compressed) + _COMPRESSED.size if is_smaller else length
+            self.seconds += time.perf_counter() - started_at
+        finally:
+            self._mutex.release()
+
+        if not is_smaller:
+            return message_type, payload
+        return MessageType.COMPRESSED, [_COMPRESSED.pack(self._codec, flags, message_type, length), compressed]
+
+
+def decompress(payload: bytes | memoryview) -> tuple[MessageType, bytes]:
+    """The type and payload of the original message of a COMPRESSED payload (what a Python client would do)"""
+    codec, flags, message_type, length = _COMPRESSED.unpack_from(payload)
+    compressed = memoryview(payload)[_COMPRESSED.size :]
+    if codec == Codec.ZLIB:
+        original = zlib.decompress(compressed)
+    elif codec == Codec.LZMA:
+        original = lzma.decompress(compressed)
+    else:
+        raise ValueError(f"Unknown codec {codec}")
+    if len(original) != length:
+        raise ValueError(f"Decompressed {len(original)} bytes, the original message had {length}")
+
+    message_type = MessageType(message_type)
+    if flags & _DELTA_ENCODED:
+        original = bytearray(original)
+        _delta_samples(original, _SEQUENCES.size if message_type == MessageType.SEQUENCED_DATA else 0, encode=False)
+    return message_type, bytes(original)
+
+
+def _delta_samples(payload: bytearray, offset: int, encode: bool) -> None:
+    """Delta encode (or decode) in place the samples of the DATA payload starting at [offset] of [payload]"""
+    _, itemsize, timebase_kind, n_channels, n_blocks, n_samples, *_ = _SUMMARY.unpack_from(payload, offset)
+    timebase_size = 4 * n_blocks + (16 * n_blocks if timebase_kind == TimebaseKind.UNIFORM else 8 * n_samples)
+    samples = np.frombuffer(
+        payload,
+        dtype={4: "<u4", 8: "<u8"}[itemsize],
+        count=n_channels * n_samples,
+        offset=offset + _SUMMARY.size + timebase_size,
+    ).reshape(n_channels, n_samples)
+    if encode:
+        samples[:, 1:] = np.diff(samples, axis=1)  # Wraps around, as the unsigned integers do
+    else:
+        np.cumsum(samples, axis=1, dtype=samples.dtype, out=samples)
+
+
+def frame_buffers(
+    message_type: MessageType, payload: list[bytes | memoryview], compression: Compression | None = None
+) -> list[bytes | memoryview]:
+    """A complete frame as a list of buffers: the header, then the buffers of the payload (not joined, so they can be
+    written with a single vectored write, e.g. socket.sendmsg). The frame is compressed if a compression is given and
+    it is worth it."""
+    if compression is not None:
+        message_type, payload = compression.compress(message_type, payload)
+    length = sum(len(buffer) for buffer in payload)
+    return [_HEADER.pack(MAGIC, PROTOCOL_VERSION, message_type, length), *payload]
+
+
+def data_frame_buffers(
+    data: Data, dtype: np.dtype = _SAMPLE_TYPES["float32"], compression: Compression | None = None
+) -> list[bytes | memoryview]:
+    """A complete DATA frame, as a list of buffers"""
+    return frame_buffers(MessageType.DATA, encode_data(data, dtype), compression)
+
+
+def encode_data_frame(data: Data, dtype: np.dtype = _SAMPLE_TYPES["float32"]) -> bytes:
+    """A complete DATA frame (header and payload)"""
+    return b"".join(data_frame_buffers(data, dtype))
+
+
+def sequenced_data_frame_buffers(
+    data: Data,
+    first: int,
+    last: int,
+    dtype: np.dtype = _SAMPLE_TYPES["float32"],
+    compression: Compression | None = None,
+) -> list[bytes | memoryview]:
+    """A complete SEQUENCED_DATA frame, as a list of buffers"""
+    return frame_buffers(
+        MessageType.SEQUENCED_DATA, [_SEQUENCES.pack(first, last), *encode_data(data, dtype)], compression
+    )
+
+
+def encode_sequenced_data_frame(data: Data, first: int, last: int, dtype: np.dtype = _SAMPLE_TYPES["float32"]) -> bytes:
+    """A complete SEQUENCED_DATA frame: the data and the sequence numbers of the first and last items they hold"""
+    return b"".join(sequenced_data_frame_buffers(data, first, last, dtype))
+
+
+def decode_sequenced_data(payload: bytes | memoryview) -> tuple[int, int, Data]:
+    """The sequence numbers of the first and last items, and the data of a SEQUENCED_DATA payload"""
+    first, last = _SEQUENCES.unpack_from(payload)
+    return first, last, decode_data(memoryview(payload)[_SEQUENCES.size :])
+
+
+def _is_uniform(t: np.ndarray, step: float) -> bool:
+    """Whether the timestamps [t] of a block are on the grid starting at their first time with [step].
+
+    The offsets from the first time are compared (they are small, so they are exact even for epoch timestamps), within
+    a fraction of the step, or within the resolution of the timestamps themselves when they are larger than that (the
+    epoch timestamps are only resolved to about 0.2 us).
+    """
+    resolution = 2 * np.spacing(max(abs(t[0]), abs(t[-1])))
+    tolerance = max(_UNIFORM_TOLERANCE * abs(step), resolution)
+    return np.max(np.abs((t - t[0]) - np.arange(t.shape[0]) * step)) <= tolerance
+
+
+def decode_data(payload: bytes | memoryview) -> Data:
+    """Decode the payload of a DATA message (what a Python client would do)"""
+    payload = memoryview(payload)
+    t0, itemsize, timebase_kind, n_channels, n_blocks, n_samples, n_gaps, n_events, n_event_channels = (
+        _SUMMARY.unpack_from(payload)
+    )
+    reader = _Reader(payload, _SUMMARY.size)
+    dtype = {4: _SAMPLE_TYPES["float32"], 8: _SAMPLE_TYPES["float64"]}[itemsize]
+
+    counts = reader.read("<u4", n_blocks)
+    if timebase_kind == TimebaseKind.UNIFORM:
+        starts = reader.read("<f8", n_blocks)
+        steps = reader.read("<f8", n_blocks)
+        t = [start + np.arange(count) * step for start, step, count in zip(starts, steps, counts)]
+    else:
+        times = reader.read("<f8", n_samples)
+        t = np.split(times, np.cumsum(counts)[:-1]) if n_blocks else []
+    samples = reader.read(dtype, n_channels * n_samples).reshape(n_channels, n_samples)
+    blocks = np.split(samples, np.cumsum(counts)[:-1], axis=1) if n_blocks else []
+
+    gap_times = reader.read("<f8", n_gaps)
+    gap_counts = reader.read("<i8", n_gaps)
+
+    event_times = reader.read("<f8", n_events)
+    event_durations = reader.read("<f8", n_events)
+    channel_counts = reader.read("<u2", n_events)
+    channel_indices = reader.read("<u2", n_event_channels)
+    channel_amplitudes = reader.read("<f4", n_event_channels)
+
+    events = []
+    first_channel = 0
+    for time, duration, count in zip(event_times, event_durations, channel_counts):
+        channels = tuple(
+            Channel(int(index), float(amplitude))
+            for index, amplitude in zip(
+                channel_indices[first_channel : first_channel + count],
+                channel_amplitudes[first_channel : first_channel + count],
+            )
+        )
+        first_channel += count
+        events.append((float(time), None if np.isnan(duration) else float(duration), channels))
+
+    t0_datetime = datetime.fromtimestamp(t0)
+    nidaq = NiDaqData(
+        t0=t0_datetime, t=list(t), data=list(blocks), gaps=[(float(g), int(n)) for g, n in zip(gap_times, gap_counts)]
+    )
+    rehastim = RehastimData(t0=t0_datetime, data=events)
+    return Data(nidaq=nidaq, rehastim=rehastim, t0=t0_datetime)
+
+
+class _Reader:
+    """Read the consecutive arrays of a payload"""
+
+    def __init__(self, payload: memoryview, offset: int) -> None:
+        self._payload = payload
+        self._offset = offset
+
+    def read(self, dtype, count: int) -> np.ndarray:
+        dtype = np.dtype(dtype)
+        out = np.frombuffer(self._payload, dtype=dtype, count=count, offset=self._offset)
+        self._offset += count * dtype.itemsize
+        return out
@@ -0,0 +1,160 @@
+from collections import deque
+from datetime import datetime
+from itertools import islice
+import logging
+import threading
+
+import numpy as np
+
+from ..common.data import Data
+from ..nidaq import NiDaqGeneric
+from ..rehastim import RehastimGeneric
+from ..rehastim.data import Channel
+from .live_stream import _ItemKind, _resolve_channels, _to_data
+
+_logger = logging.getLogger("lokomat_fes")
+
+
+class RetentionBuffer:
+    """Keep the last NiDaq blocks, gaps and stimulation events, each numbered by a sequence number, so a client can ask
+    for "everything after sequence n" (e.g. to resume where it was after a reconnection).
+
+    The sequence numbers are shared by all the items, they start at 0 and always increase (they are not reset when the
+    continuous data are). Only the last [size] items, holding at most [max_bytes] of NiDaq blocks, are retained: a client
+    asking for older items only gets those still retained, and can tell how many it missed from the first sequence
+    number it receives.
+    """
+
+    def __init__(
+        self, nidaq: NiDaqGeneric, rehastim: RehastimGeneric, size: int = 10000, max_bytes: int | None = None
+    ) -> None:
+        """
+        Parameters
+        ----------
+        nidaq : NiDaqGeneric
+            The device whose blocks and gaps are retained.
+        rehastim : RehastimGeneric
+            The device whose stimulation events are retained.
+        size : int
+            Maximum number of items (blocks, gaps and events) retained.
+        max_bytes : int | None
+            Maximum memory held by the NiDaq blocks retained (the newest block is always retained), None for no limit
+            other than [size].
+        """
+        if size < 1:
+            raise ValueError("size must be at least 1")
+        if max_bytes is not None and max_bytes < 1:
+            raise ValueError("max_bytes must be at least 1")
+
+        self._nidaq = nidaq
+        self._rehastim = rehastim
+        self._size = size
+        self._max_bytes = max_bytes
+        self._items: deque[tuple[_ItemKind, tuple, int]] = deque()  # The kind, the item and its size in bytes
+        self._nbytes = 0
+        self._next_sequence = 0
+        self._last_channels: tuple[Channel, ...] = ()
+        self._mutex = threading.Lock()  # The devices add the items from their threads, the runner reads them
+        self._is_running = False
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    @property
+    def max_bytes(self) -> int | None:
+        return self._max_bytes
+
+    @property
+    def nbytes(self) -> int:
+        """The memory held by the NiDaq blocks retained"""
+        return self._nbytes
+
+    @property
+    def first_sequence(self) -> int:
+        """The sequence number of the oldest item retained"""
+        return self._next_sequence - len(self._items)
+
+    @property
+    def last_sequence(self) -> int:
+        """The sequence number of the newest item (-1 if there was none yet)"""
+        return self._next_sequence - 1
+
+    def start(self) -> None:
+        if self._is_running:
+            return
+        self._nidaq.register_to_data_ready(self._on_data_ready, on_gap=self._on_gap_detected)
+        self._rehastim.register_to_on_stimulation_changed(self._on_stimulation_changed)
+        self._is_running = True
+
+    def stop(self) -> None:
+        if not self._is_running:
+            return
+        self._nidaq.unregister_to_data_ready(self._on_data_ready)
+        self._rehastim.unregister_to_on_stimulation_changed(self._on_stimulation_changed)
+        self._is_running = False
+
+    def since(self, sequence: int, t0: datetime) -> tuple[int, int, Data]:
+        """Get the items that came after an item.
+
+        Parameters
+        ----------
+        sequence : int
+            The sequence number of the last item the client has (-1 to get all the items retained).
+        t0 : datetime
+            The time reference of the returned data.
+
+        Returns
+        -------
+        first : int
+            The sequence number of the first item returned (more than [sequence] + 1 if some were not retained).
+        last : int
+            The sequence number of the last item returned (what to ask next time), [sequence] if there is none.
+        data : Data
+            The items.
+        """
+        self._mutex.acquire()
+        try:
+            if sequence > self.last_sequence:
+                raise ValueError(f"Sequence {sequence} is ahead of the last one ({self.last_sequence})")
+
+            first = max(sequence + 1, self.first_sequence)
+            # The new items are at the end, so only them are visited
+            items = list(islice(reversed(self._items), self._next_sequence - first))
+            last = self.last_sequence
+        finally:
+            self._mutex.release()
+
+        items = [(kind, item) for kind, item, _ in reversed(items)]
+        return first, max(last, sequence), _to_data(items, t0)
+
+    def _on_data_ready(self, t: np.ndarray, data: np.ndarray) -> None:
+        self._append(_ItemKind.BLOCK, (t, data), nbytes=t.nbytes + data.nbytes)
+
+    def _on_gap_detected(self, t: float, n_samples: int) -> None:
+        self._append(_ItemKind.GAP, (t, n_samples))
+
+    def _on_stimulation_changed(self, now: float, duration: float | None, channels: tuple[Channel, ...] | None) -> None:
+        self._mutex.acquire()
+        try:
+            self._last_channels = _resolve_channels(channels, self._last_channels)
+            self._retain(_ItemKind.STIMULATION, (now, duration, self._last_channels), nbytes=0)
+        finally:
+            self._mutex.release()
+
+    def _append(self, kind: _ItemKind, item: tuple, nbytes: int = 0) -> None:
+        self._mutex.acquire()
+        try:
+            self._retain(kind, item, nbytes)
+        finally:
+            self._mutex.release()
+
+    def _retain(self, kind: _ItemKind, item: tuple, nbytes: int) -> None:
+        """Add an item and forget the oldest ones beyond the bounds (the mutex must be held)"""
+        self._items.append((kind, item, nbytes))
+        self._nbytes += nbytes
+        self._next_sequence += 1
+        while len(self._items) > self._size or (
+            self._max_bytes is not None and self._nbytes > self._max_bytes and len(self._items) > 1
+        ):
+            self._nbytes -= self._items.popleft()[2]
@@ -0,0 +1,466 @@
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from enum import Enum
+import itertools
+import json
+import logging
+import os
+import secrets
+import threading
+from typing import Callable, override
+
+from stimwalker.common.data import Data
+from stimwalker.common.metrics import metrics
+from stimwalker.common.tracing import tracer
+
+from . import protocol
+from .runner_tcp import RunnerTcp, _Command, _CommandReader, _acknowledgment, _payload_size
+
+_logger = logging.getLogger("lokomat_fes")
+
+# Time (in seconds) a data connection has to send the token pairing it with the command connection of its client
+_PAIRING_TIMEOUT = 5.0
+
+
+class _Role(Enum):
+    CONTROLLER = "controller"  # Can send every command
+    OBSERVER = "observer"  # Can only look at the data (e.g. a monitor or a logger)
+
+
+# The commands an observer can send, none of them drives the devices nor changes the state shared by the clients
+_OBSERVER_COMMANDS = tuple(
+    str(command)
+    for command in (
+        _Command.AVAILABLE_SCHEDULES,
+        _Command.GET_SCHEDULE,
+        _Command.METRICS,
+        _Command.HANDSHAKE,
+        _Command.SUBSCRIBE,
+        _Command.UNSUBSCRIBE,
+        _Command.SUBSCRIBE_VIEW,
+        _Command.FETCH_SINCE,
+        _Command.SESSION,
+        _Command.COMPRESSION,
+    )
+)
+
+
+class _Client:
+    """A client of the [RunnerAsyncTcp]: its command and data connections, its send buffer and the state of its data
+    channel. Everything but [push] must be called from the event loop."""
+
+    def __init__(
+        self,
+        client_id: int,
+        host: str,
+        command_writer: asyncio.StreamWriter,
+        max_send_buffer: int,
+        on_evicted: Callable[["_Client"], None],
+    ) -> None:
+        self.id = client_id
+        self.token = secrets.token_hex(16)  # What the data connection of this client sends to be paired with it
+        self.host = host
+        self.role = _Role.OBSERVER
+        self.command_writer = command_writer
+        self.data_writer: asyncio.StreamWriter | None = None
+
+        # The state of the data channel, swapped in the runner while it executes a command of this client
+        self.protocol_version = protocol.JSON_PROTOCOL_VERSION
+        self.sample_type = protocol.sample_type("float32")
+        self.compression = protocol.Compression()
+        self.live_stream = None
+        self.fetch_cursor = -1
+
+        self._max_send_buffer = max_send_buffer
+        self._on_evicted = on_evicted
+        self._outbox: deque[bytes | list[bytes | memoryview]] = deque()
+        self._outbox_bytes = 0
+        self._has_data = asyncio.Event()
+        self._writer_task: asyncio.Task | None = None
+        self.is_closed = False
+
+    def __str__(self) -> str:
+        return f"client {self.id} ({self.host}, {self.role.value})"
+
+    @property
+    def buffered_bytes(self) -> int:
+        """Bytes waiting to be sent on the data channel (in the send buffer and in the socket)"""
+        in_socket = self.data_writer.transport.get_write_buffer_size() if self.data_writer is not None else 0
+        return self._outbox_bytes + in_socket
+
+    def push(self, payload: bytes | list[bytes | memoryview]) -> None:
+        """Queue a message (or the buffers of a message) for the data channel. The client is evicted if too many bytes
+        are waiting."""
+        if self.is_closed:
+            return
+        self._outbox.append(payload)
+        self._outbox_bytes += _payload_size(payload)
+        if self.buffered_bytes > self._max_send_buffer:
+            _logger.warning(f"Evicting the {self}, which does not read its data ({self.buffered_bytes} bytes waiting)")
+            self.close()
+            self._on_evicted(self)
+            return
+        self._has_data.set()
+
+    def attach_data(self, writer: asyncio.StreamWriter) -> None:
+        """Start sending on the data connection (the messages sent before it was connected are kept)"""
+        self.data_writer = writer
+        self._writer_task = asyncio.create_task(self._write_loop())
+        if self._outbox:
+            self._has_data.set()
+
+    def close(self) -> None:
+        if self.is_closed:
+            return
+        self.is_closed = True
+        if self._writer_task is not None:
+            self._writer_task.cancel()
+        self._outbox.clear()
+        self._outbox_bytes = 0
+        self.command_writer.close()
+        if self.data_writer is not None:
+            self.data_writer.close()
+
+    async def _write_loop(self) -> None:
+        try:
+            while True:
+                await self._has_data.wait()
+                self._has_data.clear()
+                while self._outbox:
+                    payload = self._outbox.popleft()
+                    n_bytes = _payload_size(payload)
+                    self._outbox_bytes -= n_bytes
+                    with tracer.span("tcp.send", category="tcp", n_bytes=n_bytes, client=self.id):
+                        if isinstance(payload, list):
+                            self.data_writer.writelines(payload)  # A vectored write if the transport supports it
+                        else:
+                            self.data_writer.write(payload)
+                    await self.data_writer.drain()
+        except (ConnectionError, OSError):
+            _logger.info(f"The data connection of the {self} is closed")
+            self.close()
+
+
+class RunnerAsyncTcp(RunnerTcp):
+    """A TCP runner serving many clients at once, from a single asyncio event loop.
+
+    The protocol is the one of [RunnerTcp], except for the pairing of the two connections of a client (several clients
+    can connect from the same host): the client connects to the command port and sends a framed connect command, whose
+    response is the JSON {"clientId": id, "token": token}. It then connects to the data port and sends, as the first
+    frame of the data connection, a framed connect command with the token as its only parameter. A data connection
+    that does not send the token of a client waiting for its data connection is refused.
+
+    The first client is the controller, which can send every command, the others are observers, which can only look at
+    the data (see [_OBSERVER_COMMANDS]). When the controller leaves, the oldest observer takes over. When the last
+    client leaves, the devices are stopped, unless the runner keeps the session (see [RunnerTcp]).
+
+    The sockets never wait for the devices: the commands are executed one at a time in a worker thread, and what they
+    send is queued in the send buffer of the client, which the event loop writes as fast as the client reads. A client
+    that lets more than [max_send_buffer] bytes pile up is evicted so it cannot hold the others back.
+    """
+
+    def __init__(self, *args, max_clients: int = 8, max_send_buffer: int = 16 * 1024 * 1024, **kwargs) -> None:
+        """Initialize the Runner.
+
+        Parameters
+        ----------
+        max_clients : int, optional
+            Maximum number of clients connected at the same time, by default 8
+        max_send_buffer : int, optional
+            Maximum number of bytes waiting to be sent to a client before it is evicted, by default 16 MiB
+        Other parameters are those of [RunnerTcp] (the ports can be 0 to pick free ones).
+        """
+        super().__init__(*args, **kwargs)
+        if max_clients < 1:
+            raise ValueError("max_clients must be at least 1")
+
+        self._max_clients = max_clients
+        self._max_send_buffer = max_send_buffer
+        self._clients: dict[int, _Client] = {}  # By connection order, so the oldest observer is promoted first
+        self._client_ids = itertools.count(1)
+        self._client: _Client | None = None  # The client whose command is executing (worker thread only)
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._executor: ThreadPoolExecutor | None = None
+        self._stop_event: asyncio.Event | None = None
+        self._is_serving = threading.Event()
+
+        metrics.gauge(
+            "stimwalker_tcp_clients", "Clients connected", owner=self, function=lambda runner: len(runner._clients)
+        )
+        self._clients_evicted = metrics.counter(
+            "stimwalker_tcp_clients_evicted_total", "Clients evicted because they did not read their data"
+        )
+
+    @property
+    def command_port(self) -> int:
+        """The port of the command channel (the one picked if 0 was asked, once serving)"""
+        return self._commandPort
+
+    @property
+    def data_port(self) -> int:
+        """The port of the data channel (the one picked if 0 was asked, once serving)"""
+        return self._dataPort
+
+    @property
+    def clients(self) -> list[dict]:
+        """The clients connected (id, host, role and bytes waiting to be sent)"""
+        return [
+            {"id": client.id, "host": client.host, "role": client.role.value, "buffered_bytes": client.buffered_bytes}
+            for client in list(self._clients.values())
+        ]
+
+    def wait_until_serving(self, timeout: float | None = None) -> bool:
+        """Wait until the runner accepts connections. Returns False on timeout."""
+        return self._is_serving.wait(timeout)
+
+    @override
+    def _serve(self) -> None:
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="RunnerAsyncTcp commands")
+        try:
+            asyncio.run(self._serve_async())
+        finally:
+            self._executor.shutdown(wait=True)
+            self._is_serving.clear()
+        _logger.info("Runner async tcp exited.")
+
+    async def _serve_async(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._stop_event = asyncio.Event()
+
+        if self._command_socket_path is not None:
+            for path in (self._command_socket_path, self._data_socket_path):
+                if os.path.exists(path):
+                    os.unlink(path)  # Left over by a server that did not exit cleanly
+            command_server = await asyncio.start_unix_server(self._serve_command, self._command_socket_path)
+            data_server = await asyncio.start_unix_server(self._serve_data, self._data_socket_path)
+            _logger.info(f"Waiting for clients on {self._command_socket_path} (data on {self._data_socket_path})...")
+        else:
+            command_server = await asyncio.start_server(self._serve_command, self._ip_address, self._commandPort)
+            data_server = await asyncio.start_server(self._serve_data, self._ip_address, self._dataPort)
+            self._commandPort = command_server.sockets[0].getsockname()[1]
+            self._dataPort = data_server.sockets[0].getsockname()[1]
+            _logger.info(f"Waiting for clients on {self._ip_address}:{self._commandPort} (data on {self._dataPort})...")
+        self._is_serving.set()
+
+        try:
+            await self._stop_event.wait()
+        finally:
+            # Not waiting for the servers to be closed, which would wait for the connections that are still being set up
+            command_server.close()
+            data_server.close()
+            for path in (self._command_socket_path, self._data_socket_path):
+                if path is not None and os.path.exists(path):
+                    os.unlink(path)
+            for client in list(self._clients.values()):
+                await self._disconnect(client)
+            await self._loop.run_in_executor(self._executor, self._stop_devices)  # Even if nobody was connected
+
+    async def _serve_command(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Accept a client and execute its commands until it leaves"""
+        host = _peer_host(writer)
+        if len(self._clients) >= self._max_clients:
+            _logger.error(f"Refusing a client from {host}, there are already {self._max_clients} clients")
+            writer.close()
+            return
+
+        client = _Client(next(self._client_ids), host, writer, self._max_send_buffer, self._on_evicted)
+        if not any(other.role == _Role.CONTROLLER for other in self._clients.values()):
+            client.role = _Role.CONTROLLER
+        self._clients[client.id] = client
+        _logger.info(f"Connected to the {client}")
+
+        command_reader = _CommandReader()
+        try:
+            while not client.is_closed:
+                with tracer.span("tcp.receive", category="tcp", client=client.id):
+                    data = await reader.read(1024)
+                if not data:
+                    break
+                command_reader.feed(data)
+
+                # Execute all the commands received, in order (a client can send framed commands without waiting)
+                while not client.is_closed:
+                    received = command_reader.next_command()
+                    if received is None:
+                        break
+                    acknowledgment = await self._handle_command(client, *received)
+                    if acknowledgment is None:
+                        return
+                    with tracer.span("tcp.send_acknowledgment", category="tcp", client=client.id):
+                        writer.write(acknowledgment)
+                await writer.drain()
+        except ValueError:
+            _logger.exception(f"Invalid command frame from the {client}, closing the connection")
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            await self._disconnect(client)
+
+    async def _serve_data(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Pair a data connection with the command connection of its client, from the token it sends first"""
+        host = _peer_host(writer)
+        client = None
+        try:
+            token = await asyncio.wait_for(_read_pairing_token(reader), timeout=_PAIRING_TIMEOUT)
+            waiting = (client for client in self._clients.values() if client.data_writer is None)
+            client = next((client for client in waiting if secrets.compare_digest(client.token, token)), None)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError, ConnectionError, OSError):
+            pass
+        if client is None:
+            _logger.error(f"Refusing a data connection from {host}, which did not send the token of a client")
+            writer.close()
+            return
+        client.attach_data(writer)
+        _logger.info(f"Paired the data connection of the {client}")
+
+        # Nothing is expected on the data channel, reading only tells when the client closes it
+        try:
+            while await reader.read(1024):
+                pass
+        except (ConnectionError, OSError):
+            pass
+        await self._disconnect(client)
+
+    async def _handle_command(
+        self, client: _Client, command: str, parameters: list[str], request_id: int | None
+    ) -> bytes | None:
+        """Execute a command of a client. Returns its acknowledgment, or None if the client quits."""
+        self._commands_received.inc()
+        message = f"Received command from the {client}: {command}"
+        if parameters:
+            message += f", parameters: {parameters}"
+        if request_id is not None:
+            message += f" (request {request_id})"
+        _logger.info(message)
+
+        if command == str(_Command.QUIT):
+            return None
+        if command == str(_Command.CONNECT):
+            return self._connect_acknowledgment(client, parameters, request_id)
+        if client.role != _Role.CONTROLLER and command not in _OBSERVER_COMMANDS:
+            _logger.error(f"The {client} cannot send the command {command}, only the controller can")
+            return _acknowledgment(request_id, False)
+        if command == str(_Command.SHUTDOWN):
+            self._stop_event.set()
+            return None
+
+        success, payload = await self._loop.run_in_executor(
+            self._executor, self._execute_for, client, command, parameters, request_id
+        )
+        return _acknowledgment(request_id, success, payload)
+
+    def _connect_acknowledgment(self, client: _Client, parameters: list[str], request_id: int | None) -> bytes:
+        """The response to the connect command: the id of the client and the token its data connection must send"""
+        if request_id is None:
+            _logger.error("The connect command must be framed, its response carries the token of the data connection")
+            return _acknowledgment(request_id, False)
+        if parameters:
+            _logger.error(f"The connect command takes no parameter, received {parameters}")
+            return _acknowledgment(request_id, False)
+        if client.data_writer is not None:
+            _logger.error(f"The {client} already has a data connection")
+            return _acknowledgment(request_id, False)
+        return _acknowledgment(request_id, True, json.dumps({"clientId": client.id, "token": client.token}).encode())
+
+    def _execute_for(
+        self, client: _Client, command: str, parameters: list[str], request_id: int | None
+    ) -> tuple[bool, bytes]:
+        """Execute a command in the name of [client] (worker thread only). Returns whether it succeeded and its reply
+        if the command is framed (otherwise the reply is sent on the data channel)."""
+        with self._as_client(client):
+            self._response_payload = [] if request_id is not None else None
+            try:
+                success = self._execute_command(command, parameters)
+                payload = b"".join(self._response_payload or [])
+            finally:
+                self._response_payload = None
+        return success, payload
+
+    @contextmanager
+    def _as_client(self, client: _Client):
+        """Swap in the state of the data channel of [client], so the commands of [RunnerTcp] reply to it"""
+        self._client = client
+        self._protocol_version = client.protocol_version
+        self._sample_type = client.sample_type
+        self._compression = client.compression
+        self._live_stream = client.live_stream
+        self._fetch_cursor = client.fetch_cursor
+        try:
+            yield
+        finally:
+            client.protocol_version = self._protocol_version
+            client.sample_type = self._sample_type
+            client.compression = self._compression
+            client.live_stream = self._live_stream
+            client.fetch_cursor = self._fetch_cursor
+            self._client = None
+            self._live_stream = None
+
+    @override
+    def _write_data(self, payload: bytes) -> None:
+        self._push(self._client, payload)
+
+    @override
+    def _live_stream_sender(self) -> Callable[[Data], None]:
+        client = self._client
+        sample_type = self._sample_type
+        compression = self._compression
+        return lambda data: self._push(client, protocol.data_frame_buffers(data, sample_type, compression))
+
+    def _push(self, client: _Client, payload: bytes | list[bytes | memoryview]) -> None:
+        """Queue a message for the data channel of [client] (from any thread)"""
+        self._messages_sent.inc()
+        self._bytes_sent.inc(_payload_size(payload))
+        self._loop.call_soon_threadsafe(client.push, payload)
+
+    def _on_evicted(self, client: _Client) -> None:
+        self._clients_evicted.inc()
+        asyncio.ensure_future(self._disconnect(client))
+
+    async def _disconnect(self, client: _Client) -> None:
+        """Forget a client, stop what was running for it, and hand the control over if it was the controller"""
+        if self._clients.pop(client.id, None) is None:
+            return  # Already disconnected
+        client.close()
+        _logger.info(f"Disconnected from the {client}")
+
+        # The devices keep running for the clients to come if the session outlives the connections
+        stop_devices = not self._clients and (not self._keep_session or self._stop_event.is_set())
+        await self._loop.run_in_executor(self._executor, self._release, client, stop_devices)
+
+        has_controller = any(other.role == _Role.CONTROLLER for other in self._clients.values())
+        if client.role == _Role.CONTROLLER and self._clients and not has_controller:
+            successor = next(iter(self._clients.values()))
+            successor.role = _Role.CONTROLLER
+            _logger.info(f"The {successor} is now the controller")
+
+    def _release(self, client: _Client, stop_devices: bool) -> None:
+        """Stop the live stream of a client that left, and the devices if asked to (worker thread only)"""
+        with self._as_client(client):
+            self._stop_live_stream()
+
+        if stop_devices:
+            self._stop_devices()
+
+
+async def _read_pairing_token(reader: asyncio.StreamReader) -> str:
+    """Read the first frame of a data connection, a connect command with the token of its client"""
+    magic = await reader.readexactly(len(protocol.MAGIC))  # Refuse an unframed message without waiting for more
+    if magic != protocol.MAGIC:
+        raise ValueError("Expected a connect command, received an unframed message")
+    header = magic + await reader.readexactly(protocol.HEADER_SIZE - len(magic))
+    message_type, length = protocol.decode_header(header)
+    if message_type != protocol.MessageType.COMMAND or length > protocol.MAX_COMMAND_SIZE:
+        raise ValueError(f"Expected a connect command, received a {message_type.name} frame of {length} bytes")
+    _, command, parameters = protocol.decode_command(await reader.readexactly(length))
+    if command != _Command.CONNECT.value or len(parameters) != 1:
+        raise ValueError("Expected a connect command with the token of the client")
+    return parameters[0]
+
+
+def _peer_host(writer: asyncio.StreamWriter) -> str:
+    """The host of a connection (the clients of the Unix domain sockets are all on this host)"""
+    peername = writer.get_extra_info("peername")
+    return peername[0] if isinstance(peername, tuple) else "localhost"
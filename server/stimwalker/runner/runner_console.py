@@ -1,8 +1,11 @@
 import logging
+import threading
 from typing import override
 
 from .runner_generic import RunnerGeneric
 from ..common.data import Data
+from ..common.metrics import metrics
+from ..common.tracing import tracer
 from ..scheduler.automatic_stimulation_rule import Side, AutomaticStimulationRule
 
 _logger = logging.getLogger("lokomat_fes")
@@ -65,6 +68,15 @@ class RunnerConsole(RunnerGeneric):
             elif command == "save":
                 self._save_command(parameters)
 
+            elif command == "trace":
+                self._trace_command(parameters)
+
+            elif command == "metrics":
+                self._metrics_command(parameters)
+
+            elif command == "profile":
+                self._profile_command(parameters)
+
             elif command == "quit":
                 break
 
@@ -95,6 +107,16 @@ class RunnerConsole(RunnerGeneric):
             "\tplot: plot the last trial, if available. This method is blocking (no other commands can be used while the plot is shown)"
         )
         print("\tsave X: save the last trial to file X as a pickle file")
+        print(
+            "\ttrace X [Y]: X is 'on' or 'off' to start or stop tracing the timing of the server, 'clear' to discard the "
+            "recorded spans, or 'save' to export them to file Y (Chrome trace-event JSON, e.g. for ui.perfetto.dev)"
+        )
+        print("\tmetrics: print the runtime metrics (counters, gauges and histograms) of the server")
+        print(
+            "\tprofile X [Y]: X is 'sample' to start sampling the stacks of all the threads every Y ms (default 1), "
+            "'thread' to start profiling every call of thread Y, 'stop' to stop and write the results to file Y, or "
+            "'threads' to list the threads"
+        )
         print("\tquit: quit")
 
     def _start_nidaq_command(self, parameters: list[str]) -> bool:
@@ -233,6 +255,64 @@ class RunnerConsole(RunnerGeneric):
         filename = parameters[0]
         return _try_command(self.save_trial, filename)
 
+    def _metrics_command(self, parameters: list[str]) -> bool:
+        if not self._check_number_parameters("metrics", parameters, expected=None):
+            return False
+
+        print(metrics.render_text(), end="")
+        return True
+
+    def _profile_command(self, parameters: list[str]) -> bool:
+        if len(parameters) == 0:
+            self._check_number_parameters("profile", parameters, expected={"action": True, "value": False})
+            return False
+
+        action = parameters[0]
+        value = " ".join(parameters[1:])  # Thread names can contain spaces
+        if action == "threads":
+            for thread in threading.enumerate():
+                print(f"\t{thread.name}")
+            return True
+        elif action == "sample":
+            interval = _parse_float("interval", value) if value else 1.0
+            if interval is None:
+                return False
+            return _try_command(self.start_profiling, interval=interval / 1000)
+        elif action == "thread":
+            if not value:
+                _logger.error("profile thread requires the name of the thread to profile.")
+                return False
+            return _try_command(self.start_profiling, thread=value)
+        elif action == "stop":
+            if not value:
+                _logger.error("profile stop requires the filename to write the results to.")
+                return False
+            return _try_command(self.stop_profiling, value)
+        else:
+            _logger.error(f"Invalid profile action {action}, it must be 'sample', 'thread', 'stop' or 'threads'.")
+            return False
+
+    def _trace_command(self, parameters: list[str]) -> bool:
+        if not self._check_number_parameters("trace", parameters, expected={"action": True, "filename": False}):
+            return False
+
+        action = parameters[0]
+        if action == "on":
+            tracer.enable()
+        elif action == "off":
+            tracer.disable()
+        elif action == "clear":
+            tracer.clear()
+        elif action == "save":
+            if len(parameters) < 2:
+                _logger.error("trace save requires the filename to export the trace to.")
+                return False
+            return _try_command(tracer.export_chrome_trace, parameters[1])
+        else:
+            _logger.error(f"Invalid trace action {action}, it must be 'on', 'off', 'clear' or 'save'.")
+            return False
+        return True
+
     @staticmethod
     def _check_number_parameters(command: str, parameters: list[str], expected: dict[str, bool] | None) -> bool:
         """Check if the number of parameters is correct.
@@ -1,7 +1,13 @@
 from abc import ABC, abstractmethod
+from datetime import datetime
 import logging
 
+import numpy as np
+
+from ..common.clock import Clock
 from ..common.data import Data
+from ..common.metrics import metrics
+from ..common.profiling import SamplingProfiler, ThreadProfiler
 from ..nidaq import NiDaqGeneric, NiDaqData
 from ..rehastim import RehastimGeneric, RehastimData
 from ..scheduler.scheduler import Scheduler
@@ -13,21 +19,36 @@ _logger = logging.getLogger("lokomat_fes")
 class RunnerGeneric(ABC):
     """Abstract base class for Runners."""
 
-    def __init__(self, rehastim: RehastimGeneric, nidaq: NiDaqGeneric) -> None:
-        """Initialize the Runner."""
+    def __init__(self, rehastim: RehastimGeneric, nidaq: NiDaqGeneric, clock: Clock | None = None) -> None:
+        """Initialize the Runner.
+
+        Parameters
+        ----------
+        rehastim : RehastimGeneric
+            The stimulation device.
+        nidaq : NiDaqGeneric
+            The kinematic device.
+        clock : Clock | None
+            The clock giving the time to the runner and its scheduler ([default] is the clock of the NiDaq). It should
+            be the same clock as the devices.
+        """
         _logger.info("Initializing the Runner")
 
         self._rehastim = rehastim
         self._nidaq = nidaq
+        self._clock = clock if clock is not None else nidaq.clock
 
-        self._continuous_data = Data()
+        self._continuous_data = Data(t0=self._now())
         self._register_data_to_callbacks(self._continuous_data)
         self._last_fetch_continuous_data_index = -1
 
-        self._scheduler = Scheduler(runner=self, data=self._continuous_data)
+        self._scheduler = Scheduler(runner=self, data=self._continuous_data, clock=self._clock)
 
         self._trial_data = None
         self._is_recording = False
+        self._profiler: SamplingProfiler | ThreadProfiler | None = None
+
+        self._register_metrics()
 
     def exec(self):
         """Start the Runner."""
@@ -44,6 +65,15 @@ class RunnerGeneric(ABC):
     def _exec(self) -> None:
         """Start the Runner (implementation)."""
 
+    @property
+    def clock(self) -> Clock:
+        """The clock giving the time to the runner"""
+        return self._clock
+
+    def _now(self) -> datetime:
+        """Get the current time of the clock as a datetime"""
+        return datetime.fromtimestamp(self._clock.now())
+
     ### DATA RELATED METHODS ###
     def plot_data(self) -> None:
         """Plot the data."""
@@ -96,6 +126,7 @@ class RunnerGeneric(ABC):
             _logger.error("Cannot fetch continuous data while no data is recorded")
             raise RuntimeError("Cannot fetch continuous data while no data is recorded")
         self._continuous_data.clear()
+        self._continuous_data.set_t0(new_t0=self._now())
         self._last_fetch_continuous_data_index = len(self._continuous_data)
 
     def _fetch_continuous_data(self, from_top: bool = False) -> Data:
@@ -130,26 +161,35 @@ class RunnerGeneric(ABC):
             return Data()
         rehastim = self._continuous_data.rehastim.sample_block_between(t0=nidaq[0][0][0], tf=nidaq[0][-1][-1])
 
+        # Fetch the gaps that happened since the end of the previously fetched block
+        previous_t, _ = (
+            self._continuous_data.nidaq.sample_block(starting_index - 1, unsafe=True)
+            if starting_index > 0
+            else (None, None)
+        )
+        gaps_from = -np.inf if previous_t is None else previous_t[-1]
+        gaps = [gap for gap in self._continuous_data.nidaq.gaps if gaps_from < gap[0] <= nidaq[0][-1][-1]]
+
         # Update the last fetched data index
         self._last_fetch_continuous_data_index = last_data_index
 
         # Return a new Data object with the fetched data (t0 is still the real t0 though)
         t0 = self._continuous_data.t0
-        nidaq_data = NiDaqData(t0=t0, t=nidaq[0], data=nidaq[1])
+        nidaq_data = NiDaqData(t0=t0, t=nidaq[0], data=nidaq[1], gaps=gaps)
         rehastim_data = RehastimData(t0=t0, data=rehastim)
         return Data(nidaq=nidaq_data, rehastim=rehastim_data, t0=self._continuous_data.t0)
 
     def _prepare_trial(self):
         """Prepare the data."""
         _logger.info("Preparing the data")
-        self._trial_data = Data()
+        self._trial_data = Data(t0=self._now())
 
         # Initialize the callback to record the data
         self._register_data_to_callbacks(self._trial_data)
 
     def _register_data_to_callbacks(self, data: Data):
         """Register the data to the callbacks."""
-        self._nidaq.register_to_data_ready(data.nidaq.add_sample_block)
+        self._nidaq.register_to_data_ready(data.nidaq.add_sample_block, on_gap=data.nidaq.add_gap)
         self._rehastim.register_to_on_stimulation_changed(data.rehastim.add)
 
     def _unregister_data_to_callbacks(self, data: Data):
@@ -161,9 +201,156 @@ class RunnerGeneric(ABC):
         """Finalize the data."""
         _logger.info("Finalizing the data")
 
+        # Make sure the trial received all the data acquired so far before detaching it
+        self._nidaq.wait_for_data_ready_callbacks(timeout=1.0)
         self._unregister_data_to_callbacks(self._trial_data)
 
+    def _register_metrics(self) -> None:
+        """Expose the counters the devices and the data already keep as metrics (read when the metrics are collected,
+        so they cost nothing on the hot path). The runner is passed to the functions reading them rather than captured,
+        so the metrics do not keep it alive."""
+
+        def acquisition(key: str):
+            return lambda runner: runner._nidaq.acquisition_statistics[key]
+
+        metrics.counter(
+            "stimwalker_nidaq_blocks_read_total",
+            "NiDaq blocks acquired",
+            owner=self,
+            function=acquisition("blocks_read"),
+        )
+        metrics.counter(
+            "stimwalker_nidaq_samples_read_total",
+            "NiDaq samples acquired",
+            owner=self,
+            function=acquisition("samples_read"),
+        )
+        metrics.counter(
+            "stimwalker_nidaq_catch_up_reads_total",
+            "NiDaq reads that found more than one block waiting",
+            owner=self,
+            function=acquisition("catch_up_reads"),
+        )
+        metrics.counter("stimwalker_nidaq_gaps_total", "NiDaq overruns", owner=self, function=acquisition("gaps"))
+        metrics.counter(
+            "stimwalker_nidaq_samples_lost_total",
+            "NiDaq samples lost in overruns",
+            owner=self,
+            function=acquisition("samples_lost"),
+        )
+        metrics.counter(
+            "stimwalker_nidaq_read_errors_total", "NiDaq read errors", owner=self, function=acquisition("read_errors")
+        )
+
+        def dispatcher(runner: "RunnerGeneric") -> dict:
+            return runner._nidaq.data_ready_statistics
+
+        metrics.counter(
+            "stimwalker_nidaq_blocks_dropped_total",
+            "NiDaq blocks dropped before reaching the data subscribers (dispatcher overrun)",
+            owner=self,
+            function=lambda runner: dispatcher(runner)["dropped_at_source"],
+        )
+        metrics.counter(
+            "stimwalker_subscriber_blocks_dropped_total",
+            "NiDaq blocks dropped or coalesced by the queues of the data subscribers",
+            owner=self,
+            function=lambda runner: sum(s["dropped"] + s["coalesced"] for s in dispatcher(runner)["subscriptions"]),
+        )
+        metrics.gauge(
+            "stimwalker_dispatcher_pending_blocks",
+            "NiDaq blocks waiting to be dispatched to the data subscribers",
+            owner=self,
+            function=lambda runner: dispatcher(runner)["pending"],
+        )
+        metrics.gauge(
+            "stimwalker_data_subscribers",
+            "Data subscribers",
+            owner=self,
+            function=lambda runner: len(dispatcher(runner)["subscriptions"]),
+        )
+
+        metrics.gauge(
+            "stimwalker_continuous_data_blocks",
+            "NiDaq blocks held in the continuous data",
+            owner=self,
+            function=lambda runner: len(runner._continuous_data.nidaq),
+        )
+        metrics.gauge(
+            "stimwalker_continuous_data_bytes",
+            "Memory held by the NiDaq blocks of the continuous data",
+            owner=self,
+            function=lambda runner: runner._continuous_data.nidaq.nbytes,
+        )
+        metrics.gauge(
+            "stimwalker_continuous_data_stimulations",
+            "Stimulation events held in the continuous data",
+            owner=self,
+            function=lambda runner: len(runner._continuous_data.rehastim),
+        )
+        metrics.gauge(
+            "stimwalker_recording",
+            "Whether a trial is being recorded",
+            owner=self,
+            function=lambda runner: int(runner._is_recording),
+        )
+
+    ### PROFILING RELATED METHODS ###
+    def start_profiling(self, thread: str | None = None, interval: float = 0.001) -> None:
+        """Start profiling the live process.
+
+        Parameters
+        ----------
+        thread : str | None
+            The name of the thread to profile deterministically (every call is timed, which slows that thread down).
+            If None, all the threads are profiled by sampling their stacks (low overhead).
+        interval : float
+            The time between two samples in seconds (only when sampling).
+        """
+        if self._profiler is not None:
+            _logger.error("Cannot start profiling while already profiling")
+            raise RuntimeError("Cannot start profiling while already profiling")
+
+        profiler = SamplingProfiler(interval=interval) if thread is None else ThreadProfiler(thread)
+        profiler.start()
+        self._profiler = profiler
+
+    def stop_profiling(self, filename: str) -> dict:
+        """Stop profiling and write the results to a file.
+
+        Parameters
+        ----------
+        filename : str
+            The file to write. A deterministic profile is written in the format of pstats, the samples in the folded
+            stacks format (for flame graphs).
+
+        Returns
+        -------
+        dict
+            A summary of the profiling session.
+        """
+        if self._profiler is None:
+            _logger.error("Cannot stop profiling while not profiling")
+            raise RuntimeError("Cannot stop profiling while not profiling")
+
+        profiler = self._profiler
+        self._profiler = None
+        profiler.stop()
+        profiler.write(filename)
+        return profiler.statistics
+
     ### KINEMATIC DEVICE (NIDAQ) RELATED METHODS ###
+    @property
+    def acquisition_statistics(self) -> dict[str, int]:
+        """Get the counters of the NiDaq acquisition (blocks read, catch-up reads, gaps, samples lost, ...).
+
+        Returns
+        -------
+        dict[str, int]
+            The counters of the acquisition.
+        """
+        return self._nidaq.acquisition_statistics
+
     def start_nidaq(self):
         """Start the NiDaq."""
         _logger.info("Starting NiDaq")
@@ -1,17 +1,29 @@
 from enum import Enum
 import json
 import logging
+import os
 import socket
 from struct import pack
+import threading
 import time
-from typing import override
+from typing import Any, Callable, override
 
 from stimwalker.common.data import Data
+from stimwalker.common.metrics import MetricsHttpServer, metrics
+from stimwalker.common.tracing import tracer
+from stimwalker.nidaq.decimation import MinMaxDecimator
 
-from .runner_console import RunnerConsole
+from . import protocol
+
+from .live_stream import LiveStream
+from .retention import RetentionBuffer
+from .shared_memory_ring import SharedMemoryRingWriter
+from .runner_console import RunnerConsole, _parse_float, _parse_int
 
 _logger = logging.getLogger("lokomat_fes")
 
+_MAX_BUFFERS_PER_WRITE = 512  # Below the limit of buffers per sendmsg of the systems (IOV_MAX, 1024 on Linux)
+
 
 class _Command(Enum):
     START_NIDAQ = 0
@@ -29,6 +41,17 @@ class _Command(Enum):
     SAVE_DATA = 12
     QUIT = 13
     SHUTDOWN = 14
+    TRACE = 15
+    METRICS = 16
+    PROFILE = 17
+    HANDSHAKE = 18
+    SUBSCRIBE = 19
+    UNSUBSCRIBE = 20
+    SUBSCRIBE_VIEW = 21
+    FETCH_SINCE = 22
+    SESSION = 23
+    COMPRESSION = 24
+    CONNECT = 25
 
     def __str__(self) -> str:
         if self.name == "START_NIDAQ":
@@ -61,6 +84,28 @@ class _Command(Enum):
             return "quit"
         elif self.name == "SHUTDOWN":
             return "shutdown"
+        elif self.name == "TRACE":
+            return "trace"
+        elif self.name == "METRICS":
+            return "metrics"
+        elif self.name == "PROFILE":
+            return "profile"
+        elif self.name == "HANDSHAKE":
+            return "handshake"
+        elif self.name == "SUBSCRIBE":
+            return "subscribe"
+        elif self.name == "UNSUBSCRIBE":
+            return "unsubscribe"
+        elif self.name == "SUBSCRIBE_VIEW":
+            return "subscribe_view"
+        elif self.name == "FETCH_SINCE":
+            return "fetch_since"
+        elif self.name == "SESSION":
+            return "session"
+        elif self.name == "COMPRESSION":
+            return "compression"
+        elif self.name == "CONNECT":
+            return "connect"
         else:
             raise ValueError(f"Unknown command {self.name}")
 
@@ -69,7 +114,19 @@ class RunnerTcp(RunnerConsole):
     """Runner that connects to an external software (e.g. GUI) by TCP/IP."""
 
     def __init__(
-        self, ip_address: str = "localhost", commandPort: int = 4042, dataPort: int = 4043, *args, **kwargs
+        self,
+        ip_address: str = "localhost",
+        commandPort: int = 4042,
+        dataPort: int = 4043,
+        metricsPort: int | None = None,
+        retention_size: int = 10000,
+        retention_max_bytes: int | None = 64 << 20,
+        keep_session: bool = False,
+        shared_memory_name: str | None = None,
+        command_socket_path: str | None = None,
+        data_socket_path: str | None = None,
+        *args,
+        **kwargs,
     ) -> None:
         """Initialize the Runner.
 
@@ -81,51 +138,136 @@ class RunnerTcp(RunnerConsole):
             Port to connect to command channel, by default 4042
         dataPort : int, optional
             Port to connect to data channel, by default 4043
+        metricsPort : int | None, optional
+            If set, the metrics are also served in the Prometheus text format on http://localhost:metricsPort/metrics
+            while the runner executes, by default None
+        retention_size : int, optional
+            Number of NiDaq blocks, gaps and stimulation events kept for the clients to fetch_since while the runner
+            executes, by default 10000
+        retention_max_bytes : int | None, optional
+            Maximum memory held by the NiDaq blocks kept for the clients to fetch_since (None for no limit other than
+            [retention_size]), by default 64 MiB
+        keep_session : bool, optional
+            If True, the acquisition, the recording and the scheduler keep running when the client disconnects (or
+            quits), and the sockets stay bound so it can reattach to the session and fetch_since what it missed. Only
+            the shutdown command stops the devices. By default False (everything is stopped with the connection)
+        shared_memory_name : str | None, optional
+            If set, the NiDaq blocks are also published in a ring buffer in the shared memory of that name while the
+            runner executes, for the processes of the same host to read (see [SharedMemoryRingReader]), by default None
+        command_socket_path : str | None, optional
+            If set (with [data_socket_path]), the command channel is a Unix domain socket at that path instead of a TCP
+            socket, for a client on the same host (not available on Windows), by default None
+        data_socket_path : str | None, optional
+            The path of the Unix domain socket of the data channel, by default None
         """
         super().__init__(*args, **kwargs)
+        if (command_socket_path is None) != (data_socket_path is None):
+            raise ValueError("Both command_socket_path and data_socket_path must be given to use Unix domain sockets")
 
         self._ip_address = ip_address
         self._commandPort = commandPort
         self._dataPort = dataPort
+        self._command_socket_path = command_socket_path
+        self._data_socket_path = data_socket_path
+        self._keep_session = keep_session
         self._commandServer = None
         self._commandConnexion = None
         self._dataServer = None
         self._dataConnexion = None
+        self._protocol_version = protocol.JSON_PROTOCOL_VERSION
+        self._sample_type = protocol.sample_type("float32")
+        self._compression = protocol.Compression()
+        self._command_reader = _CommandReader()
+        self._request_id: int | None = None  # The id of the framed command being executed
+        self._response_payload: list[bytes] | None = None
+        self._data_mutex = threading.Lock()  # The live stream and the commands share the data channel
+        self._live_stream: LiveStream | None = None
+        self._retention = RetentionBuffer(
+            nidaq=self._nidaq, rehastim=self._rehastim, size=retention_size, max_bytes=retention_max_bytes
+        )
+        self._fetch_cursor = -1  # The sequence number of the last item the client fetched
+        self._metrics_server = MetricsHttpServer(port=metricsPort) if metricsPort is not None else None
+        self._shared_memory_ring = (
+            SharedMemoryRingWriter(nidaq=self._nidaq, name=shared_memory_name)
+            if shared_memory_name is not None
+            else None
+        )
+
+        self._commands_received = metrics.counter(
+            "stimwalker_tcp_commands_received_total", "Commands received on the command socket"
+        )
+        self._messages_sent = metrics.counter(
+            "stimwalker_tcp_data_messages_sent_total", "Messages sent on the data socket"
+        )
+        self._bytes_sent = metrics.counter("stimwalker_tcp_data_bytes_sent_total", "Bytes sent on the data socket")
 
     def _start_connection(self):
         """Start the TCP/IP connection."""
-        self._commandServer, self._commandConnexion = _declare_socket(self._ip_address, self._commandPort)
-        self._dataServer, self._dataConnexion = _declare_socket(self._ip_address, self._dataPort)
+        # Each client negotiates its own protocol, until then the messages are unframed JSON
+        self._protocol_version = protocol.JSON_PROTOCOL_VERSION
+        self._compression = protocol.Compression()
+        self._command_reader = _CommandReader()
+        if not self._keep_session:
+            self._fetch_cursor = -1  # A client reattaching to the session resumes where it was
+
+        if self._commandServer is None and self._command_socket_path is not None:
+            self._commandServer = _declare_unix_socket(self._command_socket_path)
+            self._dataServer = _declare_unix_socket(self._data_socket_path)
+        elif self._commandServer is None:
+            self._commandServer = _declare_socket(self._ip_address, self._commandPort)
+            self._dataServer = _declare_socket(self._ip_address, self._dataPort)
+        self._commandConnexion = _accept_connection(self._commandServer)
+        self._dataConnexion = _accept_connection(self._dataServer)
 
     @override
     def _receive_command(self) -> tuple[str | None, list[str]]:
         """Receive an acquisition command and int value from the external software."""
         _logger.info("Waiting for command...")
-        try:
-            data = self._commandConnexion.recv(1024).decode()
-        except Exception:
-            data = None
-
-        if not data:
-            _logger.info("The client has abruptly closed the connection.")
-            return None, []
+        while True:
+            try:
+                received = self._command_reader.next_command()
+            except ValueError:
+                _logger.exception("Invalid command frame, closing the connection.")
+                return None, []
+            if received is not None:
+                break
 
-        command_str, parameters_str = data.split(":")
-        command = _Command(int(command_str))
-        parameters = parameters_str.split(",") if parameters_str else []
+            # The commands received so far are incomplete (or all executed), wait for more
+            try:
+                with tracer.span("tcp.receive", category="tcp"):
+                    data = self._commandConnexion.recv(1024)
+            except Exception:
+                data = None
+            if not data:
+                _logger.info("The client has abruptly closed the connection.")
+                return None, []
+            self._command_reader.feed(data)
+
+        command, parameters, self._request_id = received
+        # The reply of a framed command is sent in its response rather than on the data channel
+        self._response_payload = [] if self._request_id is not None else None
+        self._commands_received.inc()
 
         message = f"Received command: {command}"
         if parameters:
             message += f", parameters: {parameters}"
+        if self._request_id is not None:
+            message += f" (request {self._request_id})"
         _logger.info(message)
 
-        return str(command), parameters
+        return command, parameters
 
     def _send_acknowledgment(self, response):
-        """Send an acknowledgment back to the external software."""
+        """Send an acknowledgment back to the external software (a response frame if the command was framed)."""
         acknowledgment = "OK" if response else "ERROR"
+        if self._request_id is not None:
+            acknowledgment += f" to request {self._request_id}"
+        message = _acknowledgment(self._request_id, response, b"".join(self._response_payload or []))
+        self._response_payload = None
+
         try:
-            self._commandConnexion.sendall(acknowledgment.encode())
+            with tracer.span("tcp.send_acknowledgment", category="tcp"):
+                self._commandConnexion.sendall(message)
         except Exception:
             _logger.error(f"Connection closed by the client.")
             return False
@@ -133,19 +275,75 @@ class RunnerTcp(RunnerConsole):
         _logger.info(f"Sent acknowledgment: {acknowledgment}")
         return True
 
-    def _close_connection(self):
-        """Close the TCP/IP connection."""
+    def _send_json(self, message: Any) -> None:
+        """Send a JSON message on the data channel (framed if a binary protocol was negotiated)."""
+        payload = json.dumps(message).encode()
+        if self._protocol_version != protocol.JSON_PROTOCOL_VERSION:
+            payload = protocol.frame_buffers(protocol.MessageType.JSON, [payload], self._compression)
+        self._send_data(payload)
+
+    def _send_data(self, payload: bytes | list[bytes | memoryview]) -> None:
+        """Send the reply of a command to the external software (in the response if the command was framed). The
+        payload can be a list of buffers, which are then sent one after the other without being joined first."""
+        if self._response_payload is not None:
+            if isinstance(payload, list):
+                self._response_payload.extend(payload)
+            else:
+                self._response_payload.append(payload)
+            return
+        self._write_data(payload)
+
+    def _write_data(self, payload: bytes | list[bytes | memoryview]) -> None:
+        """Send a message to the external software on the data channel."""
+        n_bytes = _payload_size(payload)
+        with tracer.span("tcp.send", category="tcp", n_bytes=n_bytes):
+            self._data_mutex.acquire()
+            try:
+                if isinstance(payload, list):
+                    _send_buffers(self._dataConnexion, payload)
+                else:
+                    self._dataConnexion.sendall(payload)
+            finally:
+                self._data_mutex.release()
+        self._messages_sent.inc()
+        self._bytes_sent.inc(n_bytes)
+
+    def _close_connection(self, keep_listening: bool = False):
+        """Close the TCP/IP connection (and the servers, unless [keep_listening] for the next client)."""
+        if keep_listening:
+            self._commandConnexion.close()
+            self._dataConnexion.close()
+            _logger.info("Connection closed, waiting for the client to reattach to the session")
+            return
+
         # Give some time to the external software to close the connection
         time.sleep(1)
 
         self._commandConnexion.close()
-        self._commandServer.close()
+        _close_server(self._commandServer)
         self._dataConnexion.close()
-        self._dataServer.close()
+        _close_server(self._dataServer)
+        self._commandServer = None
+        self._dataServer = None
         _logger.info("Connection closed")
 
     @override
     def _exec(self) -> None:
+        if self._metrics_server is not None:
+            self._metrics_server.start()
+        self._retention.start()
+        if self._shared_memory_ring is not None:
+            self._shared_memory_ring.start()
+        try:
+            self._serve()
+        finally:
+            if self._shared_memory_ring is not None:
+                self._shared_memory_ring.stop()
+            self._retention.stop()
+            if self._metrics_server is not None:
+                self._metrics_server.stop()
+
+    def _serve(self) -> None:
         # Start the runner (internal).
         # The outer loop is to handle the case where the connection is closed by the external software, in which case
         # we need to wait for a new connection. The inner loop is to handle the case where the external software sends
@@ -160,72 +358,117 @@ class RunnerTcp(RunnerConsole):
                 if command is None:
                     break
 
-                if command == str(_Command.START_NIDAQ):
-                    success = self._start_nidaq_command(parameters)
+                if command in (str(_Command.QUIT), str(_Command.SHUTDOWN)):
+                    # Stop the the server
+                    break
 
-                elif command == str(_Command.STOP_NIDAQ):
-                    success = self._stop_nidaq_command(parameters)
+                success = self._execute_command(command, parameters)
 
-                elif command == str(_Command.START_RECORDING):
-                    success = self._start_recording_command(parameters)
+                # Send acknowledgment back
+                if not self._send_acknowledgment(success):
+                    break
 
-                elif command == str(_Command.STOP_RECORDING):
-                    success = self._stop_recording_command(parameters)
+            # Stop pushing to a client that is gone
+            self._stop_live_stream()
 
-                elif command == str(_Command.STIMULATE):
-                    success = self._stimulate_command(parameters)
+            # Make sure the devices are stopped, unless the session outlives the connection
+            is_shutdown = command == str(_Command.SHUTDOWN)
+            if is_shutdown or not self._keep_session:
+                self._stop_devices()
 
-                elif command == str(_Command.AVAILABLE_SCHEDULES):
-                    success = self._list_available_schedules_command(parameters)
+            # Close the connection when done
+            self._close_connection(keep_listening=self._keep_session and not is_shutdown)
 
-                elif command == str(_Command.ADD_SCHEDULE):
-                    success = self._schedule_stimulation_command(parameters)
+            if is_shutdown:
+                # Trickle down the quit command
+                break
 
-                elif command == str(_Command.GET_SCHEDULE):
-                    success = self._get_scheduled_stimulations_command(parameters)
+        _logger.info("Runner tcp exited.")
 
-                elif command == str(_Command.REMOVE_SCHEDULED):
-                    success = self._unschedule_stimulation_command(parameters)
+    def _stop_devices(self) -> None:
+        """Stop the recording and the NiDaq if they are running"""
+        if self._is_recording:
+            self.stop_recording()
 
-                elif command == str(_Command.START_FETCH_DATA):
-                    success = self._start_fetch_continuous_data_command(parameters)
+        if self._nidaq.is_connected:
+            self.stop_nidaq()
 
-                elif command == str(_Command.FETCH_DATA):
-                    success = self._fetch_continuous_data_command(parameters)
+    def _execute_command(self, command: str, parameters: list[str]) -> bool:
+        """Execute a command received from the external software (but QUIT and SHUTDOWN, which end the connection)."""
+        if command == str(_Command.START_NIDAQ):
+            success = self._start_nidaq_command(parameters)
 
-                elif command == str(_Command.PLOT_DATA):
-                    success = self._plot_data_command(parameters)
+        elif command == str(_Command.STOP_NIDAQ):
+            success = self._stop_nidaq_command(parameters)
 
-                elif command == str(_Command.SAVE_DATA):
-                    success = self._save_command(parameters)
+        elif command == str(_Command.START_RECORDING):
+            success = self._start_recording_command(parameters)
 
-                elif command in (str(_Command.QUIT), str(_Command.SHUTDOWN)):
-                    # Stop the the server
-                    break
+        elif command == str(_Command.STOP_RECORDING):
+            success = self._stop_recording_command(parameters)
 
-                else:
-                    _logger.error(f"Unknown command {command}")
-                    success = False
+        elif command == str(_Command.STIMULATE):
+            success = self._stimulate_command(parameters)
 
-                # Send acknowledgment back
-                if not self._send_acknowledgment(success):
-                    break
+        elif command == str(_Command.AVAILABLE_SCHEDULES):
+            success = self._list_available_schedules_command(parameters)
 
-            # Make sure the devices are stopped
-            if self._is_recording:
-                self.stop_recording()
+        elif command == str(_Command.ADD_SCHEDULE):
+            success = self._schedule_stimulation_command(parameters)
 
-            if self._nidaq.is_connected:
-                self.stop_nidaq()
+        elif command == str(_Command.GET_SCHEDULE):
+            success = self._get_scheduled_stimulations_command(parameters)
 
-            # Close the connection when done
-            self._close_connection()
+        elif command == str(_Command.REMOVE_SCHEDULED):
+            success = self._unschedule_stimulation_command(parameters)
 
-            if command == str(_Command.SHUTDOWN):
-                # Trickle down the quit command
-                break
+        elif command == str(_Command.START_FETCH_DATA):
+            success = self._start_fetch_continuous_data_command(parameters)
 
-        _logger.info("Runner tcp exited.")
+        elif command == str(_Command.FETCH_DATA):
+            success = self._fetch_continuous_data_command(parameters)
+
+        elif command == str(_Command.PLOT_DATA):
+            success = self._plot_data_command(parameters)
+
+        elif command == str(_Command.SAVE_DATA):
+            success = self._save_command(parameters)
+
+        elif command == str(_Command.TRACE):
+            success = self._trace_command(parameters)
+
+        elif command == str(_Command.METRICS):
+            success = self._metrics_command(parameters)
+
+        elif command == str(_Command.PROFILE):
+            success = self._profile_command(parameters)
+
+        elif command == str(_Command.HANDSHAKE):
+            success = self._handshake_command(parameters)
+
+        elif command == str(_Command.SUBSCRIBE):
+            success = self._subscribe_command(parameters)
+
+        elif command == str(_Command.UNSUBSCRIBE):
+            success = self._unsubscribe_command(parameters)
+
+        elif command == str(_Command.SUBSCRIBE_VIEW):
+            success = self._subscribe_view_command(parameters)
+
+        elif command == str(_Command.FETCH_SINCE):
+            success = self._fetch_since_command(parameters)
+
+        elif command == str(_Command.SESSION):
+            success = self._session_command(parameters)
+
+        elif command == str(_Command.COMPRESSION):
+            success = self._compression_command(parameters)
+
+        else:
+            _logger.error(f"Unknown command {command}")
+            success = False
+
+        return success
 
     @override
     def _start_nidaq_command(self, parameters: list[str]) -> bool:
@@ -233,14 +476,12 @@ class RunnerTcp(RunnerConsole):
         if not out:
             return out
 
-        self._dataConnexion.sendall(
-            json.dumps(
-                {
-                    "t0": self._continuous_data.t0.timestamp(),
-                    "nidaqNbChannels": self._nidaq.num_channels,
-                    "rehastimNbChannels": self._rehastim.nb_channels,
-                }
-            ).encode()
+        self._send_json(
+            {
+                "t0": self._continuous_data.t0.timestamp(),
+                "nidaqNbChannels": self._nidaq.num_channels,
+                "rehastimNbChannels": self._rehastim.nb_channels,
+            }
         )
 
         return True
@@ -252,7 +493,7 @@ class RunnerTcp(RunnerConsole):
 
         available_schedules = [schedule.serialize() for schedule in self._scheduler.available_schedules]
 
-        self._dataConnexion.sendall(json.dumps(available_schedules).encode())
+        self._send_json(available_schedules)
         return True
 
     @override
@@ -261,7 +502,7 @@ class RunnerTcp(RunnerConsole):
             return False
 
         scheduled_stimulations = [stim.serialize() for stim in self._scheduler.get_stimulations()]
-        self._dataConnexion.sendall(json.dumps(scheduled_stimulations).encode())
+        self._send_json(scheduled_stimulations)
         return True
 
     @override
@@ -269,13 +510,295 @@ class RunnerTcp(RunnerConsole):
         data = super()._fetch_continuous_data(from_top)
 
         # Send the message
-        self._dataConnexion.sendall(json.dumps(data.serialize(to_json=True)).encode())
+        if self._protocol_version == protocol.JSON_PROTOCOL_VERSION:
+            self._send_json(data.serialize(to_json=True))
+        else:
+            self._send_data(protocol.data_frame_buffers(data, self._sample_type, self._compression))
 
         return data
 
+    def _fetch_since_command(self, parameters: list[str]) -> bool:
+        """Send the blocks, gaps and stimulation events that came after a sequence number: the one given (e.g. the last
+        one received before a reconnection, -1 for all the items retained), or by default the last one fetched."""
+        if not self._check_number_parameters("fetch_since", parameters, expected={"sequence": False}):
+            return False
+
+        sequence = _parse_int("sequence", parameters[0]) if parameters else self._fetch_cursor
+        if sequence is None:
+            return False
+        try:
+            first, last, data = self._retention.since(sequence, t0=self._continuous_data.t0)
+        except ValueError:
+            _logger.exception("Cannot fetch since this sequence")
+            return False
+        if first > sequence + 1:
+            _logger.warning(f"The items {sequence + 1} to {first - 1} are no longer retained")
+        self._fetch_cursor = last
+
+        if self._protocol_version == protocol.JSON_PROTOCOL_VERSION:
+            self._send_json({"first": first, "last": last, "data": data.serialize(to_json=True)})
+        else:
+            self._send_data(
+                protocol.sequenced_data_frame_buffers(data, first, last, self._sample_type, self._compression)
+            )
+        return True
+
+    def _session_command(self, parameters: list[str]) -> bool:
+        """Send the state of the session, e.g. for a client reattaching to it (the devices may already be running)"""
+        if not self._check_number_parameters("session", parameters, expected=None):
+            return False
+
+        self._send_json(
+            {
+                "t0": self._continuous_data.t0.timestamp(),
+                "nidaqNbChannels": self._nidaq.num_channels,
+                "rehastimNbChannels": self._rehastim.nb_channels,
+                "nidaqConnected": self._nidaq.is_connected,
+                "recording": self._is_recording,
+                "keepSession": self._keep_session,
+                "firstSequence": self._retention.first_sequence,
+                "lastSequence": self._retention.last_sequence,
+                "cursor": self._fetch_cursor,
+                "sharedMemory": self._shared_memory_ring.name if self._shared_memory_ring is not None else None,
+            }
+        )
+        return True
+
+    def _handshake_command(self, parameters: list[str]) -> bool:
+        """Negotiate the protocol of the data channel: the version (0 is unframed JSON) and the type of the samples."""
+        if not self._check_number_parameters("handshake", parameters, expected={"version": True, "sample_type": False}):
+            return False
 
-def _declare_socket(ip_address: str, port: int):
-    """Declare the socket to be used for the connection."""
+        try:
+            version = int(parameters[0])
+            sample_type = (
+                protocol.sample_type(parameters[1]) if len(parameters) > 1 else protocol.sample_type("float32")
+            )
+        except ValueError:
+            _logger.exception("Invalid handshake")
+            return False
+        if version not in protocol.SUPPORTED_VERSIONS:
+            _logger.error(
+                f"Unsupported protocol version {version}, the supported ones are {protocol.SUPPORTED_VERSIONS}"
+            )
+            return False
+
+        self._protocol_version = version
+        self._sample_type = sample_type
+        if version == protocol.JSON_PROTOCOL_VERSION:
+            self._compression = protocol.Compression()  # The unframed messages cannot be compressed
+        _logger.info(f"Using the protocol version {version} with {sample_type.name} samples on the data channel")
+        return True
+
+    def _compression_command(self, parameters: list[str]) -> bool:
+        """Negotiate the compression of the messages of the data channel: the codec ("none", "zlib" or "lzma"), then
+        optionally the size in bytes from which a message is compressed (1024 by default), the compression level and
+        whether to delta encode the samples before compressing them (0 or 1, 0 by default)."""
+        if not self._check_number_parameters(
+            "compression",
+            parameters,
+            expected={"codec": True, "threshold": False, "level": False, "delta": False},
+        ):
+            return False
+        if self._protocol_version == protocol.JSON_PROTOCOL_VERSION:
+            _logger.error("The compressed messages are framed, negotiate a binary protocol (handshake) first")
+            return False
+
+        try:
+            compression = protocol.Compression.from_parameters(parameters)
+        except ValueError:
+            _logger.exception("Invalid compression")
+            return False
+        if self._live_stream is not None:
+            _logger.error("Unsubscribe before changing the compression")
+            return False
+
+        self._compression = compression
+        _logger.info(
+            f"Compressing the messages of at least {compression.threshold} bytes with {compression.codec.name.lower()}"
+            f"{' after delta encoding the samples' if compression.delta else ''} on the data channel"
+        )
+        return True
+
+    def _subscribe_command(self, parameters: list[str]) -> bool:
+        """Push the new data to the data channel as they arrive, instead of waiting for the fetch commands. The
+        parameters are the minimum time between two messages in milliseconds (0 by default, i.e. as soon as the data
+        arrive) and the maximum number of blocks, gaps and events waiting to be sent (the oldest are dropped beyond)."""
+        if not self._check_number_parameters(
+            "subscribe", parameters, expected={"flush_interval": False, "queue_size": False}
+        ):
+            return False
+        flush_interval = _parse_float("flush_interval", parameters[0]) if len(parameters) > 0 else 0.0
+        queue_size = _parse_int("queue_size", parameters[1]) if len(parameters) > 1 else 256
+        if flush_interval is None or queue_size is None:
+            return False
+
+        return self._start_live_stream(flush_interval=flush_interval / 1000, queue_size=queue_size)
+
+    def _subscribe_view_command(self, parameters: list[str]) -> bool:
+        """Push a min/max envelope of the new NiDaq data for display, instead of every sample. The parameters are the
+        number of samples per second wanted (per channel), the minimum time between two messages in milliseconds (0 by
+        default) and then the channels to send (all of them by default)."""
+        if not self._check_number_parameters(
+            "subscribe_view", parameters[:2], expected={"points_per_second": True, "flush_interval": False}
+        ):
+            return False
+
+        points_per_second = _parse_float("points_per_second", parameters[0])
+        flush_interval = _parse_float("flush_interval", parameters[1]) if len(parameters) > 1 else 0.0
+        channels = [_parse_int("channel", channel) for channel in parameters[2:]]
+        if points_per_second is None or flush_interval is None or None in channels:
+            return False
+        if any(channel < 0 or channel >= self._nidaq.num_channels for channel in channels):
+            _logger.error(f"Invalid channels {channels}, the NiDaq has {self._nidaq.num_channels} channels")
+            return False
+
+        try:
+            decimator = MinMaxDecimator.from_points_per_second(points_per_second, channels=channels or None)
+        except ValueError:
+            _logger.exception("Invalid view subscription")
+            return False
+        return self._start_live_stream(flush_interval=flush_interval / 1000, decimator=decimator)
+
+    def _start_live_stream(
+        self, flush_interval: float, queue_size: int = 256, decimator: MinMaxDecimator | None = None
+    ) -> bool:
+        if self._protocol_version == protocol.JSON_PROTOCOL_VERSION:
+            _logger.error("The pushed messages are framed, negotiate a binary protocol (handshake) before subscribing")
+            return False
+        if self._live_stream is not None:
+            _logger.error("Already subscribed")
+            return False
+
+        try:
+            self._live_stream = LiveStream(
+                nidaq=self._nidaq,
+                rehastim=self._rehastim,
+                send=self._live_stream_sender(),
+                t0=self._continuous_data.t0,
+                queue_size=queue_size,
+                flush_interval=flush_interval,
+                decimator=decimator,
+            )
+        except ValueError:
+            _logger.exception("Invalid subscription")
+            return False
+        self._live_stream.start()
+        return True
+
+    def _live_stream_sender(self) -> Callable[[Data], None]:
+        """The function the live stream sends its messages with (from its own thread)"""
+        sample_type = self._sample_type
+        compression = self._compression
+        return lambda data: self._write_data(protocol.data_frame_buffers(data, sample_type, compression))
+
+    def _unsubscribe_command(self, parameters: list[str]) -> bool:
+        if not self._check_number_parameters("unsubscribe", parameters, expected=None):
+            return False
+        if self._live_stream is None:
+            _logger.error("Not subscribed")
+            return False
+
+        self._stop_live_stream()
+        return True
+
+    def _stop_live_stream(self) -> None:
+        if self._live_stream is None:
+            return
+        self._live_stream.stop()
+        self._live_stream = None
+
+    @override
+    def _metrics_command(self, parameters: list[str]) -> bool:
+        if not self._check_number_parameters("metrics", parameters, expected=None):
+            return False
+
+        self._send_json(metrics.serialize())
+        return True
+
+    @override
+    def _profile_command(self, parameters: list[str]) -> bool:
+        if parameters == ["threads"]:
+            # Send the names of the threads to the external software instead of printing them
+            self._send_json([thread.name for thread in threading.enumerate()])
+            return True
+
+        return super()._profile_command(parameters)
+
+    @override
+    def _trace_command(self, parameters: list[str]) -> bool:
+        if parameters and parameters[0] == "dump":
+            # Send the trace to the external software instead of writing it to a file of the server
+            if not self._check_number_parameters("trace dump", parameters[1:], expected=None):
+                return False
+            self._send_json(tracer.to_chrome_trace())
+            return True
+
+        return super()._trace_command(parameters)
+
+
+def _parse_command(data: str) -> tuple[_Command, list[str]]:
+    """Parse an unframed command message ("command:parameter1,parameter2,...")"""
+    command_str, parameters_str = data.split(":")
+    command = _Command(int(command_str))
+    parameters = parameters_str.split(",") if parameters_str else []
+    return command, parameters
+
+
+def _acknowledgment(request_id: int | None, success: bool, payload: bytes = b"") -> bytes:
+    """The acknowledgment of a command: a response frame if the command was framed, "OK" or "ERROR" otherwise"""
+    if request_id is None:
+        return b"OK" if success else b"ERROR"
+    return protocol.encode_response(request_id, success, payload)
+
+
+class _CommandReader:
+    """Split what is received on the command socket into commands.
+
+    The commands are either framed (see [protocol]), in which case any number of them can arrive at once or in pieces,
+    or unframed ("command:parameter1,parameter2,..."), which have no delimiter so each read is taken as one command.
+    """
+
+    def __init__(self) -> None:
+        self._frames = protocol.FrameReader(max_payload=protocol.MAX_COMMAND_SIZE)
+
+    def __len__(self) -> int:
+        """Number of bytes buffered"""
+        return len(self._frames)
+
+    def feed(self, data: bytes) -> None:
+        self._frames.feed(data)
+
+    def next_command(self) -> tuple[str, list[str], int | None] | None:
+        """The next command (command, parameters and request id, which is None if the command is not framed), or None
+        if more bytes are needed. Raises a ValueError if the bytes are not a valid frame."""
+        if len(self._frames) == 0:
+            return None
+
+        if not self._frames.starts_with_frame():
+            data = self._frames.take().decode(errors="replace")
+            try:
+                command, parameters = _parse_command(data)
+            except ValueError:
+                return data.strip(), [], None  # Unknown, the command will fail
+            return str(command), parameters, None
+
+        frame = self._frames.next_frame()
+        if frame is None:
+            return None
+        message_type, payload = frame
+        if message_type != protocol.MessageType.COMMAND:
+            raise ValueError(f"Expected a command frame, received a {message_type.name} frame")
+        request_id, command_value, parameters = protocol.decode_command(payload)
+        try:
+            command = str(_Command(command_value))
+        except ValueError:
+            command = str(command_value)  # Unknown, the command will fail
+        return command, parameters, request_id
+
+
+def _declare_socket(ip_address: str, port: int) -> socket.socket:
+    """Declare the server socket the clients connect to."""
     server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     while True:
         try:
@@ -287,8 +810,60 @@ def _declare_socket(ip_address: str, port: int):
             continue
 
     server.listen()
-    _logger.info(f"Waiting for connection on {ip_address}:{port}...")
+    return server
+
+
+def _declare_unix_socket(path: str) -> socket.socket:
+    """Declare the server socket the clients of the same host connect to."""
+    if os.path.exists(path):
+        os.unlink(path)  # Left over by a server that did not exit cleanly
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    server.listen()
+    return server
+
+
+def _close_server(server: socket.socket) -> None:
+    """Close a server socket (and remove the file of a Unix domain socket)."""
+    path = server.getsockname() if server.family == getattr(socket, "AF_UNIX", None) else None
+    server.close()
+    if path and os.path.exists(path):
+        os.unlink(path)
+
+
+def _accept_connection(server: socket.socket) -> socket.socket:
+    """Wait for a client to connect to a server socket."""
+    address = server.getsockname()
+    if not isinstance(address, str):
+        address = f"{address[0]}:{address[1]}"
+    _logger.info(f"Waiting for connection on {address}...")
     connexion, addr = server.accept()
     _logger.info(f"Connected to {addr}")
 
-    return server, connexion
+    return connexion
+
+
+def _payload_size(payload: bytes | list[bytes | memoryview]) -> int:
+    """Number of bytes of a payload or of a list of buffers."""
+    if isinstance(payload, list):
+        return sum(len(buffer) for buffer in payload)
+    return len(payload)
+
+
+def _send_buffers(connexion: socket.socket, buffers: list[bytes | memoryview]) -> None:
+    """Send buffers one after the other with vectored writes (no copy to join them), or joined if the platform has no
+    sendmsg."""
+    if not hasattr(connexion, "sendmsg"):
+        connexion.sendall(b"".join(buffers))
+        return
+
+    buffers = [memoryview(buffer).cast("B") for buffer in buffers if len(buffer)]
+    while buffers:
+        sent = connexion.sendmsg(buffers[:_MAX_BUFFERS_PER_WRITE])
+        # Skip what was sent, the rest is sent by the next write
+        while buffers and sent >= len(buffers[0]):
+            sent -= len(buffers[0])
+            buffers.pop(0)
+        if sent:
+            buffers[0] = buffers[0][sent:]
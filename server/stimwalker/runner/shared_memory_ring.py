@@ -0,0 +1,263 @@
+"""
+Ring buffer of the live NiDaq samples in shared memory, for the processes running on the same host as the server (they
+map the ring and read it directly, instead of each having their own TCP feed).
+
+The ring is made of a header followed by the time of each sample and the samples themselves:
+
+    header (40 bytes): magic "SWRG" (4 bytes), version (uint8), sample size in bytes (uint8), reserved (2 bytes),
+        number of channels (uint32), capacity in samples (uint32), then three uint64 counters: the seqlock (odd while
+        the writer is writing), the number of samples written and the number of blocks written
+    time: time of the sample, as given by the NiDaq (float64[capacity])
+    samples: channels x capacity (float32 or float64), each channel being contiguous
+
+The sample n (counting from the first sample ever written) is at the position n % capacity. The readers never wait for
+the writer: they copy what they want and start over if the seqlock changed in the meantime (the writer was writing).
+"""
+
+from multiprocessing import shared_memory
+import logging
+import struct
+import sys
+
+import numpy as np
+
+from ..nidaq import NiDaqGeneric
+from .protocol import sample_type
+
+_logger = logging.getLogger("lokomat_fes")
+
+MAGIC = b"SWRG"
+VERSION = 1
+
+_HEADER = struct.Struct("<4sBBHII")
+_COUNTERS_OFFSET = _HEADER.size  # 8-byte aligned, so each counter is read and written at once
+_SEQLOCK, _SAMPLES_WRITTEN, _BLOCKS_WRITTEN = range(3)
+HEADER_SIZE = _COUNTERS_OFFSET + 3 * 8
+
+
+def _map(buffer: memoryview, num_channels: int, capacity: int, dtype: np.dtype):
+    """The counters, time and samples arrays of a ring, as views of its memory"""
+    counters = np.ndarray((3,), dtype="<u8", buffer=buffer, offset=_COUNTERS_OFFSET)
+    t = np.ndarray((capacity,), dtype="<f8", buffer=buffer, offset=HEADER_SIZE)
+    data = np.ndarray((num_channels, capacity), dtype=dtype, buffer=buffer, offset=HEADER_SIZE + capacity * 8)
+    return counters, t, data
+
+
+class SharedMemoryRingWriter:
+    """Publish the blocks of a NiDaq in a ring buffer in shared memory (see the module for its layout).
+
+    The blocks are written from the dispatcher thread of the NiDaq, so publishing never goes through the event loop nor
+    the commands of the runner. The ring only holds the last [duration] seconds: a reader that falls behind more than
+    that misses samples (which it can tell from the number of samples written).
+    """
+
+    def __init__(
+        self,
+        nidaq: NiDaqGeneric,
+        name: str | None = None,
+        duration: float = 10.0,
+        dtype: np.dtype = sample_type("float32"),
+    ) -> None:
+        """
+        Parameters
+        ----------
+        nidaq : NiDaqGeneric
+            The device whose blocks are published.
+        name : str | None
+            The name of the shared memory ([default] lets the system pick one, see [name]).
+        duration : float
+            How long the samples stay in the ring in seconds.
+        dtype : np.dtype
+            The type of the samples in the ring.
+        """
+        if duration <= 0:
+            raise ValueError("duration must be positive")
+
+        self._nidaq = nidaq
+        self._name = name
+        self._capacity = max(int(nidaq.frame_rate * duration), 1)
+        self._dtype = np.dtype(dtype)
+        self._memory: shared_memory.SharedMemory | None = None
+        self._counters: np.ndarray | None = None
+        self._t: np.ndarray | None = None
+        self._data: np.ndarray | None = None
+
+    @property
+    def name(self) -> str | None:
+        """The name the readers open the ring with (None until started)"""
+        return self._memory.name if self._memory is not None else None
+
+    @property
+    def capacity(self) -> int:
+        return self._capacity
+
+    @property
+    def is_running(self) -> bool:
+        return self._memory is not None
+
+    def start(self) -> None:
+        if self.is_running:
+            raise RuntimeError("The shared memory ring is already running")
+
+        num_channels = self._nidaq.num_channels
+        size = HEADER_SIZE + self._capacity * (8 + num_channels * self._dtype.itemsize)
+        self._memory = shared_memory.SharedMemory(name=self._name, create=True, size=size)
+        _HEADER.pack_into(self._memory.buf, 0, MAGIC, VERSION, self._dtype.itemsize, 0, num_channels, self._capacity)
+        self._counters, self._t, self._data = _map(self._memory.buf, num_channels, self._capacity, self._dtype)
+        self._counters[:] = 0
+
+        self._nidaq.register_to_data_ready(self._on_data_ready)
+        _logger.info(f"Publishing the NiDaq data in the shared memory {self.name} ({size} bytes)")
+
+    def stop(self) -> None:
+        """Stop publishing and remove the ring (the readers still mapping it keep their mapping until they close it)"""
+        if not self.is_running:
+            return
+
+        self._nidaq.unregister_to_data_ready(self._on_data_ready)
+        self._nidaq.wait_for_data_ready_callbacks(timeout=1.0)
+        name = self.name
+        self._counters = self._t = self._data = None  # Release the views before closing the memory
+        self._memory.close()
+        self._memory.unlink()
+        self._memory = None
+        _logger.info(f"Stopped publishing in the shared memory {name}")
+
+    def _on_data_ready(self, t: np.ndarray, data: np.ndarray) -> None:
+        counters = self._counters
+        if counters is None:
+            return  # Stopped in the meantime
+
+        n_samples = t.shape[0]
+        if n_samples > self._capacity:
+            t = t[-self._capacity :]
+            data = data[:, -self._capacity :]
+        written = int(counters[_SAMPLES_WRITTEN]) + n_samples
+
+        counters[_SEQLOCK] += 1  # Odd: the readers start over
+        first = (written - t.shape[0]) % self._capacity
+        n_first = min(t.shape[0], self._capacity - first)
+        self._t[first : first + n_first] = t[:n_first]
+        self._data[:, first : first + n_first] = data[:, :n_first]
+        if n_first < t.shape[0]:
+            # Wrap around
+            self._t[: t.shape[0] - n_first] = t[n_first:]
+            self._data[:, : t.shape[0] - n_first] = data[:, n_first:]
+        counters[_SAMPLES_WRITTEN] = written
+        counters[_BLOCKS_WRITTEN] += 1
+        counters[_SEQLOCK] += 1
+
+
+class SharedMemoryRingReader:
+    """Read the ring buffer published by a [SharedMemoryRingWriter], from any process of the same host.
+
+    The ring is mapped once, then each read copies the samples asked for straight from the shared memory, without any
+    call to the server.
+    """
+
+    def __init__(self, name: str) -> None:
+        """
+        Parameters
+        ----------
+        name : str
+            The name of the shared memory (the [name] of the writer).
+        """
+        self._memory = _attach(name)
+        magic, version, itemsize, _, num_channels, capacity = _HEADER.unpack_from(self._memory.buf, 0)
+        if magic != MAGIC:
+            self._memory.close()
+            raise ValueError(f"The shared memory {name} is not a stimwalker ring")
+        if version != VERSION:
+            self._memory.close()
+            raise ValueError(f"Unsupported version {version} of the ring")
+
+        self._num_channels = num_channels
+        self._capacity = capacity
+        self._counters, self._t, self._data = _map(
+            self._memory.buf, num_channels, capacity, {4: sample_type("float32"), 8: sample_type("float64")}[itemsize]
+        )
+
+    @property
+    def num_channels(self) -> int:
+        return self._num_channels
+
+    @property
+    def capacity(self) -> int:
+        return self._capacity
+
+    @property
+    def samples_written(self) -> int:
+        """Number of samples written since the ring was created (the cursor to read from next)"""
+        return int(self._counters[_SAMPLES_WRITTEN])
+
+    @property
+    def blocks_written(self) -> int:
+        return int(self._counters[_BLOCKS_WRITTEN])
+
+    def read(self, since: int = 0, max_samples: int | None = None) -> tuple[np.ndarray, np.ndarray, int, int]:
+        """Copy the samples written after a given number of samples.
+
+        Parameters
+        ----------
+        since : int
+            Number of samples already read (the cursor returned by the previous read, 0 for all the ring).
+        max_samples : int | None
+            Only read the last [max_samples] samples at most ([default] reads all the available ones).
+
+        Returns
+        -------
+        t : np.ndarray
+            Time of the samples.
+        data : np.ndarray
+            Samples [channels x time].
+        first : int
+            Index of the first sample returned (more than [since] if some were overwritten before being read).
+        cursor : int
+            Number of samples written, to read from next time.
+        """
+        while True:
+            sequence = int(self._counters[_SEQLOCK])
+            if sequence % 2:
+                continue  # The writer is writing
+            written = int(self._counters[_SAMPLES_WRITTEN])
+            first = max(since, written - self._capacity)
+            if max_samples is not None:
+                first = max(first, written - max_samples)
+            first = min(first, written)
+
+            positions = np.arange(first, written) % self._capacity
+            t = self._t[positions]
+            data = self._data[:, positions]
+            if int(self._counters[_SEQLOCK]) == sequence:
+                return t, data, first, written
+
+    def close(self) -> None:
+        """Unmap the ring (it does not remove it, the writer does)"""
+        if self._memory is None:
+            return
+        self._counters = self._t = self._data = None  # Release the views before closing the memory
+        self._memory.close()
+        self._memory = None
+
+    def __enter__(self) -> "SharedMemoryRingReader":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    """Open an existing shared memory without tracking it: the writer owns it, so it must not be removed when a reader
+    process exits"""
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+
+    from multiprocessing import resource_tracker
+
+    # Before Python 3.13, opening a shared memory registers it for removal at exit, so skip the registration
+    register = resource_tracker.register
+    resource_tracker.register = lambda name, rtype: None
+    try:
+        return shared_memory.SharedMemory(name=name)
+    finally:
+        resource_tracker.register = register
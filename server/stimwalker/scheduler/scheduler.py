@@ -1,4 +1,3 @@
-from datetime import datetime
 import json
 import logging
 import os
@@ -6,28 +5,56 @@ import threading
 import time
 
 from .automatic_stimulation_rule import AutomaticStimulationRule
+from ..common.clock import Clock, SystemClock, TimerHandle
 from ..common.data import Data
+from ..common.metrics import metrics
+from ..common.tracing import tracer
 
 logger = logging.getLogger("lokomat_fes")
 _mutex = threading.Lock()
 
 
 class Scheduler:
-    def __init__(self, runner, data: Data) -> None:
-        """Initialize the scheduler."""
+    def __init__(self, runner, data: Data, clock: Clock | None = None, virtual_tick_period: float = 0.001) -> None:
+        """Initialize the scheduler.
+
+        Parameters
+        ----------
+        runner : RunnerGeneric
+            The runner to send the stimulations to.
+        data : Data
+            The data the stimulation rules are evaluated on.
+        clock : Clock | None
+            The clock giving the time ([default] is the system clock).
+        virtual_tick_period : float
+            With a virtual clock, the rules are checked every [virtual_tick_period] seconds of simulated time (with the
+            system clock, they are checked continuously from a thread).
+        """
         from ..runner import RunnerGeneric
 
         self._runner: RunnerGeneric = runner
         self._data = data
+        self._clock = clock if clock is not None else SystemClock()
+        self._virtual_tick_period = virtual_tick_period
 
         self.available_schedules: list[AutomaticStimulationRule] = _default_schedules(self)
         self._schedules: dict[int, AutomaticStimulationRule] = {}
 
+        self._ticks = metrics.counter("stimwalker_scheduler_ticks_total", "Checks of the stimulation rules")
+        self._commands_sent = metrics.counter(
+            "stimwalker_stimulation_commands_sent_total", "Stimulation commands sent by the scheduler"
+        )
+
         # Start a thread that will run the scheduler at each millisecond to check whether to stimulate or not
         self._is_paused = False
         self._exit_flag = False
-        self._thread = threading.Thread(target=self._run)
-        self._thread.start()
+        self._thread: threading.Thread | None = None
+        self._next_tick: TimerHandle | None = None
+        if self._clock.is_virtual:
+            self._schedule_next_tick()
+        else:
+            self._thread = threading.Thread(target=self._run, name="Scheduler")
+            self._thread.start()
 
     def __len__(self) -> int:
         """Get the number of stimulations in the scheduler."""
@@ -67,7 +94,10 @@ class Scheduler:
     def dispose(self) -> None:
         """Stop the scheduler."""
         self._exit_flag = True
-        self._thread.join()
+        if self._next_tick is not None:
+            self._next_tick.cancel()
+        if self._thread is not None:
+            self._thread.join()
 
     def _run(self) -> None:
         """Run the scheduler to check whether to stimulate or not."""
@@ -75,25 +105,45 @@ class Scheduler:
             if self._exit_flag:
                 break
 
-            if self._is_paused:
-                time.sleep(0)
-                continue
+            if not self._is_paused:
+                self._tick()
+            time.sleep(0)
 
-            t = datetime.now().timestamp() - self._data.t0.timestamp()
+    def _schedule_next_tick(self) -> None:
+        """Check the rules again in [virtual_tick_period] seconds of simulated time."""
+        self._next_tick = self._clock.call_later(self._virtual_tick_period, self._run_virtual_tick)
 
-            _mutex.acquire()
-            # Get all the stimulations to check whether to stimulate or not
-            amplitudes = [None] * self._runner.nb_channels_rehastim
-            for stimulation in self._schedules.values():
-                stimulation.stimulation_amplitudes(t, self._data, amplitudes)
+    def _run_virtual_tick(self) -> None:
+        if self._exit_flag:
+            return
+        if not self._is_paused:
+            self._tick()
+        self._schedule_next_tick()
 
-            if any(e is not None for e in amplitudes):
-                self._runner.set_stimulation_pulse_amplitude(amplitudes=amplitudes)
-                logger.info(f"Starting or modifying a stimulation (amplitude 0 acting as stopping the stimulation)")
-                self._runner.start_stimulation()
+    def _tick(self) -> None:
+        """Check whether to stimulate or not."""
+        # The rules are checked continuously, so only the ticks that send a command are traced (the others would flood
+        # the ring of the tracer)
+        tick_start = time.perf_counter_ns() if tracer.is_enabled else None
+        self._ticks.inc()
 
-            _mutex.release()
-            time.sleep(0)
+        t = self._clock.now() - self._data.t0.timestamp()
+
+        _mutex.acquire()
+        # Get all the stimulations to check whether to stimulate or not
+        amplitudes = [None] * self._runner.nb_channels_rehastim
+        for stimulation in self._schedules.values():
+            stimulation.stimulation_amplitudes(t, self._data, amplitudes)
+
+        if any(e is not None for e in amplitudes):
+            self._runner.set_stimulation_pulse_amplitude(amplitudes=amplitudes)
+            logger.info(f"Starting or modifying a stimulation (amplitude 0 acting as stopping the stimulation)")
+            self._runner.start_stimulation()
+            self._commands_sent.inc()
+            if tick_start is not None:
+                tracer.record("scheduler.tick", tick_start, category="scheduler")
+
+        _mutex.release()
 
 
 def _default_schedules(self) -> list[AutomaticStimulationRule]:
@@ -0,0 +1,134 @@
+import json
+import sys
+
+import pytest
+
+from benchmarks.__main__ import main
+
+
+def test_data_structures_benchmarks(tmp_path, monkeypatch):
+    output = tmp_path / "report.json"
+    monkeypatch.setattr(
+        sys,
+        "argv",
+        ["benchmarks", "data", "--minutes", "0.1", "--repeat", "1", "--min-time", "0", "--output", str(output)],
+    )
+    main()
+
+    with open(output) as f:
+        report = json.load(f)
+    assert report["suite"] == "data"
+    assert "python" in report["metadata"]
+    benchmarks = {result["benchmark"] for result in report["results"]}
+    assert "nidaq.add_sample_block" in benchmarks
+    assert "data_analyser.percentage_of_stride" in benchmarks
+    for result in report["results"]:
+        assert result["params"]["session_minutes"] == 0.1
+        assert result["seconds_per_call"]["min"] > 0
+
+
+def test_compression_benchmark(tmp_path, monkeypatch):
+    output = tmp_path / "report.json"
+    monkeypatch.setattr(
+        sys,
+        "argv",
+        [
+            "benchmarks",
+            "compression",
+            "--fetch-seconds",
+            "0.5",
+            "--levels",
+            "1",
+            "--repeat",
+            "1",
+            "--min-time",
+            "0",
+            "--output",
+            str(output),
+        ],
+    )
+    main()
+
+    with open(output) as f:
+        report = json.load(f)
+    results = {
+        (result["benchmark"], result["params"]["codec"], result["params"]["delta"]): result["compression"]
+        for result in report["results"]
+    }
+    assert len(results) == 6  # JSON, binary and delta encoded binary for each codec
+    for compression in results.values():
+        assert compression["ratio"] > 1
+        assert compression["compress_ms"] > 0
+    assert (
+        results[("compression.binary", "zlib", True)]["ratio"] > results[("compression.binary", "zlib", False)]["ratio"]
+    )
+
+
+def test_latency_benchmark(tmp_path, monkeypatch):
+    output = tmp_path / "report.json"
+    monkeypatch.setattr(
+        sys,
+        "argv",
+        [
+            "benchmarks",
+            "latency",
+            "--block-durations",
+            "0.05",
+            "--rules",
+            "4",
+            "--subscribers",
+            "1",
+            "--duration",
+            "1.5",
+            "--output",
+            str(output),
+        ],
+    )
+    main()
+
+    with open(output) as f:
+        report = json.load(f)
+    assert len(report["results"]) == 1
+    result = report["results"][0]
+    assert result["params"] == {"block_duration": 0.05, "rules": 4, "subscribers": 1}
+    assert result["blocks"] > 20
+    assert result["latency"]["count"] > 0
+    assert 0 < result["latency"]["p50"] <= result["latency"]["max"]
+
+
+def test_soak_benchmark(tmp_path, monkeypatch):
+    output = tmp_path / "report.json"
+    monkeypatch.setattr(
+        sys,
+        "argv",
+        [
+            "benchmarks",
+            "soak",
+            "--hours",
+            "0.05",
+            "--trial-minutes",
+            "1",
+            "--rest-minutes",
+            "0.5",
+            "--sample-minutes",
+            "1",
+            "--scheduler-tick",
+            "0.1",
+            "--tracemalloc",
+            "--top",
+            "3",
+            "--output",
+            str(output),
+        ],
+    )
+    main()
+
+    with open(output) as f:
+        report = json.load(f)
+    result = report["results"][0]
+    assert result["passed"], result["failures"]
+    assert len(result["samples"]) == 4
+    assert result["samples"][-1]["simulated_hours"] == pytest.approx(0.05)
+    assert result["samples"][-1]["retained_data_bytes"] > result["samples"][0]["retained_data_bytes"]
+    assert result["summary"]["thread_growth"] <= 0
+    assert len(result["top_allocators"]) == 3
@@ -0,0 +1,83 @@
+import threading
+import time
+
+import pytest
+
+from stimwalker.common.clock import SystemClock, VirtualClock
+
+
+def test_system_clock():
+    clock = SystemClock()
+    assert not clock.is_virtual
+    assert clock.now() == pytest.approx(time.time(), abs=0.1)
+
+    start = clock.perf_counter()
+    clock.sleep(0.01)
+    assert clock.perf_counter() - start >= 0.01
+
+
+def test_system_clock_call_later():
+    called = threading.Event()
+    clock = SystemClock()
+    clock.call_later(0.01, called.set)
+    assert called.wait(1)
+
+    cancelled = threading.Event()
+    handle = clock.call_later(0.05, cancelled.set)
+    handle.cancel()
+    assert handle.is_cancelled
+    assert not cancelled.wait(0.1)
+
+
+def test_virtual_clock_only_moves_when_advanced():
+    clock = VirtualClock(start=1000)
+    assert clock.is_virtual
+    assert clock.now() == 1000
+    assert clock.perf_counter() == 0
+
+    time.sleep(0.01)
+    assert clock.now() == 1000
+
+    clock.advance(2.5)
+    assert clock.now() == 1002.5
+    assert clock.perf_counter() == 2.5
+
+    clock.sleep(0.5)
+    assert clock.now() == 1003
+
+    with pytest.raises(ValueError, match="The time cannot go backward"):
+        clock.advance(-1)
+
+
+def test_virtual_clock_calls_in_order():
+    clock = VirtualClock()
+    calls = []
+    clock.call_later(2, lambda: calls.append(("b", clock.now())))
+    clock.call_later(1, lambda: calls.append(("a", clock.now())))
+    clock.call_later(2, lambda: calls.append(("c", clock.now())))
+    clock.call_later(5, lambda: calls.append(("d", clock.now())))
+    assert clock.pending_calls == 4
+
+    clock.advance(3)
+    assert calls == [("a", 1), ("b", 2), ("c", 2)]
+    assert clock.now() == 3
+
+    clock.advance(10)
+    assert calls[-1] == ("d", 5)
+    assert clock.pending_calls == 0
+
+
+def test_virtual_clock_rescheduling_and_cancel():
+    clock = VirtualClock()
+    ticks = []
+
+    def tick():
+        ticks.append(clock.now())
+        clock.call_later(1, tick)
+
+    clock.call_later(1, tick)
+    handle = clock.call_later(2.5, lambda: ticks.append(None))
+    handle.cancel()
+
+    clock.advance(5)
+    assert ticks == [1, 2, 3, 4, 5]
@@ -0,0 +1,315 @@
+import threading
+import time
+
+import pytest
+
+from stimwalker.common.dispatcher import DataDispatcher, DropPolicy, Subscription
+
+
+def test_synchronous_dispatch_when_not_started():
+    received = []
+    dispatcher = DataDispatcher()
+    dispatcher.subscribe(Subscription(lambda a, b: received.append((a, b))))
+
+    dispatcher.push(1, 2)
+    assert received == [(1, 2)]
+    assert dispatcher.pushed == 1
+
+
+def test_dispatch_in_order():
+    received = []
+    dispatcher = DataDispatcher(capacity=128, num_workers=3)
+    subscription = dispatcher.subscribe(Subscription(received.append, queue_size=128))
+    dispatcher.start()
+
+    for i in range(100):
+        assert dispatcher.push(i)
+    assert dispatcher.flush(timeout=2)
+    dispatcher.stop()
+
+    assert received == list(range(100))
+    assert subscription.delivered == 100
+    assert subscription.dropped == 0
+    assert not dispatcher.is_running
+
+
+def test_callbacks_are_called_from_dispatcher_threads():
+    threads = []
+    dispatcher = DataDispatcher()
+    dispatcher.subscribe(Subscription(lambda _: threads.append(threading.current_thread())))
+    dispatcher.start()
+
+    dispatcher.push(0)
+    assert dispatcher.flush(timeout=1)
+    dispatcher.stop()
+
+    assert threads[0] is not threading.current_thread()
+
+
+def test_drop_oldest():
+    release = threading.Event()
+    received = []
+
+    def blocking_callback(value):
+        release.wait()
+        received.append(value)
+
+    dispatcher = DataDispatcher()
+    subscription = dispatcher.subscribe(
+        Subscription(blocking_callback, queue_size=2, drop_policy=DropPolicy.DROP_OLDEST)
+    )
+    dispatcher.start()
+
+    dispatcher.push(0)  # This one is being delivered (and is blocked)
+    time.sleep(0.05)
+    for i in range(1, 6):
+        dispatcher.push(i)
+    time.sleep(0.05)
+    release.set()
+    assert dispatcher.flush(timeout=1)
+    dispatcher.stop()
+
+    assert received == [0, 4, 5]
+    assert subscription.dropped == 3
+    assert subscription.max_queue_depth == 2
+
+
+def test_events_are_delivered_in_order_and_never_dropped():
+    release = threading.Event()
+    received = []
+
+    def blocking_callback(value):
+        release.wait()
+        received.append(value)
+
+    dispatcher = DataDispatcher()
+    subscription = dispatcher.subscribe(
+        Subscription(
+            blocking_callback,
+            queue_size=2,
+            drop_policy=DropPolicy.DROP_OLDEST,
+            event_callback=lambda value: received.append(f"event {value}"),
+        )
+    )
+    blocks_only = []
+    dispatcher.subscribe(Subscription(blocks_only.append))
+    dispatcher.start()
+
+    dispatcher.push(0)  # This one is being delivered (and is blocked)
+    time.sleep(0.05)
+    dispatcher.push(1)
+    dispatcher.push_event("a")
+    for i in range(2, 5):
+        dispatcher.push(i)
+    time.sleep(0.05)
+    release.set()
+    assert dispatcher.flush(timeout=1)
+    dispatcher.stop()
+
+    # The event takes room in the queue, but the blocks are dropped instead of it
+    assert received == [0, "event a", 4]
+    assert subscription.dropped == 3
+    assert subscription.events == 1
+    assert blocks_only == [0, 1, 2, 3, 4]  # Without an event callback, the events are ignored
+
+
+def test_drop_newest():
+    release = threading.Event()
+    received = []
+
+    def blocking_callback(value):
+        release.wait()
+        received.append(value)
+
+    dispatcher = DataDispatcher()
+    subscription = dispatcher.subscribe(
+        Subscription(blocking_callback, queue_size=2, drop_policy=DropPolicy.DROP_NEWEST)
+    )
+    dispatcher.start()
+
+    dispatcher.push(0)
+    time.sleep(0.05)
+    for i in range(1, 6):
+        dispatcher.push(i)
+    time.sleep(0.05)
+    release.set()
+    assert dispatcher.flush(timeout=1)
+    dispatcher.stop()
+
+    assert received == [0, 1, 2]
+    assert subscription.dropped == 3
+
+
+def test_slow_subscriber_does_not_stall_others():
+    release = threading.Event()
+    fast = []
+
+    dispatcher = DataDispatcher(num_workers=2)
+    dispatcher.subscribe(Subscription(lambda _: release.wait()))
+    dispatcher.subscribe(Subscription(fast.append))
+    dispatcher.start()
+
+    for i in range(10):
+        dispatcher.push(i)
+    time.sleep(0.1)
+    assert fast == list(range(10))
+
+    release.set()
+    dispatcher.stop()
+
+
+def test_dropped_at_source_when_overrun():
+    release = threading.Event()
+
+    dispatcher = DataDispatcher(capacity=2, num_workers=1)
+    dispatcher.subscribe(Subscription(lambda _: release.wait(), queue_size=1, drop_policy=DropPolicy.DROP_NEWEST))
+    dispatcher._fan_out_thread = threading.current_thread()  # Pretend to be running, without anyone consuming
+
+    assert dispatcher.push(0)
+    assert dispatcher.push(1)
+    assert not dispatcher.push(2)
+    assert dispatcher.dropped_at_source == 1
+    assert dispatcher.statistics["pending"] == 2
+
+
+def test_callback_errors_are_counted():
+    def failing_callback(_):
+        raise ValueError("Oups")
+
+    dispatcher = DataDispatcher()
+    subscription = dispatcher.subscribe(Subscription(failing_callback))
+    dispatcher.start()
+    dispatcher.push(0)
+    dispatcher.push(1)
+    assert dispatcher.flush(timeout=1)
+    dispatcher.stop()
+
+    assert subscription.errors == 2
+    assert subscription.delivered == 2
+
+
+def test_unsubscribe():
+    received = []
+    dispatcher = DataDispatcher()
+    subscription = dispatcher.subscribe(Subscription(received.append))
+    dispatcher.start()
+
+    dispatcher.push(0)
+    assert dispatcher.flush(timeout=1)
+    dispatcher.unsubscribe(subscription)
+    dispatcher.push(1)
+    assert dispatcher.flush(timeout=1)
+    dispatcher.stop()
+
+    assert received == [0]
+    assert dispatcher.subscriptions == ()
+
+
+def test_invalid_parameters():
+    with pytest.raises(ValueError, match="queue_size must be at least 1"):
+        Subscription(print, queue_size=0)
+    with pytest.raises(ValueError, match="decimation must be at least 1"):
+        Subscription(print, decimation=0)
+    with pytest.raises(ValueError, match="needs a callback or an event callback"):
+        Subscription(None)
+    with pytest.raises(ValueError, match="num_workers must be at least 1"):
+        DataDispatcher(num_workers=0)
+    with pytest.raises(ValueError, match="capacity must be at least 1"):
+        DataDispatcher(capacity=0)
+
+
+def test_lossless_blocks_the_dispatcher():
+    received = []
+
+    def slow_callback(value):
+        time.sleep(0.01)
+        received.append(value)
+
+    dispatcher = DataDispatcher(capacity=64)
+    subscription = dispatcher.subscribe(Subscription(slow_callback, queue_size=2, drop_policy=DropPolicy.LOSSLESS))
+    dispatcher.start()
+
+    for i in range(20):
+        dispatcher.push(i)
+    assert dispatcher.flush(timeout=2)
+    dispatcher.stop()
+
+    assert received == list(range(20))
+    assert subscription.dropped == 0
+    assert subscription.max_queue_depth <= 2
+
+
+def test_latest_only_coalesces():
+    release = threading.Event()
+    received = []
+
+    def blocking_callback(value):
+        release.wait()
+        received.append(value)
+
+    dispatcher = DataDispatcher()
+    subscription = dispatcher.subscribe(Subscription(blocking_callback, drop_policy=DropPolicy.LATEST_ONLY))
+    dispatcher.start()
+
+    dispatcher.push(0)
+    time.sleep(0.05)
+    for i in range(1, 6):
+        dispatcher.push(i)
+    time.sleep(0.05)
+    release.set()
+    assert dispatcher.flush(timeout=1)
+    dispatcher.stop()
+
+    assert received == [0, 5]
+    assert subscription.coalesced == 4
+    assert subscription.dropped == 0
+    assert subscription.queue_size == 1
+
+
+def test_decimation():
+    received = []
+    dispatcher = DataDispatcher()
+    subscription = dispatcher.subscribe(Subscription(received.append, decimation=3))
+
+    for i in range(10):
+        dispatcher.push(i)
+
+    assert received == [0, 3, 6, 9]
+    assert subscription.offered == 10
+    assert subscription.decimated == 6
+    assert subscription.delivered == 4
+
+
+def test_slow_feed_does_not_stall_lossless_feed():
+    release = threading.Event()
+    recording = []
+
+    dispatcher = DataDispatcher(num_workers=2)
+    gui = dispatcher.subscribe(Subscription(lambda _: release.wait(), drop_policy=DropPolicy.LATEST_ONLY))
+    dispatcher.subscribe(Subscription(recording.append, drop_policy=DropPolicy.LOSSLESS))
+    dispatcher.start()
+
+    for i in range(50):
+        dispatcher.push(i)
+    time.sleep(0.1)
+    assert recording == list(range(50))
+    assert gui.coalesced > 0
+
+    release.set()
+    dispatcher.stop()
+
+
+def test_unsubscribe_releases_lossless_wait():
+    release = threading.Event()
+
+    dispatcher = DataDispatcher()
+    subscription = dispatcher.subscribe(Subscription(lambda _: release.wait(), queue_size=1))
+    dispatcher.start()
+
+    for i in range(3):
+        dispatcher.push(i)
+    time.sleep(0.05)
+    dispatcher.unsubscribe(subscription)  # The fan-out thread must not stay blocked on the removed subscription
+    release.set()
+    assert dispatcher.flush(timeout=1)
+    dispatcher.stop()
@@ -0,0 +1,149 @@
+import gc
+import json
+import math
+import urllib.error
+import urllib.request
+
+import pytest
+
+from stimwalker.common.dispatcher import DataDispatcher, Subscription
+from stimwalker.common.metrics import MetricsHttpServer, MetricsRegistry, _Metric, metrics
+
+
+def test_counter_and_gauge():
+    registry = MetricsRegistry()
+    counter = registry.counter("blocks_total", "Blocks")
+    counter.inc()
+    counter.inc(2)
+    assert counter.value == 3
+    assert registry.counter("blocks_total", "Blocks") is counter
+
+    gauge = registry.gauge("pending", "Pending blocks")
+    gauge.set(5)
+    gauge.inc(-2)
+    assert gauge.value == 3
+
+    values = [1]
+    read = registry.gauge("read", "Read from a function", function=lambda: values[0])
+    assert read.value == 1
+    values[0] = 7
+    assert read.value == 7
+
+    # Asking again with a function replaces it
+    registry.gauge("read", "Read from a function", function=lambda: 42)
+    assert read.value == 42
+
+    with pytest.raises(ValueError):
+        registry.histogram("blocks_total", "Not a histogram")
+
+    registry.unregister("read")
+    assert registry.get("read") is None
+
+
+def test_metrics_read_from_an_owner_do_not_keep_it_alive():
+    class Device:
+        def __init__(self, blocks: int) -> None:
+            self.blocks = blocks
+
+    registry = MetricsRegistry()
+    first = Device(3)
+    gauge = registry.gauge("blocks", "Blocks", owner=first, function=lambda device: device.blocks)
+    assert gauge.value == 3
+
+    # A new owner replaces the previous one, which can then be collected
+    second = Device(5)
+    assert registry.gauge("blocks", "Blocks", owner=second, function=lambda device: device.blocks) is gauge
+    assert gauge.value == 5
+    del first
+    gc.collect()
+    assert registry.get("blocks") is gauge
+
+    del second
+    gc.collect()
+    assert registry.get("blocks") is None
+    assert "blocks" not in registry.serialize()
+    assert "blocks" not in registry.render_text()
+
+
+def test_metrics_must_implement_their_samples():
+    with pytest.raises(TypeError):
+        _Metric("abstract", "Abstract")
+
+
+def test_histogram():
+    registry = MetricsRegistry()
+    histogram = registry.histogram("time_seconds", "Time", buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 2.0):
+        histogram.observe(value)
+    assert histogram.count == 4
+    assert histogram.sum == pytest.approx(2.65)
+    assert histogram.buckets == {0.1: 2, 1.0: 3, math.inf: 4}
+
+    with pytest.raises(ValueError):
+        registry.histogram("unsorted", "Unsorted", buckets=(1.0, 0.1))
+
+
+def test_render_text_and_serialize():
+    registry = MetricsRegistry()
+    registry.counter("blocks_total", "Blocks read").inc(3)
+    registry.gauge("callback_seconds_max", "Slowest callback", labels={"subscriber": "plot"}).set(0.25)
+    registry.gauge("callback_seconds_max", "Slowest callback", labels={"subscriber": "record"}).set(0.5)
+    registry.histogram("tick_seconds", "Tick", buckets=(0.001,)).observe(0.0005)
+
+    text = registry.render_text()
+    assert "# HELP blocks_total Blocks read\n# TYPE blocks_total counter\nblocks_total 3\n" in text
+    assert text.count("# TYPE callback_seconds_max gauge") == 1
+    assert 'callback_seconds_max{subscriber="plot"} 0.25\n' in text
+    assert 'tick_seconds_bucket{le="0.001"} 1\n' in text
+    assert 'tick_seconds_bucket{le="+Inf"} 1\n' in text
+    assert "tick_seconds_count 1\n" in text
+
+    serialized = json.loads(json.dumps(registry.serialize()))
+    assert serialized["blocks_total"] == 3
+    assert {"labels": {"subscriber": "record"}, "value": 0.5} in serialized["callback_seconds_max"]
+    assert serialized["tick_seconds"]["count"] == 1
+    assert serialized["tick_seconds"]["buckets"]["+Inf"] == 1
+
+
+def test_failing_function_does_not_break_the_collection():
+    registry = MetricsRegistry()
+    registry.gauge("broken", "Broken", function=lambda: 1 / 0)
+    registry.counter("working_total", "Working").inc()
+
+    assert "working_total 1" in registry.render_text()
+    assert registry.serialize() == {"broken": None, "working_total": 1}
+
+
+def test_http_server():
+    registry = MetricsRegistry()
+    registry.counter("requests_total", "Requests").inc(2)
+    server = MetricsHttpServer(registry=registry, port=0)
+    server.start()
+    try:
+        with urllib.request.urlopen(f"http://localhost:{server.port}/metrics", timeout=5) as response:
+            assert response.status == 200
+            assert response.headers["Content-Type"].startswith("text/plain")
+            assert "requests_total 2" in response.read().decode()
+
+        with pytest.raises(urllib.error.HTTPError):
+            urllib.request.urlopen(f"http://localhost:{server.port}/other", timeout=5)
+    finally:
+        server.stop()
+    assert not server.is_running
+
+
+def test_subscriber_callback_time_is_measured():
+    def record(t, data):
+        pass
+
+    dispatcher = DataDispatcher(name="test")
+    dispatcher.subscribe(Subscription(record))
+    histogram = metrics.histogram(
+        "stimwalker_subscriber_callback_seconds",
+        "",
+        labels={"subscriber": "test_subscriber_callback_time_is_measured.<locals>.record"},
+    )
+    count = histogram.count
+    for _ in range(3):
+        dispatcher.push(0.0, None)
+    assert histogram.count == count + 3
@@ -0,0 +1,103 @@
+import pstats
+import threading
+import time
+
+import pytest
+
+from stimwalker.common.profiling import SamplingProfiler, ThreadProfiler, find_thread
+
+
+def _square(x: float) -> float:
+    return x * x
+
+
+def _step() -> float:
+    return _square(2.0)
+
+
+def _busy_loop(stop: threading.Event) -> None:
+    while not stop.is_set():
+        _step()
+        time.sleep(0.0005)
+
+
+def _not_profiled() -> None:
+    pass
+
+
+@pytest.fixture
+def busy_thread():
+    stop = threading.Event()
+    thread = threading.Thread(target=_busy_loop, args=(stop,), name="Busy Thread", daemon=True)
+    thread.start()
+    yield thread
+    stop.set()
+    thread.join()
+
+
+def test_find_thread(busy_thread):
+    assert find_thread("busy thread") is busy_thread
+    with pytest.raises(ValueError, match="There is no thread named"):
+        find_thread("missing")
+
+
+def test_thread_profiler(busy_thread, tmp_path):
+    profiler = ThreadProfiler("Busy Thread")
+    profiler.start()
+    assert profiler.is_running
+    with pytest.raises(RuntimeError):
+        profiler.start()
+    deadline = time.perf_counter() + 0.2
+    while time.perf_counter() < deadline:
+        _not_profiled()
+    with pytest.raises(RuntimeError):
+        profiler.write(str(tmp_path / "too_early.prof"))
+    profiler.stop()
+
+    statistics = profiler.statistics
+    assert statistics["thread"] == "Busy Thread"
+    assert statistics["calls"] > 0
+
+    functions = {function[2]: stats for function, stats in profiler.stats.items()}
+    assert "_square" in functions
+    assert "_not_profiled" not in functions  # Called by another thread
+    primitive_calls, calls, own_time, cumulative_time, callers = functions["_square"]
+    assert calls > 10
+    assert cumulative_time >= own_time >= 0
+    assert [caller[2] for caller in callers] == ["_step"]
+
+    # Nothing is recorded once stopped
+    n_calls = functions["_square"][1]
+    time.sleep(0.05)
+    profiler.create_stats()
+    assert {function[2]: stats for function, stats in profiler.stats.items()}["_square"][1] == n_calls
+
+    path = tmp_path / "thread.prof"
+    profiler.write(str(path))
+    stats = pstats.Stats(str(path))
+    assert any(function[2] == "_square" for function in stats.stats)
+
+
+def test_sampling_profiler(busy_thread, tmp_path):
+    with pytest.raises(ValueError):
+        SamplingProfiler(interval=0)
+
+    profiler = SamplingProfiler(interval=0.001)
+    profiler.start()
+    time.sleep(0.2)
+    profiler.stop()
+    assert not profiler.is_running
+
+    statistics = profiler.statistics
+    assert statistics["samples"] > 10
+    stacks = profiler.stacks
+    assert any(stack.startswith("Busy Thread;") and "_busy_loop" in stack for stack in stacks)
+    assert not any(stack.startswith("SamplingProfiler") for stack in stacks)
+
+    path = tmp_path / "stacks.folded"
+    profiler.write(str(path))
+    with open(path) as f:
+        lines = f.read().splitlines()
+    assert len(lines) == len(stacks)
+    stack, count = lines[0].rsplit(" ", 1)
+    assert stacks[stack] == int(count)
@@ -0,0 +1,131 @@
+import json
+import threading
+import time
+
+import pytest
+
+from stimwalker.common.clock import VirtualClock
+from stimwalker.common.tracing import Tracer, tracer
+from stimwalker.nidaq.mocks import NiDaqLokomatMock
+
+
+def test_tracer_disabled():
+    trace = Tracer(capacity=8)
+    assert not trace.is_enabled
+
+    with trace.span("nothing"):
+        pass
+    assert trace.spans == []
+    assert trace.span("nothing") is trace.span("something else")  # The same no-op span, nothing is allocated
+
+
+def test_tracer_spans():
+    trace = Tracer(capacity=8)
+    trace.enable()
+    with trace.span("outer", category="test", n_samples=10):
+        with trace.span("inner"):
+            pass
+
+    def in_thread():
+        with trace.span("in thread"):
+            pass
+
+    thread = threading.Thread(target=in_thread, name="TracedThread")
+    thread.start()
+    thread.join()
+
+    spans = trace.spans
+    assert [span["name"] for span in spans] == ["outer", "inner", "in thread"]
+    outer, inner, in_thread_span = spans
+    assert outer["category"] == "test"
+    assert outer["args"] == {"n_samples": 10}
+    assert inner["category"] == "stimwalker"
+    assert outer["start"] <= inner["start"]
+    assert inner["start"] + inner["duration"] <= outer["start"] + outer["duration"]
+    assert outer["thread"] == threading.current_thread().name
+    assert in_thread_span["thread"] == "TracedThread"
+
+    trace.disable()
+    with trace.span("ignored"):
+        pass
+    assert len(trace.spans) == 3
+
+    trace.clear()
+    assert trace.spans == []
+
+
+def test_tracer_records_spans_once_they_are_over():
+    trace = Tracer(capacity=8)
+    start = time.perf_counter_ns()
+    trace.record("ignored", start)
+    assert trace.spans == []
+
+    trace.enable()
+    start = time.perf_counter_ns()
+    trace.record("tick", start, category="test", n_commands=1)
+    (span,) = trace.spans
+    assert span["name"] == "tick"
+    assert span["category"] == "test"
+    assert span["start"] == start
+    assert span["duration"] >= 0
+    assert span["args"] == {"n_commands": 1}
+
+
+def test_tracer_ring_keeps_the_newest_spans():
+    trace = Tracer(capacity=4)
+    trace.enable()
+    for i in range(10):
+        with trace.span(f"span {i}"):
+            pass
+    assert [span["name"] for span in trace.spans] == ["span 6", "span 7", "span 8", "span 9"]
+
+    with pytest.raises(ValueError):
+        Tracer(capacity=0)
+
+
+def test_tracer_chrome_trace(tmp_path):
+    trace = Tracer()
+    trace.enable()
+    with trace.span("block", category="nidaq", n_samples=10, device=object()):
+        pass
+
+    path = tmp_path / "trace.json"
+    trace.export_chrome_trace(str(path))
+    with open(path) as f:
+        events = json.load(f)["traceEvents"]
+
+    metadata = [event for event in events if event["ph"] == "M"]
+    assert metadata[0]["name"] == "thread_name"
+    assert metadata[0]["args"]["name"] == threading.current_thread().name
+
+    (span,) = [event for event in events if event["ph"] == "X"]
+    assert span["name"] == "block"
+    assert span["cat"] == "nidaq"
+    assert span["dur"] >= 0
+    assert span["tid"] == metadata[0]["tid"]
+    assert span["args"]["n_samples"] == 10
+    assert isinstance(span["args"]["device"], str)
+
+
+def test_nidaq_is_traced():
+    tracer.clear()
+    tracer.enable()
+    try:
+        clock = VirtualClock()
+        nidaq = NiDaqLokomatMock(time_between_samples=0.1, clock=clock)
+
+        def plot(t, data):
+            pass
+
+        nidaq.register_to_data_ready(plot)
+        nidaq.connect()
+        clock.advance(0.35)
+        nidaq.disconnect()
+    finally:
+        tracer.disable()
+
+    names = [span["name"] for span in tracer.spans]
+    tracer.clear()
+    assert names.count("nidaq.data_has_arrived") == 3
+    assert names.count("nidaq.manage_new_data") == 3
+    assert names.count("subscriber test_nidaq_is_traced.<locals>.plot") == 3
@@ -280,3 +280,26 @@ def test_save_and_load():
     np.testing.assert_almost_equal(nidaq_data_loaded._data[1][0, 0], 0)
     np.testing.assert_almost_equal(nidaq_data._t[1][0], t[0] + block_time * 1)
     np.testing.assert_almost_equal(nidaq_data._data[1][0, 0], np.sin(t[0] + block_time * 1))
+
+
+def test_gaps():
+    nidaq_data = NiDaqData()
+    assert nidaq_data.gaps == []
+
+    nidaq_data.add(np.array([0, 1]), np.array([[0, 1]]))
+    nidaq_data.add_gap(2, 3)
+    nidaq_data.add(np.array([5, 6]), np.array([[5, 6]]))
+    assert nidaq_data.gaps == [(2, 3)]
+
+    # Gaps are copied and serialized
+    assert nidaq_data.copy.gaps == [(2, 3)]
+    assert NiDaqData.deserialize(nidaq_data.serialize()).gaps == [(2, 3)]
+    assert json.dumps(nidaq_data.serialize(to_json=True))
+
+    # Data serialized before gaps existed can still be deserialized
+    serialized = nidaq_data.serialize()
+    del serialized["gaps"]
+    assert NiDaqData.deserialize(serialized).gaps == []
+
+    nidaq_data.clear()
+    assert nidaq_data.gaps == []
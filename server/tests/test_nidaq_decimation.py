@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from stimwalker.nidaq import MinMaxDecimator
+
+
+def test_min_max_decimator_keeps_the_peaks():
+    t = (np.arange(1000) + 0.5) * 0.001  # Away from the bucket boundaries
+    data = np.vstack([np.sin(2 * np.pi * t), np.zeros_like(t)])
+    data[1, 123] = 5.0  # A single sample spike
+
+    decimator = MinMaxDecimator(bucket_duration=0.1)
+    blocks = [decimator.add(t[i : i + 37], data[:, i : i + 37]) for i in range(0, t.size, 37)]
+    blocks.append(decimator.flush())
+    out_t = np.concatenate([block[0] for block in blocks if block is not None])
+    out_data = np.concatenate([block[1] for block in blocks if block is not None], axis=1)
+
+    # Two samples per bucket, whatever the blocks
+    assert out_t.size == 20
+    assert decimator.samples_in == 1000
+    assert decimator.samples_out == 20
+    assert np.all(np.diff(out_t) >= 0)
+    np.testing.assert_almost_equal(out_data[:, 0::2], data.reshape(2, 10, 100).min(axis=2))
+    np.testing.assert_almost_equal(out_data[:, 1::2], data.reshape(2, 10, 100).max(axis=2))
+    assert out_data[1].max() == 5.0
+    np.testing.assert_almost_equal(out_t[0::2], t[0::100])
+    np.testing.assert_almost_equal(out_t[1::2], t[99::100])
+
+
+def test_min_max_decimator_channels_and_parameters():
+    decimator = MinMaxDecimator.from_points_per_second(20, channels=[2, 0])
+    assert decimator.bucket_duration == 0.1
+
+    t = np.arange(10) * 0.05
+    data = np.arange(30, dtype=float).reshape(3, 10)
+    out_t, out_data = decimator.add(t, data)
+    np.testing.assert_almost_equal(out_t, [0.0, 0.05, 0.1, 0.15, 0.2, 0.25, 0.3, 0.35])
+    np.testing.assert_almost_equal(out_data[0, :2], [20, 21])
+    np.testing.assert_almost_equal(out_data[1, :2], [0, 1])
+    assert decimator.add(t[:0], data[:, :0]) is None
+    assert decimator.flush()[0].size == 2
+    assert decimator.flush() is None
+
+    with pytest.raises(ValueError):
+        MinMaxDecimator(bucket_duration=0)
+    with pytest.raises(ValueError):
+        MinMaxDecimator.from_points_per_second(0)
+    with pytest.raises(ValueError):
+        MinMaxDecimator(bucket_duration=0.1, channels=[])
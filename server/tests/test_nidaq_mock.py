@@ -1,6 +1,9 @@
 import pytest
 import time
 
+import numpy as np
+
+from stimwalker.common.clock import VirtualClock
 from stimwalker.nidaq.mocks import NiDaqLokomatMock
 
 
@@ -135,11 +138,13 @@ def test_on_data_ready_callback():
     nidaq._generate_fake_data()
     assert len(nidaq._data._t) == 1
     assert len(nidaq._data._data) == 1
+    assert nidaq.wait_for_data_ready_callbacks(timeout=1)  # Callbacks are called from the dispatcher threads
     assert _callback_called
 
     _callback_called = False
     nidaq.unregister_to_data_ready(data_ready_callback)
     nidaq._generate_fake_data()
+    assert nidaq.wait_for_data_ready_callbacks(timeout=1)
     assert not _callback_called
 
     nidaq.dispose()
@@ -176,3 +181,252 @@ def test_resuming_recording():
     nidaq.stop_recording()
 
     nidaq.dispose()
+
+
+def test_slow_callback_does_not_delay_acquisition():
+    fast_blocks = []
+    slow_blocks = []
+
+    def fast_callback(t, samples):
+        fast_blocks.append(t)
+
+    def slow_callback(t, samples):
+        time.sleep(0.05)
+        slow_blocks.append(t)
+
+    nidaq = NiDaqLokomatMock()
+    nidaq.connect()
+    nidaq.register_to_data_ready(slow_callback)
+    nidaq.register_to_data_ready(fast_callback)
+
+    initial_time = time.perf_counter()
+    for _ in range(5):
+        nidaq._generate_fake_data()
+    assert time.perf_counter() - initial_time < 0.05 * 5  # The acquisition does not wait for the slow callback
+
+    assert nidaq.wait_for_data_ready_callbacks(timeout=2)
+    assert len(fast_blocks) == 5
+    assert len(slow_blocks) == 5
+
+    statistics = nidaq.data_ready_statistics
+    assert statistics["pushed"] == 5
+    assert statistics["dropped_at_source"] == 0
+    assert statistics["subscriptions"][0]["max_callback_time"] >= 0.05
+
+    nidaq.dispose()
+
+
+def test_fake_data_are_read_into_their_own_buffer():
+    nidaq = NiDaqLokomatMock(time_between_samples=10)  # Make sure the timer does not interfere with the test
+    nidaq.connect()
+    received = []
+    nidaq.register_to_data_ready(lambda t, data: received.append(data))
+
+    for _ in range(3):
+        nidaq._generate_fake_data()
+    assert nidaq.wait_for_data_ready_callbacks(timeout=1)
+
+    # One buffer per block, which is what is kept and dispatched (without any copy)
+    assert nidaq.acquisition_statistics["buffers_allocated"] == 3
+    blocks = list(nidaq._data._data)
+    assert len({id(block) for block in blocks}) == 3
+    assert all(block.base is None and block.dtype == np.float64 and block.flags.c_contiguous for block in blocks)
+    assert all(sent is kept for sent, kept in zip(received, blocks))
+
+    nidaq.dispose()
+
+
+def test_fake_data_content():
+    nidaq = NiDaqLokomatMock(time_between_samples=10)
+    nidaq.connect()
+
+    nidaq._generate_fake_data()
+    _, data = nidaq._data.sample_block(index=-1)
+    assert data.dtype == np.float64
+    assert data.flags["C_CONTIGUOUS"]
+    np.testing.assert_almost_equal(data[0, 0], 0)
+    np.testing.assert_almost_equal(data[1:, :], 0)
+
+    nidaq.dispose()
+
+
+def test_catch_up_reads_all_available_blocks():
+    received = []
+
+    nidaq = NiDaqLokomatMock(time_between_samples=10)
+    nidaq.connect()
+    nidaq.register_to_data_ready(lambda t, data: received.append(t))
+
+    # Three blocks are waiting when the notification finally comes in
+    nidaq._acquire_fake_samples(2 * nidaq._n_samples_per_block)
+    nidaq._generate_fake_data()
+    assert nidaq.wait_for_data_ready_callbacks(timeout=1)
+
+    assert len(nidaq._data) == 3
+    assert len(received) == 3
+    np.testing.assert_almost_equal(np.diff(nidaq._data.time), nidaq.dt, decimal=5)  # Time is continuous
+    assert nidaq._data.gaps == []
+
+    statistics = nidaq.acquisition_statistics
+    assert statistics["blocks_read"] == 3
+    assert statistics["samples_read"] == 3 * nidaq._n_samples_per_block
+    assert statistics["catch_up_reads"] == 1
+    assert statistics["max_backlog_blocks"] == 3
+    assert statistics["gaps"] == 0
+
+    nidaq.dispose()
+
+
+def test_partial_block_waits_for_next_notification():
+    nidaq = NiDaqLokomatMock(time_between_samples=10)
+    nidaq.connect()
+
+    nidaq._acquire_fake_samples(nidaq._n_samples_per_block // 2)
+    nidaq._data_has_arrived(0, 0, 0, None)
+    assert len(nidaq._data) == 0
+
+    nidaq._acquire_fake_samples(nidaq._n_samples_per_block // 2)
+    nidaq._data_has_arrived(0, 0, 0, None)
+    assert len(nidaq._data) == 1
+
+    nidaq.dispose()
+
+
+def test_overrun_is_recorded_as_gap():
+    gaps = []
+
+    nidaq = NiDaqLokomatMock(time_between_samples=10, input_buffer_blocks=2)
+    nidaq.register_to_gap_detected(lambda t, n_samples: gaps.append((t, n_samples)))
+    nidaq.connect()
+    n = nidaq._n_samples_per_block
+
+    nidaq._generate_fake_data()
+
+    # Fall behind by more than the buffer of the device can hold
+    nidaq._acquire_fake_samples(3 * n)
+    nidaq._generate_fake_data()
+    assert nidaq.wait_for_data_ready_callbacks(timeout=1)  # The gaps are dispatched like the blocks
+
+    # The oldest 2 blocks were overwritten, and the 2 that were still in the buffer are read
+    assert len(nidaq._data) == 3
+    assert len(gaps) == 1
+    assert gaps[0][1] == 2 * n
+    assert nidaq._data.gaps == gaps
+
+    # The gap is at the end of the first block and the time accounts for the missing samples (the timestamps are not
+    # exactly spaced by dt as the drift correction sees the mock going much faster than the host clock)
+    t_first, _ = nidaq._data.sample_block(0)
+    t_second, data_second = nidaq._data.sample_block(1)
+    assert gaps[0][0] - t_first[-1] == pytest.approx(nidaq.dt, rel=0.01)
+    assert t_second[0] - t_first[-1] == pytest.approx((2 * n + 1) * nidaq.dt, rel=0.01)
+    np.testing.assert_almost_equal(data_second[0, 0], np.sin(2 * np.pi * 3 * n / nidaq.frame_rate))
+
+    statistics = nidaq.acquisition_statistics
+    assert statistics["gaps"] == 1
+    assert statistics["samples_lost"] == 2 * n
+
+    nidaq.dispose()
+
+
+def test_gaps_arrive_in_order_with_the_blocks():
+    received = []
+    nidaq = NiDaqLokomatMock(time_between_samples=10, input_buffer_blocks=2)
+    nidaq.register_to_data_ready(
+        lambda t, data: received.append("block"), on_gap=lambda t, n_samples: received.append("gap")
+    )
+    nidaq.connect()
+
+    nidaq._generate_fake_data()
+    nidaq._acquire_fake_samples(3 * nidaq._n_samples_per_block)
+    nidaq._generate_fake_data()
+    assert nidaq.wait_for_data_ready_callbacks(timeout=1)
+    assert received == ["block", "gap", "block", "block"]
+
+    nidaq.dispose()
+
+
+def test_samples_overwritten_during_the_read_are_a_gap():
+    nidaq = NiDaqLokomatMock(time_between_samples=10, input_buffer_blocks=2)
+    nidaq.connect()
+    n = nidaq._n_samples_per_block
+    nidaq._generate_fake_data()
+
+    # The device overwrites the samples between the moment they are found available and the read
+    read_into = nidaq._read_into
+    overwritten = []
+
+    def racing_read(buffer, first_sample):
+        if not overwritten:
+            overwritten.append(first_sample)
+            nidaq._acquire_fake_samples(2 * n)
+            raise RuntimeError("Samples overwritten")
+        return read_into(buffer, first_sample)
+
+    nidaq._read_into = racing_read
+    nidaq._acquire_fake_samples(n)
+    assert nidaq._data_has_arrived(0, 0, 0, None) == 1
+
+    statistics = nidaq.acquisition_statistics
+    assert statistics["read_errors"] == 0
+    assert statistics["overwritten_reads"] == 1
+    assert statistics["gaps"] == 1
+    assert statistics["samples_lost"] == n
+    assert len(nidaq._data) == 3
+
+    nidaq.dispose()
+
+
+def test_read_errors_are_counted():
+    nidaq = NiDaqLokomatMock(time_between_samples=10)
+    nidaq.connect()
+
+    def failing_read(buffer, first_sample):
+        raise RuntimeError("Device unplugged")
+
+    nidaq._read_into = failing_read
+    nidaq._acquire_fake_samples(nidaq._n_samples_per_block)
+    assert nidaq._data_has_arrived(0, 0, 0, None) == 0
+    assert nidaq.acquisition_statistics["read_errors"] == 1
+
+    nidaq.dispose()
+
+
+def test_mock_keeps_the_nominal_rate():
+    nidaq = NiDaqLokomatMock(time_between_samples=0.01)
+    nidaq.connect()
+    time.sleep(0.5)
+    nidaq.disconnect()
+
+    statistics = nidaq.timer_statistics
+    assert statistics["achieved_rate"] == pytest.approx(1 / nidaq._time_between_samples, rel=0.05)
+    assert nidaq.acquisition_statistics["samples_read"] == statistics["calls"] * nidaq._n_samples_per_block
+    nidaq.dispose()
+
+
+def test_virtual_clock():
+    clock = VirtualClock(start=1000)
+    nidaq = NiDaqLokomatMock(time_between_samples=0.1, clock=clock)
+    assert nidaq.clock is clock
+
+    received = []
+    nidaq.register_to_data_ready(lambda t, data: received.append(t))
+    nidaq.connect()
+    nidaq.start_recording()
+
+    # A simulated minute runs instantly, and the data ready callbacks are called synchronously
+    initial_time = time.perf_counter()
+    clock.advance(60)
+    assert time.perf_counter() - initial_time < 10
+    assert len(received) == 600
+    assert nidaq.data.t0.timestamp() == 1000
+
+    # The timestamps follow the simulated time exactly
+    t = np.concatenate(received)
+    np.testing.assert_almost_equal(t[0], 1000)
+    np.testing.assert_almost_equal(t[-1], 1060 - nidaq.dt)
+    np.testing.assert_almost_equal(np.diff(t), nidaq.dt)
+    assert nidaq.acquisition_statistics["gaps"] == 0
+
+    nidaq.stop_recording()
+    nidaq.disconnect()
+    nidaq.dispose()
@@ -0,0 +1,126 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from stimwalker.common.clock import VirtualClock
+from stimwalker.nidaq.perpetual_timer import PerpetualTimer
+
+
+def test_period_must_be_positive():
+    with pytest.raises(ValueError, match="The period of the timer must be positive"):
+        PerpetualTimer(0, lambda: None)
+
+
+def test_single_persistent_thread():
+    threads = set()
+
+    def function():
+        threads.add(threading.get_ident())
+
+    timer = PerpetualTimer(0.005, function)
+    timer.start()
+    time.sleep(0.1)
+    timer.cancel()
+
+    assert len(threads) == 1
+    assert not timer.thread.is_alive()
+
+
+def test_execution_time_does_not_drift_the_rate():
+    def slow_function():
+        time.sleep(0.005)
+
+    timer = PerpetualTimer(0.01, slow_function)
+    timer.start()
+    time.sleep(0.5)
+    timer.cancel()
+
+    statistics = timer.statistics
+    assert statistics["nominal_rate"] == 100
+    assert statistics["achieved_rate"] == pytest.approx(100, rel=0.05)
+    assert statistics["calls"] == pytest.approx(50, abs=3)
+    assert statistics["jitter"] >= 0
+    assert statistics["max_lateness"] >= statistics["mean_lateness"]
+
+
+def test_catch_up():
+    calls = 0
+
+    def function():
+        nonlocal calls
+        calls += 1
+        if calls == 1:
+            time.sleep(0.1)
+
+    timer = PerpetualTimer(0.01, function, catch_up=True)
+    timer.start()
+    time.sleep(0.3)
+    timer.cancel()
+
+    # Nothing is lost, the calls that were missed while blocked are made back to back
+    assert timer.statistics["skipped"] == 0
+    assert timer.statistics["late_calls"] > 0
+    assert calls == pytest.approx(30, abs=3)
+
+
+def test_skip():
+    calls = 0
+
+    def function():
+        nonlocal calls
+        calls += 1
+        if calls == 1:
+            time.sleep(0.1)
+
+    timer = PerpetualTimer(0.01, function, catch_up=False)
+    timer.start()
+    time.sleep(0.3)
+    timer.cancel()
+
+    # The calls that were missed while blocked are skipped, and the timer resynchronizes on its deadlines
+    assert timer.statistics["skipped"] == pytest.approx(9, abs=2)
+    assert calls + timer.statistics["skipped"] == pytest.approx(30, abs=3)
+
+
+def test_failing_function_does_not_stop_the_timer():
+    calls = 0
+
+    def failing_function():
+        nonlocal calls
+        calls += 1
+        raise RuntimeError("Failing")
+
+    timer = PerpetualTimer(0.01, failing_function)
+    timer.start()
+    time.sleep(0.1)
+    timer.cancel()
+
+    assert calls > 1
+
+
+def test_cancel_before_start():
+    timer = PerpetualTimer(0.01, lambda: None)
+    timer.cancel()
+    assert timer.statistics["calls"] == 0
+    assert timer.statistics["achieved_rate"] == 0
+
+
+def test_virtual_clock():
+    clock = VirtualClock()
+    calls = []
+    timer = PerpetualTimer(0.01, lambda: calls.append(clock.now()), clock=clock)
+    timer.start()
+
+    # No thread is involved, the calls happen as the clock advances
+    assert not timer.thread.is_alive()
+    clock.advance(1)
+    assert len(calls) == 100
+    np.testing.assert_almost_equal(calls[:3], [0.01, 0.02, 0.03])
+    assert timer.statistics["achieved_rate"] == pytest.approx(100)
+    assert timer.statistics["jitter"] == 0
+
+    timer.cancel()
+    clock.advance(1)
+    assert len(calls) == 100
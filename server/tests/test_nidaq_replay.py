@@ -0,0 +1,165 @@
+import numpy as np
+import pytest
+
+from stimwalker.common.clock import VirtualClock
+from stimwalker.common.data import Data
+from stimwalker.nidaq import NiDaqData, NiDaqReplay
+
+
+def _recording(n_blocks: int = 10, n_channels: int = 3, block_size: int = 100, frame_rate: int = 1000) -> NiDaqData:
+    data = NiDaqData()
+    rng = np.random.default_rng(42)
+    for i in range(n_blocks):
+        t = 500 + (i * block_size + np.arange(block_size)) / frame_rate
+        data.add(t, rng.standard_normal((n_channels, block_size)))
+    return data
+
+
+def _replay(nidaq: NiDaqReplay) -> tuple[list[np.ndarray], list[np.ndarray]]:
+    received_t = []
+    received_data = []
+
+    def on_data_ready(t, data):
+        received_t.append(t)
+        received_data.append(data)
+
+    nidaq.register_to_data_ready(on_data_ready)
+    return received_t, received_data
+
+
+def test_replay_infers_the_device():
+    nidaq = NiDaqReplay(_recording())
+    assert nidaq.num_channels == 3
+    assert nidaq.frame_rate == 1000
+    assert nidaq.n_blocks == 10
+    assert nidaq.speed == 1
+
+    with pytest.raises(ValueError, match="The speed of the replay must be positive"):
+        NiDaqReplay(_recording(), speed=0)
+    with pytest.raises(ValueError, match="Cannot replay a recording without NiDaq data"):
+        NiDaqReplay(NiDaqData())
+
+
+def test_replay_from_file(tmp_path):
+    recording = _recording()
+    path = str(tmp_path / "trial.pkl")
+    Data(nidaq=recording).save(path)
+
+    clock = VirtualClock(start=1000)
+    nidaq = NiDaqReplay(path, speed=None, clock=clock)
+    received_t, received_data = _replay(nidaq)
+    nidaq.connect()
+    clock.advance(1)
+    assert nidaq.is_finished
+
+    # The data are replayed as recorded, and the timestamps are moved to the start of the replay
+    assert len(received_data) == 10
+    np.testing.assert_array_equal(np.concatenate(received_data, axis=1), recording.as_array)
+    np.testing.assert_almost_equal(np.concatenate(received_t), recording.time - 500 + 1000)
+    nidaq.disconnect()
+    nidaq.dispose()
+
+
+def test_replay_at_speed():
+    clock = VirtualClock(start=1000)
+    nidaq = NiDaqReplay(_recording(), speed=2, clock=clock)
+    received_t, _ = _replay(nidaq)
+    nidaq.connect()
+
+    # Each block of 0.1 s is emitted every 0.05 s, and the timeline is compressed accordingly
+    clock.advance(0.26)
+    assert len(received_t) == 5
+    clock.advance(1)
+    assert len(received_t) == 10
+    assert nidaq.is_finished
+    t = np.concatenate(received_t)
+    np.testing.assert_almost_equal(np.diff(t), 0.0005)
+    np.testing.assert_almost_equal(t[0], 1000)
+
+    nidaq.disconnect()
+    nidaq.dispose()
+
+
+def test_looping_replay_on_virtual_clock_terminates():
+    clock = VirtualClock(start=1000)
+    nidaq = NiDaqReplay(_recording(), speed=None, loop=True, clock=clock)
+    received_t, _ = _replay(nidaq)
+    nidaq.connect()
+
+    # Each advance only emits the blocks whose samples are all in the past
+    clock.advance(2.5)
+    assert len(received_t) == 25
+    assert received_t[-1][-1] <= clock.now()
+    clock.advance(0.5)
+    assert len(received_t) == 30
+    assert not nidaq.is_finished
+
+    # The timeline keeps going forward over the loops
+    t = np.concatenate(received_t)
+    np.testing.assert_almost_equal(np.diff(t), 0.001)
+    assert all(block[-1] <= 1003 for block in received_t)
+
+    nidaq.disconnect()
+    nidaq.dispose()
+
+
+def test_replay_blocks_are_read_only_views():
+    clock = VirtualClock()
+    nidaq = NiDaqReplay(_recording(), speed=None, clock=clock)
+    _, received_data = _replay(nidaq)
+    nidaq.connect()
+    clock.advance(1)
+
+    assert not received_data[0].flags.writeable
+    assert received_data[0].base is received_data[1].base
+    nidaq.disconnect()
+    nidaq.dispose()
+
+
+def test_replay_recorded_gaps():
+    recording = _recording()
+    recording._t = [t + (0.3 if i >= 5 else 0) for i, t in enumerate(recording._t)]
+    recording.add_gap(t=500.5, n_samples=300)
+
+    clock = VirtualClock(start=1000)
+    nidaq = NiDaqReplay(recording, speed=None, clock=clock)
+    gaps = []
+    nidaq.register_to_gap_detected(lambda t, n_samples: gaps.append((t, n_samples)))
+    nidaq.connect()
+    clock.advance(1.3)
+
+    assert len(gaps) == 1
+    assert gaps[0][0] == pytest.approx(1000.5)
+    assert gaps[0][1] == 300
+    assert nidaq.acquisition_statistics["samples_lost"] == 300
+    nidaq.disconnect()
+    nidaq.dispose()
+
+
+def test_replay_loop():
+    clock = VirtualClock(start=1000)
+    nidaq = NiDaqReplay(_recording(n_blocks=2), speed=1, loop=True, clock=clock)
+    received_t, _ = _replay(nidaq)
+    nidaq.connect()
+
+    clock.advance(1.001)
+    assert len(received_t) == 10
+    assert not nidaq.is_finished
+
+    # The timeline keeps going forward without gaps
+    t = np.concatenate(received_t)
+    np.testing.assert_almost_equal(np.diff(t), 0.001)
+    assert nidaq.acquisition_statistics["gaps"] == 0
+    nidaq.disconnect()
+    nidaq.dispose()
+
+
+def test_replay_as_fast_as_possible_in_real_time():
+    nidaq = NiDaqReplay(_recording(n_blocks=200), speed=None)
+    received_t, _ = _replay(nidaq)
+    nidaq.connect()
+    assert nidaq.wait_until_finished(timeout=5)
+    assert nidaq.wait_for_data_ready_callbacks(timeout=5)
+    assert len(received_t) == 200
+    nidaq.disconnect()
+    nidaq.dispose()
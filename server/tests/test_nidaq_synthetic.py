@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+from stimwalker.common.clock import VirtualClock
+from stimwalker.nidaq import NiDaqSynthetic
+
+
+def _acquire(nidaq: NiDaqSynthetic, duration: float) -> tuple[np.ndarray, np.ndarray]:
+    clock = nidaq.clock
+    nidaq.connect()
+    nidaq.start_recording()
+    clock.advance(duration)
+    nidaq.stop_recording()
+    out = nidaq.data.time, nidaq.data.as_array
+    nidaq.disconnect()
+    nidaq.dispose()
+    return out
+
+
+def test_synthetic_initialize():
+    nidaq = NiDaqSynthetic(num_channels=128, frame_rate=10000, time_between_samples=0.05)
+    assert nidaq.num_channels == 128
+    assert nidaq.frame_rate == 10000
+    assert nidaq._n_samples_per_block == 500
+    assert nidaq.seed == 0
+    nidaq.dispose()
+
+
+def test_synthetic_signals():
+    nidaq = NiDaqSynthetic(num_channels=64, frame_rate=2000, noise=0, clock=VirtualClock())
+    t, data = _acquire(nidaq, 2)
+    assert data.shape == (64, 4000)
+    assert t.shape == (4000,)
+
+    # The hip is a sine wave of one cycle per stride and the other channels are periodic with the stride
+    np.testing.assert_almost_equal(data[0, :], np.sin(2 * np.pi * np.arange(4000) / 2000))
+    np.testing.assert_almost_equal(data[:, :2000], data[:, 2000:])
+    assert np.all(np.std(data[1:, :], axis=1) > 1)
+
+
+def test_synthetic_is_reproducible():
+    _, first = _acquire(NiDaqSynthetic(num_channels=16, seed=42, clock=VirtualClock()), 1)
+    _, second = _acquire(NiDaqSynthetic(num_channels=16, seed=42, clock=VirtualClock()), 1)
+    _, other = _acquire(NiDaqSynthetic(num_channels=16, seed=43, clock=VirtualClock()), 1)
+
+    np.testing.assert_array_equal(first, second)
+    assert not np.array_equal(first, other)
+
+
+def test_synthetic_sample_only_depends_on_its_index():
+    nidaq = NiDaqSynthetic(num_channels=8, frame_rate=1000, time_between_samples=0.1, noise=0.1)
+    whole = np.empty((8, 100))
+    nidaq._read_into(whole, first_sample=12345)
+    shifted = np.empty((8, 100))
+    nidaq._read_into(shifted, first_sample=12345 + 50)
+    np.testing.assert_array_equal(whole[:, 50:], shifted[:, :50])
+
+    # The noise does not repeat with the stride
+    later = np.empty((8, 100))
+    nidaq._read_into(later, first_sample=12345 + nidaq._stride_length)
+    assert not np.array_equal(whole, later)
+    nidaq.dispose()
+
+
+def test_synthetic_noise():
+    nidaq = NiDaqSynthetic(num_channels=4, noise=0.5, clock=VirtualClock())
+    clean = NiDaqSynthetic(num_channels=4, noise=0, clock=VirtualClock())
+    _, noisy_data = _acquire(nidaq, 1)
+    _, clean_data = _acquire(clean, 1)
+    assert np.std(noisy_data - clean_data) == pytest.approx(0.5, rel=0.1)
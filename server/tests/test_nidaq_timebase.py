@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+
+from stimwalker.nidaq.timebase import Timebase
+
+
+def _simulate(timebase: Timebase, n_blocks: int, n_samples: int, true_period: float, jitter: float = 0, seed: int = 0):
+    """Simulate a device whose clock has a [true_period] and notifies each block with some random latency"""
+    rng = np.random.default_rng(seed)
+    blocks = []
+    for i in range(n_blocks):
+        first_sample = i * n_samples
+        arrival = 1000 + (first_sample + n_samples) * true_period + 0.002 + abs(rng.normal(0, jitter))
+        timebase.observe(sample_index=first_sample + n_samples, host_time=arrival)
+        blocks.append(timebase.timestamps(first_sample=first_sample, n_samples=n_samples))
+    return blocks
+
+
+def test_first_block_ends_at_arrival():
+    timebase = Timebase(frame_rate=1000)
+    timebase.observe(sample_index=100, host_time=10)
+    t = timebase.timestamps(first_sample=0, n_samples=100)
+
+    assert t.shape == (100,)
+    np.testing.assert_almost_equal(t[0], 10 - 0.1)
+    np.testing.assert_almost_equal(t[-1], 10 - 0.001)
+
+
+def test_timestamps_without_observation():
+    timebase = Timebase(frame_rate=1000)
+    with pytest.raises(RuntimeError, match="The timebase needs at least one observation before giving timestamps"):
+        timebase.timestamps(first_sample=0, n_samples=100)
+
+
+def test_no_drift():
+    timebase = Timebase(frame_rate=1000)
+    blocks = _simulate(timebase, n_blocks=50, n_samples=100, true_period=0.001)
+
+    t = np.concatenate(blocks)
+    np.testing.assert_almost_equal(np.diff(t), 0.001)
+    np.testing.assert_almost_equal(timebase.statistics["drift_ppm"], 0, decimal=3)
+
+
+def test_drift_is_corrected():
+    # The device clock is 200 ppm slower than what it claims
+    true_period = 0.001 * (1 + 200e-6)
+    timebase = Timebase(frame_rate=1000)
+    blocks = _simulate(timebase, n_blocks=500, n_samples=100, true_period=true_period, jitter=0.0005)
+
+    statistics = timebase.statistics
+    assert statistics["drift_ppm"] == pytest.approx(200, abs=20)
+    assert 0 < statistics["jitter"] < 0.002
+
+    # The timestamps follow the host clock (within the mean latency), instead of drifting by 200 us per second
+    last_sample = 500 * 100 - 1
+    true_time = 1000 + (last_sample + 1) * true_period + 0.002
+    assert blocks[-1][-1] == pytest.approx(true_time, abs=0.002)
+
+    # And they are always increasing smoothly
+    t = np.concatenate(blocks)
+    assert np.all(np.diff(t) > 0)
+    assert np.max(np.abs(np.diff(t) - 0.001)) < 0.001 * 0.01
+
+
+def test_drift_is_clamped():
+    timebase = Timebase(frame_rate=1000, max_drift_ppm=100)
+    _simulate(timebase, n_blocks=20, n_samples=100, true_period=0.002)
+    assert timebase.statistics["drift_ppm"] == pytest.approx(100)
+
+
+def test_gap_keeps_timebase():
+    timebase = Timebase(frame_rate=1000)
+    timebase.observe(sample_index=100, host_time=10)
+    first = timebase.timestamps(first_sample=0, n_samples=100)
+    timebase.observe(sample_index=400, host_time=10.3)
+    after_gap = timebase.timestamps(first_sample=300, n_samples=100)
+
+    np.testing.assert_almost_equal(after_gap[0] - first[-1], 0.201)
+    np.testing.assert_almost_equal(timebase.time_of(100), first[-1] + 0.001)
+
+
+def test_reset():
+    timebase = Timebase(frame_rate=1000)
+    _simulate(timebase, n_blocks=10, n_samples=100, true_period=0.001)
+    timebase.reset()
+    assert timebase.statistics["observations"] == 0
+    assert timebase.period == 0.001
@@ -1,6 +1,7 @@
 import pytest
 import time
 
+from stimwalker.common.clock import VirtualClock
 from stimwalker.rehastim.mocks import RehastimLokomatMock, pyScienceModeRehastim2Mock
 
 
@@ -96,6 +97,24 @@ def test_stimulate_for_a_specific_duration():
     assert not device.stimulation_active
 
 
+def test_stimulate_for_a_specific_duration_with_virtual_clock():
+    clock = VirtualClock(start=1000)
+    rehastim = RehastimLokomatMock(port="NoPort", clock=clock)
+
+    changes = []
+    rehastim.register_to_on_stimulation_changed(lambda t, duration, channels: changes.append((t, duration)))
+    rehastim.start_stimulation(duration=2)
+    assert changes == [(1000, 2)]
+
+    # The stimulation stops when the simulated time reaches its end
+    clock.advance(1.9)
+    assert len(changes) == 1
+    clock.advance(0.2)
+    assert changes == [(1000, 2), (1002, 0)]
+
+    rehastim.dispose()
+
+
 def test_resuming_stimulation():
     rehastim = RehastimLokomatMock(port="NoPort")
 
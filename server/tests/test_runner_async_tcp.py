@@ -0,0 +1,417 @@
+import json
+import os
+import socket
+import threading
+import time
+
+import pytest
+
+from stimwalker.nidaq.mocks import NiDaqLokomatMock
+from stimwalker.rehastim.mocks import RehastimLokomatMock
+from stimwalker.runner import protocol
+from stimwalker.runner.runner_async_tcp import RunnerAsyncTcp
+from stimwalker.runner.runner_tcp import _Command
+
+
+class _TestClient:
+    def __init__(self, runner: RunnerAsyncTcp, socket_paths: tuple[str, str] | None = None) -> None:
+        if socket_paths is None:
+            self.command = socket.create_connection(("localhost", runner.command_port), timeout=5)
+        else:
+            self.command = _connect_unix(socket_paths[0])
+        self.id, self.token = self.connect()
+
+        # The data connection is paired with the command connection by the token it sends first
+        if socket_paths is None:
+            self.data = socket.create_connection(("localhost", runner.data_port), timeout=5)
+        else:
+            self.data = _connect_unix(socket_paths[1])
+        self.data.sendall(protocol.encode_command(0, _Command.CONNECT.value, [self.token]))
+
+    def connect(self) -> tuple[int, str]:
+        self.command.sendall(protocol.encode_command(1, _Command.CONNECT.value))
+        reader = protocol.FrameReader()
+        frame = None
+        while frame is None:
+            reader.feed(self.command.recv(1 << 16))
+            frame = reader.next_frame()
+        request_id, success, payload = protocol.decode_response(frame[1])
+        assert frame[0] == protocol.MessageType.RESPONSE and request_id == 1 and success
+        reply = json.loads(payload)
+        return reply["clientId"], reply["token"]
+
+    def send(self, command: _Command, parameters: str = "") -> bytes:
+        self.command.sendall(f"{command.value}:{parameters}".encode())
+        return self.command.recv(16)
+
+    def receive_frame(self) -> tuple[protocol.MessageType, bytes]:
+        header = self._receive(protocol.HEADER_SIZE)
+        message_type, length = protocol.decode_header(header)
+        return message_type, self._receive(length)
+
+    def _receive(self, n_bytes: int) -> bytes:
+        out = b""
+        while len(out) < n_bytes:
+            chunk = self.data.recv(n_bytes - len(out))
+            if not chunk:
+                raise ConnectionError("closed")
+            out += chunk
+        return out
+
+    def close(self) -> None:
+        self.command.close()
+        self.data.close()
+
+
+def _connect_unix(path: str) -> socket.socket:
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    connection.settimeout(5)
+    connection.connect(path)
+    return connection
+
+
+@pytest.fixture
+def runner():
+    nidaq = NiDaqLokomatMock(time_between_samples=0.01)
+    rehastim = RehastimLokomatMock(port="NoPort")
+    runner = RunnerAsyncTcp(rehastim=rehastim, nidaq=nidaq, commandPort=0, dataPort=0, max_clients=2)
+    thread = threading.Thread(target=runner.exec)
+    thread.start()
+    assert runner.wait_until_serving(timeout=5)
+    yield runner
+
+    controller = _TestClient(runner)
+    controller.send(_Command.SHUTDOWN)
+    thread.join(timeout=5)
+    controller.close()
+    nidaq.dispose()
+    rehastim.dispose()
+
+
+def _wait_for(condition, timeout: float = 2.0) -> bool:
+    deadline = time.perf_counter() + timeout
+    while not condition():
+        if time.perf_counter() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_controller_and_observers(runner):
+    controller = _TestClient(runner)
+    observer = _TestClient(runner)
+    assert _wait_for(lambda: len(runner.clients) == 2)
+    assert [client["role"] for client in runner.clients] == ["controller", "observer"]
+
+    # Only the controller drives the devices, both can look at the data
+    assert observer.send(_Command.START_NIDAQ) == b"ERROR"
+    assert controller.send(_Command.START_NIDAQ) == b"OK"
+    assert observer.send(_Command.HANDSHAKE, "1") == b"OK"
+    assert observer.send(_Command.SUBSCRIBE) == b"OK"
+    message_type, payload = observer.receive_frame()
+    assert message_type == protocol.MessageType.DATA
+    assert len(protocol.decode_data(payload).nidaq) >= 1
+
+    # The replies go to the client that asked
+    assert controller.send(_Command.AVAILABLE_SCHEDULES) == b"OK"
+    controller.data.settimeout(5)
+    assert controller.data.recv(1 << 16).startswith(b"{")  # The reply of START_NIDAQ, in JSON
+
+    # The observer takes over when the controller leaves
+    controller.close()
+    assert _wait_for(lambda: [client["role"] for client in runner.clients] == ["controller"])
+    assert observer.send(_Command.UNSUBSCRIBE) == b"OK"
+    assert observer.send(_Command.STOP_NIDAQ) == b"OK"
+    observer.close()
+    assert _wait_for(lambda: runner.clients == [])
+
+
+def test_too_many_clients(runner):
+    clients = [_TestClient(runner), _TestClient(runner)]
+    assert _wait_for(lambda: len(runner.clients) == 2)
+
+    refused = socket.create_connection(("localhost", runner.command_port), timeout=5)
+    assert refused.recv(16) == b""  # Closed by the runner
+    refused.close()
+
+    for client in clients:
+        client.close()
+    assert _wait_for(lambda: runner.clients == [])
+
+
+def test_data_connections_are_paired_by_token(runner):
+    # Two clients of the same host, whose data connections arrive in the reverse order of their command connections
+    controller = socket.create_connection(("localhost", runner.command_port), timeout=5)
+    controller.sendall(protocol.encode_command(1, _Command.CONNECT.value))
+    observer = socket.create_connection(("localhost", runner.command_port), timeout=5)
+    observer.sendall(protocol.encode_command(1, _Command.CONNECT.value))
+    tokens = []
+    for connection in (controller, observer):
+        reader = protocol.FrameReader()
+        reader.feed(connection.recv(1 << 16))
+        tokens.append(json.loads(protocol.decode_response(reader.next_frame()[1])[2])["token"])
+    assert [client["role"] for client in runner.clients] == ["controller", "observer"]
+
+    observer_data = socket.create_connection(("localhost", runner.data_port), timeout=5)
+    observer_data.sendall(protocol.encode_command(0, _Command.CONNECT.value, [tokens[1]]))
+    controller_data = socket.create_connection(("localhost", runner.data_port), timeout=5)
+    controller_data.sendall(protocol.encode_command(0, _Command.CONNECT.value, [tokens[0]]))
+
+    # Each reply goes to the data connection of the client that asked
+    controller.sendall(f"{_Command.AVAILABLE_SCHEDULES.value}:".encode())
+    assert controller.recv(16) == b"OK"
+    assert isinstance(json.loads(controller_data.recv(1 << 16)), list)
+    observer.sendall(f"{_Command.SESSION.value}:".encode())
+    assert observer.recv(16) == b"OK"
+    assert "t0" in json.loads(observer_data.recv(1 << 16))
+
+    for connection in (controller, observer, controller_data, observer_data):
+        connection.close()
+    assert _wait_for(lambda: runner.clients == [])
+
+
+def test_unpaired_data_connections_are_refused(runner, caplog):
+    client = socket.create_connection(("localhost", runner.command_port), timeout=5)
+    assert _wait_for(lambda: len(runner.clients) == 1)
+    client.sendall(f"{_Command.CONNECT.value}:".encode())
+    assert client.recv(16) == b"ERROR"  # The token is only sent in a framed response
+
+    # A wrong token, then no token at all
+    data = socket.create_connection(("localhost", runner.data_port), timeout=5)
+    data.sendall(protocol.encode_command(0, _Command.CONNECT.value, ["not a token"]))
+    assert data.recv(16) == b""  # Closed by the runner
+    data.close()
+    data = socket.create_connection(("localhost", runner.data_port), timeout=5)
+    data.sendall(f"{_Command.CONNECT.value}:".encode())
+    assert data.recv(16) == b""
+    data.close()
+    assert "Refusing a data connection" in caplog.text
+
+    client.close()
+    assert _wait_for(lambda: runner.clients == [])
+
+
+def test_slow_client_is_evicted():
+    nidaq = NiDaqLokomatMock(time_between_samples=0.01)
+    rehastim = RehastimLokomatMock(port="NoPort")
+    runner = RunnerAsyncTcp(rehastim=rehastim, nidaq=nidaq, commandPort=0, dataPort=0, max_send_buffer=16)
+    thread = threading.Thread(target=runner.exec)
+    thread.start()
+    assert runner.wait_until_serving(timeout=5)
+
+    client = _TestClient(runner)
+    assert client.send(_Command.METRICS) == b""  # The metrics do not fit in the send buffer, the client is evicted
+    assert _wait_for(lambda: runner.clients == [])
+    client.close()
+
+    controller = _TestClient(runner)
+    controller.send(_Command.SHUTDOWN)
+    thread.join(timeout=5)
+    assert not thread.is_alive()
+    controller.close()
+    nidaq.dispose()
+    rehastim.dispose()
+
+
+def test_pipelined_framed_commands(runner):
+    client = _TestClient(runner)
+    assert _wait_for(lambda: len(runner.clients) == 1)
+
+    # Several commands sent at once, without waiting for their responses
+    client.command.sendall(
+        protocol.encode_command(1, _Command.AVAILABLE_SCHEDULES.value)
+        + protocol.encode_command(2, _Command.STOP_NIDAQ.value, ["unexpected"])
+        + protocol.encode_command(3, _Command.METRICS.value)
+    )
+    reader = protocol.FrameReader()
+    responses = []
+    while len(responses) < 3:
+        reader.feed(client.command.recv(1 << 16))
+        while (frame := reader.next_frame()) is not None:
+            assert frame[0] == protocol.MessageType.RESPONSE
+            responses.append(protocol.decode_response(frame[1]))
+
+    # In order, with the reply of each command in its response
+    assert [(request_id, success) for request_id, success, _ in responses] == [(1, True), (2, False), (3, True)]
+    assert isinstance(json.loads(responses[0][2]), list)
+    assert "stimwalker_tcp_clients" in json.loads(responses[2][2])
+
+    client.close()
+    assert _wait_for(lambda: runner.clients == [])
+
+
+def test_truncated_command_only_closes_its_client(runner, caplog):
+    client = _TestClient(runner)
+    assert _wait_for(lambda: len(runner.clients) == 1)
+
+    payload = protocol.encode_command(1, _Command.METRICS.value)[protocol.HEADER_SIZE :]
+    client.command.sendall(protocol.encode_frame(protocol.MessageType.COMMAND, payload[:3]))
+    assert client.command.recv(16) == b""  # Closed by the runner
+    assert _wait_for(lambda: runner.clients == [])
+    assert "Invalid command frame" in caplog.text
+    client.close()
+
+    # The runner still serves the other clients
+    client = _TestClient(runner)
+    assert client.send(_Command.AVAILABLE_SCHEDULES) == b"OK"
+    client.close()
+    assert _wait_for(lambda: runner.clients == [])
+
+
+def test_subscribe_view(runner):
+    client = _TestClient(runner)
+    assert _wait_for(lambda: len(runner.clients) == 1)
+
+    assert client.send(_Command.HANDSHAKE, "1") == b"OK"
+    assert client.send(_Command.SUBSCRIBE_VIEW, "100,0,99") == b"ERROR"  # No such channel
+    assert client.send(_Command.SUBSCRIBE_VIEW, "100,0,1") == b"OK"
+    assert client.send(_Command.START_NIDAQ) == b"OK"
+
+    # Only the envelope of the requested channel is pushed (after the JSON reply of START_NIDAQ)
+    message_type, payload = client.receive_frame()
+    while message_type != protocol.MessageType.DATA:
+        message_type, payload = client.receive_frame()
+    t, data = protocol.decode_data(payload).nidaq.sample_block(0)
+    assert data.shape[0] == 1
+    assert t.size % 2 == 0
+
+    assert client.send(_Command.UNSUBSCRIBE) == b"OK"
+    assert client.send(_Command.STOP_NIDAQ) == b"OK"
+    client.close()
+    assert _wait_for(lambda: runner.clients == [])
+
+
+def test_fetch_since_resumes_after_a_reconnection(runner):
+    client = _TestClient(runner)
+    other = _TestClient(runner)  # Keeps the devices running while the first client is away
+    assert _wait_for(lambda: len(runner.clients) == 2)
+    assert client.send(_Command.HANDSHAKE, "1") == b"OK"
+    assert client.send(_Command.START_NIDAQ) == b"OK"
+    time.sleep(0.1)
+    assert client.send(_Command.FETCH_SINCE) == b"OK"
+
+    def receive_sequenced_data(test_client: _TestClient):
+        message_type, payload = test_client.receive_frame()
+        while message_type != protocol.MessageType.SEQUENCED_DATA:  # Skip the reply of START_NIDAQ
+            message_type, payload = test_client.receive_frame()
+        return protocol.decode_sequenced_data(payload)
+
+    first, last, data = receive_sequenced_data(client)
+    assert first == 0
+    assert last >= 0
+    last_time = data.nidaq.sample_block(-1)[0][-1]
+    client.close()
+
+    # A new connection picks up right after what was received, without sending the history again
+    time.sleep(0.1)
+    client = _TestClient(runner)
+    assert client.send(_Command.HANDSHAKE, "1") == b"OK"
+    assert client.send(_Command.FETCH_SINCE, str(last)) == b"OK"
+    first, new_last, data = receive_sequenced_data(client)
+    assert first == last + 1
+    assert new_last > last
+    assert data.nidaq.sample_block(0)[0][0] > last_time
+    assert client.send(_Command.FETCH_SINCE, str(new_last + 1000)) == b"ERROR"  # Ahead of the server
+
+    assert other.send(_Command.STOP_NIDAQ) == b"OK"
+    client.close()
+    other.close()
+    assert _wait_for(lambda: runner.clients == [])
+
+
+def test_compression(runner):
+    client = _TestClient(runner)
+    assert _wait_for(lambda: len(runner.clients) == 1)
+
+    assert client.send(_Command.COMPRESSION, "zlib") == b"ERROR"  # The unframed messages cannot be compressed
+    assert client.send(_Command.HANDSHAKE, "1") == b"OK"
+    assert client.send(_Command.COMPRESSION, "gzip") == b"ERROR"
+    assert client.send(_Command.COMPRESSION, "zlib,0,1,1") == b"OK"
+    assert client.send(_Command.START_NIDAQ) == b"OK"
+    time.sleep(0.1)
+    assert client.send(_Command.FETCH_SINCE, "-1") == b"OK"
+
+    # The reply of START_NIDAQ is too short to be made smaller, the data are compressed
+    message_type, payload = client.receive_frame()
+    assert message_type == protocol.MessageType.JSON
+    assert "t0" in json.loads(payload)
+
+    message_type, payload = client.receive_frame()
+    assert message_type == protocol.MessageType.COMPRESSED
+    message_type, payload = protocol.decompress(payload)
+    assert message_type == protocol.MessageType.SEQUENCED_DATA
+    first, last, data = protocol.decode_sequenced_data(payload)
+    assert first == 0
+    assert len(data.nidaq) >= 1
+
+    assert client.send(_Command.STOP_NIDAQ) == b"OK"
+    client.close()
+    assert _wait_for(lambda: runner.clients == [])
+
+
+def test_session_outlives_the_clients():
+    nidaq = NiDaqLokomatMock(time_between_samples=0.01)
+    rehastim = RehastimLokomatMock(port="NoPort")
+    runner = RunnerAsyncTcp(rehastim=rehastim, nidaq=nidaq, commandPort=0, dataPort=0, keep_session=True)
+    thread = threading.Thread(target=runner.exec)
+    thread.start()
+    assert runner.wait_until_serving(timeout=5)
+
+    client = _TestClient(runner)
+    assert client.send(_Command.START_NIDAQ) == b"OK"
+    client.close()
+    assert _wait_for(lambda: runner.clients == [])
+    assert nidaq.is_connected  # Still acquiring without any client
+    assert _wait_for(lambda: runner._retention.last_sequence >= 0)
+
+    # A new client reattaches to the running session and catches up
+    client = _TestClient(runner)
+    assert client.send(_Command.SESSION) == b"OK"
+    client.data.settimeout(5)
+    session = json.loads(client.data.recv(1 << 16))
+    assert session["nidaqConnected"]
+    assert session["lastSequence"] >= 0
+    assert client.send(_Command.HANDSHAKE, "1") == b"OK"
+    assert client.send(_Command.FETCH_SINCE, "-1") == b"OK"
+    message_type, payload = client.receive_frame()
+    assert message_type == protocol.MessageType.SEQUENCED_DATA
+    first, last, _ = protocol.decode_sequenced_data(payload)
+    assert first == 0
+    assert last >= session["lastSequence"]
+
+    # Only the shutdown stops the devices
+    client.send(_Command.SHUTDOWN)
+    thread.join(timeout=5)
+    assert not thread.is_alive()
+    assert not nidaq.is_connected
+    client.close()
+    nidaq.dispose()
+    rehastim.dispose()
+
+
+@pytest.mark.skipif(not hasattr(socket, "AF_UNIX"), reason="No Unix domain sockets on this platform")
+def test_unix_domain_sockets(tmp_path):
+    paths = (str(tmp_path / "command.sock"), str(tmp_path / "data.sock"))
+    nidaq = NiDaqLokomatMock(time_between_samples=0.01)
+    rehastim = RehastimLokomatMock(port="NoPort")
+    runner = RunnerAsyncTcp(rehastim=rehastim, nidaq=nidaq, command_socket_path=paths[0], data_socket_path=paths[1])
+    thread = threading.Thread(target=runner.exec)
+    thread.start()
+    assert runner.wait_until_serving(timeout=5)
+
+    client = _TestClient(runner, socket_paths=paths)
+    assert client.send(_Command.HANDSHAKE, "1") == b"OK"
+    assert client.send(_Command.START_NIDAQ) == b"OK"
+    assert client.send(_Command.SUBSCRIBE) == b"OK"
+    message_type, payload = client.receive_frame()
+    while message_type != protocol.MessageType.DATA:  # Skip the reply of START_NIDAQ
+        message_type, payload = client.receive_frame()
+    assert len(protocol.decode_data(payload).nidaq) >= 1
+
+    client.send(_Command.SHUTDOWN)
+    thread.join(timeout=5)
+    assert not thread.is_alive()
+    client.close()
+    nidaq.dispose()
+    rehastim.dispose()
+    assert not any(os.path.exists(path) for path in paths)  # The socket files are removed
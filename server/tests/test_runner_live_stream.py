@@ -0,0 +1,162 @@
+from datetime import datetime
+import sys
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from stimwalker.common.clock import VirtualClock
+from stimwalker.common.data import Data
+from stimwalker.nidaq.decimation import MinMaxDecimator
+from stimwalker.nidaq.mocks import NiDaqLokomatMock
+from stimwalker.rehastim.mocks import RehastimLokomatMock
+from stimwalker.runner.live_stream import LiveStream
+
+
+def _wait_until_sent(nidaq: NiDaqLokomatMock, stream: LiveStream) -> None:
+    nidaq.wait_for_data_ready_callbacks(timeout=1.0)
+    deadline = time.perf_counter() + 1.0
+    while stream.pending and time.perf_counter() < deadline:
+        time.sleep(0.001)
+
+
+def test_live_stream_pushes_blocks_and_events():
+    clock = VirtualClock()
+    nidaq = NiDaqLokomatMock(time_between_samples=0.1, clock=clock)
+    rehastim = RehastimLokomatMock(port="NoPort", clock=clock)
+    messages: list[Data] = []
+
+    stream = LiveStream(nidaq=nidaq, rehastim=rehastim, send=messages.append, t0=datetime.fromtimestamp(clock.now()))
+    stream.start()
+    nidaq.connect()
+    clock.advance(0.35)
+    rehastim.start_stimulation(duration=0.1)
+    clock.advance(0.2)
+    _wait_until_sent(nidaq, stream)
+    stream.stop()
+    nidaq.disconnect()
+    rehastim.dispose()
+
+    assert not stream.is_running
+    assert stream.dropped == 0
+    assert stream.messages_sent == len(messages)
+    assert sum(len(message.nidaq) for message in messages) == 5
+    times = np.concatenate([message.nidaq.time for message in messages if message.nidaq.has_data])
+    assert np.all(np.diff(times) > 0)
+
+    # The start of the stimulation, then its stop once the duration elapsed
+    events = [event for message in messages for event in message.rehastim._data]
+    assert len(events) == 2
+    (start, start_duration, start_channels), (stop, stop_duration, stop_channels) = events
+    assert start == pytest.approx(0.35)
+    assert start_duration == 0.1
+    assert len(start_channels) == rehastim.nb_channels
+    assert stop == pytest.approx(0.45)
+    assert stop_duration == 0
+    assert len(stop_channels) == rehastim.nb_channels
+
+
+def test_live_stream_flush_interval_batches_blocks():
+    clock = VirtualClock()
+    nidaq = NiDaqLokomatMock(time_between_samples=0.01, clock=clock)
+    rehastim = RehastimLokomatMock(port="NoPort", clock=clock)
+    messages: list[Data] = []
+
+    stream = LiveStream(
+        nidaq=nidaq, rehastim=rehastim, send=messages.append, t0=datetime.now(), flush_interval=0.2, queue_size=1000
+    )
+    stream.start()
+    nidaq.connect()
+    clock.advance(0.505)
+    _wait_until_sent(nidaq, stream)
+    stream.stop()  # Sends what is still waiting for the end of the flush interval
+    nidaq.disconnect()
+    rehastim.dispose()
+
+    assert sum(len(message.nidaq) for message in messages) == 50
+    assert len(messages) < 50
+
+
+def test_live_stream_drops_the_oldest_items():
+    clock = VirtualClock()
+    nidaq = NiDaqLokomatMock(time_between_samples=0.01, clock=clock)
+    rehastim = RehastimLokomatMock(port="NoPort", clock=clock)
+    messages: list[Data] = []
+
+    stream = LiveStream(
+        nidaq=nidaq, rehastim=rehastim, send=messages.append, t0=datetime.now(), flush_interval=10, queue_size=4
+    )
+    stream.start()
+    nidaq.connect()
+    clock.advance(0.105)
+    nidaq.wait_for_data_ready_callbacks(timeout=1.0)
+    stream.stop()
+    nidaq.disconnect()
+    rehastim.dispose()
+
+    assert stream.queued == 10
+    assert stream.dropped == 6
+    (message,) = messages
+    assert len(message.nidaq) == 4
+
+
+def test_live_stream_queue_is_bounded_with_concurrent_producers():
+    nidaq = NiDaqLokomatMock(time_between_samples=0.01, clock=VirtualClock())
+    rehastim = RehastimLokomatMock(port="NoPort")
+    stream = LiveStream(nidaq=nidaq, rehastim=rehastim, send=lambda message: None, t0=datetime.now(), queue_size=8)
+
+    # The blocks and the events are queued from different threads (not started, so nothing is sent)
+    def produce():
+        for i in range(5000):
+            stream._on_gap_detected(float(i), 1)
+
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        producers = [threading.Thread(target=produce) for _ in range(4)]
+        for producer in producers:
+            producer.start()
+        for producer in producers:
+            producer.join()
+    finally:
+        sys.setswitchinterval(switch_interval)
+    rehastim.dispose()
+
+    assert stream.queued == 20000
+    assert stream.pending == 8
+    assert stream.dropped == 20000 - 8
+
+
+def test_live_stream_decimates_the_blocks():
+    clock = VirtualClock()
+    nidaq = NiDaqLokomatMock(time_between_samples=0.1, clock=clock)
+    rehastim = RehastimLokomatMock(port="NoPort", clock=clock)
+    messages: list[Data] = []
+
+    decimator = MinMaxDecimator.from_points_per_second(40, channels=[1])
+    stream = LiveStream(nidaq=nidaq, rehastim=rehastim, send=messages.append, t0=datetime.now(), decimator=decimator)
+    stream.start()
+    nidaq.connect()
+    clock.advance(1.05)
+    _wait_until_sent(nidaq, stream)
+    stream.stop()  # Sends the last bucket
+    nidaq.disconnect()
+    rehastim.dispose()
+
+    blocks = [message.nidaq.sample_block(i) for message in messages for i in range(len(message.nidaq))]
+    assert all(data.shape[0] == 1 for _, data in blocks)
+    assert sum(t.size for t, _ in blocks) == decimator.samples_out == stream.statistics["samples_out"]
+    assert decimator.samples_in == 10 * nidaq._n_samples_per_block
+    assert decimator.samples_out <= 2 * 21  # About 40 samples per second
+    assert decimator.samples_out * 10 < decimator.samples_in
+
+
+def test_live_stream_parameters():
+    nidaq = NiDaqLokomatMock(time_between_samples=0.01, clock=VirtualClock())
+    rehastim = RehastimLokomatMock(port="NoPort")
+    with pytest.raises(ValueError):
+        LiveStream(nidaq=nidaq, rehastim=rehastim, send=print, t0=datetime.now(), queue_size=0)
+    with pytest.raises(ValueError):
+        LiveStream(nidaq=nidaq, rehastim=rehastim, send=print, t0=datetime.now(), flush_interval=-1)
+    rehastim.dispose()
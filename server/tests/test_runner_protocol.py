@@ -0,0 +1,294 @@
+import json
+import socket
+import threading
+
+import numpy as np
+import pytest
+
+from stimwalker import Data
+from stimwalker.rehastim.data import Channel
+from stimwalker.runner import protocol
+from stimwalker.runner.runner_tcp import _CommandReader, _send_buffers
+
+
+def _data(n_blocks: int = 20, n_samples: int = 100, n_channels: int = 16, uniform: bool = True) -> Data:
+    data = Data()
+    rng = np.random.default_rng(42)
+    for i in range(n_blocks):
+        t = 1000.0 + i * n_samples * 0.001 + np.arange(n_samples) * 0.001
+        if not uniform:
+            t = t + rng.uniform(0, 1e-4, n_samples)
+        data.nidaq.add(t, rng.normal(size=(n_channels, n_samples)))
+    data.nidaq.add_gap(1000.5, 3)
+    data.rehastim.add(now=1000.1, duration=0.2, channels=(Channel(1, 20.0), Channel(3, 15.5)))
+    data.rehastim.add(now=1000.4, duration=None, channels=(Channel(2, 0.0),))
+    return data
+
+
+@pytest.mark.parametrize("uniform", [True, False])
+@pytest.mark.parametrize("name", ["float32", "float64"])
+def test_data_round_trip(uniform, name):
+    data = _data(uniform=uniform)
+    frame = protocol.encode_data_frame(data, protocol.sample_type(name))
+
+    message_type, length = protocol.decode_header(frame[: protocol.HEADER_SIZE])
+    assert message_type == protocol.MessageType.DATA
+    assert length == len(frame) - protocol.HEADER_SIZE
+
+    decoded = protocol.decode_data(frame[protocol.HEADER_SIZE :])
+    assert decoded.t0 == data.t0
+    assert len(decoded.nidaq) == len(data.nidaq)
+    np.testing.assert_allclose(decoded.nidaq.time, data.nidaq.time, atol=1e-9)
+    tolerance = 1e-6 if name == "float32" else 0
+    np.testing.assert_allclose(decoded.nidaq.as_array, data.nidaq.as_array, rtol=tolerance, atol=tolerance)
+    assert decoded.nidaq.as_array.dtype == np.dtype(name)
+    assert decoded.nidaq.gaps == [(1000.5, 3)]
+
+    events = decoded.rehastim._data
+    assert [(t, duration) for t, duration, _ in events] == [(1000.1, 0.2), (1000.4, None)]
+    assert [(c.channel_index, c.amplitude) for c in events[0][2]] == [(1, 20.0), (3, 15.5)]
+    assert [(c.channel_index, c.amplitude) for c in events[1][2]] == [(2, 0.0)]
+
+
+@pytest.mark.parametrize("t0", [1000.0, 1.79e9])
+def test_uniform_timebase_of_epoch_timestamps(t0):
+    data = Data()
+    for i in range(10):
+        data.nidaq.add(t0 + i * 0.1 + np.arange(100) * 0.001, np.zeros((2, 100)))
+    payload = protocol.encode_data_frame(data)[protocol.HEADER_SIZE :]
+    assert protocol._SUMMARY.unpack_from(payload)[2] == protocol.TimebaseKind.UNIFORM
+
+    decoded = protocol.decode_data(payload)
+    np.testing.assert_allclose(decoded.nidaq.time, data.nidaq.time, rtol=0, atol=1e-6)
+
+    # A jitter of a tenth of the step is not a uniform timebase, whatever the magnitude of the timestamps
+    jittered = Data()
+    jittered.nidaq.add(t0 + np.arange(100) * 0.001 + np.tile([0, 1e-4], 50), np.zeros((2, 100)))
+    payload = protocol.encode_data_frame(jittered)[protocol.HEADER_SIZE :]
+    assert protocol._SUMMARY.unpack_from(payload)[2] == protocol.TimebaseKind.EXPLICIT
+    np.testing.assert_array_equal(protocol.decode_data(payload).nidaq.time, jittered.nidaq.time)
+
+
+def test_empty_data_round_trip():
+    data = Data()
+    frame = protocol.encode_data_frame(data)
+    decoded = protocol.decode_data(frame[protocol.HEADER_SIZE :])
+    assert len(decoded.nidaq) == 0
+    assert len(decoded.rehastim) == 0
+    assert decoded.t0 == data.t0
+
+
+def test_frame_header():
+    frame = protocol.encode_frame(protocol.MessageType.JSON, b'{"a": 1}')
+    assert protocol.decode_header(frame[: protocol.HEADER_SIZE]) == (protocol.MessageType.JSON, 8)
+    assert json.loads(frame[protocol.HEADER_SIZE :]) == {"a": 1}
+
+    with pytest.raises(ValueError):
+        protocol.decode_header(b"XX" + frame[2 : protocol.HEADER_SIZE])
+    with pytest.raises(ValueError):
+        protocol.decode_header(frame[:2] + bytes([protocol.PROTOCOL_VERSION + 1]) + frame[3 : protocol.HEADER_SIZE])
+    with pytest.raises(ValueError):
+        protocol.sample_type("int16")
+
+
+def test_binary_is_much_smaller_than_json():
+    data = _data()
+    json_size = len(json.dumps(data.serialize(to_json=True)).encode())
+    binary_size = len(protocol.encode_data_frame(data))
+    assert binary_size * 2 < json_size
+
+
+def test_command_and_response_round_trip():
+    frame = protocol.encode_command(7, 10, ["1", "é,with a comma", ""])
+    message_type, length = protocol.decode_header(frame[: protocol.HEADER_SIZE])
+    assert message_type == protocol.MessageType.COMMAND
+    assert protocol.decode_command(frame[protocol.HEADER_SIZE :]) == (7, 10, ["1", "é,with a comma", ""])
+
+    frame = protocol.encode_response(7, True, b'{"a": 1}')
+    assert protocol.decode_response(frame[protocol.HEADER_SIZE :]) == (7, True, b'{"a": 1}')
+    frame = protocol.encode_response(8, False)
+    assert protocol.decode_response(frame[protocol.HEADER_SIZE :]) == (8, False, b"")
+
+
+def test_malformed_commands_are_value_errors():
+    payload = protocol.encode_command(7, 10, ["1", "abc"])[protocol.HEADER_SIZE :]
+
+    # Truncated anywhere: in the header, in the length of a parameter or in a parameter
+    for length in range(len(payload)):
+        with pytest.raises(ValueError):
+            protocol.decode_command(payload[:length])
+
+    # A parameter announced longer than the payload, or bytes after the last parameter
+    overrunning = bytearray(payload)
+    overrunning[-5:-3] = (100).to_bytes(2, "little")
+    with pytest.raises(ValueError):
+        protocol.decode_command(bytes(overrunning))
+    with pytest.raises(ValueError):
+        protocol.decode_command(payload + b"x")
+
+    with pytest.raises(ValueError):
+        protocol.decode_response(b"\x01")
+
+    reader = _CommandReader()
+    reader.feed(protocol.encode_frame(protocol.MessageType.COMMAND, payload[:3]))
+    with pytest.raises(ValueError):
+        reader.next_command()
+
+
+def test_frame_reader_handles_any_segmentation():
+    frames = protocol.encode_command(1, 0) + protocol.encode_command(2, 16, ["x"])
+
+    # Everything at once
+    reader = protocol.FrameReader()
+    reader.feed(frames)
+    assert protocol.decode_command(reader.next_frame()[1]) == (1, 0, [])
+    assert protocol.decode_command(reader.next_frame()[1]) == (2, 16, ["x"])
+    assert reader.next_frame() is None
+
+    # One byte at a time
+    reader = protocol.FrameReader()
+    decoded = []
+    for i in range(len(frames)):
+        reader.feed(frames[i : i + 1])
+        frame = reader.next_frame()
+        if frame is not None:
+            decoded.append(protocol.decode_command(frame[1])[0])
+    assert decoded == [1, 2]
+    assert len(reader) == 0
+
+    reader = protocol.FrameReader(max_payload=4)
+    reader.feed(protocol.encode_command(1, 0))
+    with pytest.raises(ValueError):
+        reader.next_frame()
+
+
+def test_command_reader_framed_and_unframed():
+    reader = _CommandReader()
+    reader.feed(b"10:1")
+    assert reader.next_command() == ("fetch", ["1"], None)
+    assert reader.next_command() is None
+
+    reader.feed(protocol.encode_command(3, 5) + protocol.encode_command(4, 999, ["a", "b"]))
+    assert reader.next_command() == ("available_schedules", [], 3)
+    assert reader.next_command() == ("999", ["a", "b"], 4)  # Unknown commands are left to fail
+    assert reader.next_command() is None
+
+    reader.feed(b"not a command")
+    assert reader.next_command() == ("not a command", [], None)
+
+    reader.feed(protocol.encode_frame(protocol.MessageType.JSON, b"{}"))
+    with pytest.raises(ValueError):
+        reader.next_command()
+
+
+def test_sequenced_data_round_trip():
+    data = _data(n_blocks=3)
+    frame = protocol.encode_sequenced_data_frame(data, first=12, last=40, dtype=np.dtype("<f8"))
+    message_type, length = protocol.decode_header(frame[: protocol.HEADER_SIZE])
+    assert message_type == protocol.MessageType.SEQUENCED_DATA
+    assert length == len(frame) - protocol.HEADER_SIZE
+
+    first, last, decoded = protocol.decode_sequenced_data(frame[protocol.HEADER_SIZE :])
+    assert (first, last) == (12, 40)
+    assert len(decoded.nidaq) == len(data.nidaq)
+    np.testing.assert_array_equal(decoded.nidaq.as_array, data.nidaq.as_array)
+
+
+def test_frame_buffers_are_the_frame():
+    data = _data(n_blocks=3)
+    assert b"".join(protocol.data_frame_buffers(data)) == protocol.encode_data_frame(data)
+    assert b"".join(protocol.sequenced_data_frame_buffers(data, 1, 2)) == protocol.encode_sequenced_data_frame(
+        data, 1, 2
+    )
+
+
+@pytest.mark.parametrize("codec", [protocol.Codec.ZLIB, protocol.Codec.LZMA])
+@pytest.mark.parametrize("delta", [False, True])
+@pytest.mark.parametrize("uniform", [True, False])
+@pytest.mark.parametrize("name", ["float32", "float64"])
+def test_compressed_round_trip(codec, delta, uniform, name):
+    data = _data(uniform=uniform)
+    dtype = protocol.sample_type(name)
+    compression = protocol.Compression(codec=codec, threshold=0, level=1, delta=delta)
+    for message_type, payload in (
+        (protocol.MessageType.DATA, protocol.encode_data(data, dtype)),
+        (protocol.MessageType.SEQUENCED_DATA, [protocol._SEQUENCES.pack(3, 7), *protocol.encode_data(data, dtype)]),
+    ):
+        compressed_type, compressed = compression.compress(message_type, payload)
+        assert compressed_type == protocol.MessageType.COMPRESSED
+        decompressed_type, decompressed = protocol.decompress(b"".join(compressed))
+        assert decompressed_type == message_type
+        assert decompressed == b"".join(payload)
+
+
+def test_compression_of_smooth_signals():
+    data = Data()
+    t = 1000.0 + np.arange(2000) * 0.001
+    data.nidaq.add(t, np.sin(2 * np.pi * np.arange(25)[:, np.newaxis] / 25 + t) * 30)
+    payload = protocol.encode_data(data)
+    size = sum(len(buffer) for buffer in payload)
+
+    sizes = {}
+    for delta in (False, True):
+        compression = protocol.Compression(codec=protocol.Codec.ZLIB, delta=delta)
+        frame = protocol.frame_buffers(protocol.MessageType.DATA, payload, compression)
+        message_type, length = protocol.decode_header(frame[0])
+        assert message_type == protocol.MessageType.COMPRESSED
+        sizes[delta] = length
+        assert compression.messages == 1
+        assert compression.bytes_in == size
+        assert compression.ratio == pytest.approx(size / length)
+
+        assert protocol.decompress(b"".join(frame[1:])) == (protocol.MessageType.DATA, b"".join(payload))
+    assert sizes[True] < sizes[False] < size  # The delta encoding helps
+
+
+def test_compression_threshold():
+    compression = protocol.Compression(codec=protocol.Codec.ZLIB, threshold=100)
+    small = [b"{}" * 10]
+    assert compression.compress(protocol.MessageType.JSON, small) == (protocol.MessageType.JSON, small)
+    assert compression.messages == 0
+
+    # Sent as they are when compressing does not make them smaller
+    random = [np.random.default_rng(0).bytes(1000)]
+    assert compression.compress(protocol.MessageType.JSON, random) == (protocol.MessageType.JSON, random)
+    assert compression.messages == 1
+    assert compression.ratio == 1.0
+
+    # Nothing is compressed without a codec
+    assert protocol.Compression(threshold=0).compress(protocol.MessageType.JSON, small)[0] == protocol.MessageType.JSON
+
+
+def test_compression_parameters():
+    compression = protocol.Compression.from_parameters(["lzma", "2048", "3", "1"])
+    assert (compression.codec, compression.threshold, compression.level, compression.delta) == (
+        protocol.Codec.LZMA,
+        2048,
+        3,
+        True,
+    )
+    assert protocol.Compression.from_parameters(["zlib"]).threshold == 1024
+    for parameters in ([], ["gzip"], ["zlib", "-1"], ["zlib", "10", "12"], ["zlib", "x"]):
+        with pytest.raises(ValueError):
+            protocol.Compression.from_parameters(parameters)
+
+
+def test_send_buffers_handles_partial_writes():
+    buffers = protocol.data_frame_buffers(_data(n_blocks=50, n_samples=1000), np.dtype("<f8"))
+    expected = b"".join(buffers)
+    assert len(expected) > 1 << 20  # More than what a socket buffer holds, so some writes are partial
+
+    sender, receiver = socket.socketpair()
+    received = bytearray()
+
+    def receive():
+        while len(received) < len(expected):
+            received.extend(receiver.recv(1 << 16))
+
+    thread = threading.Thread(target=receive)
+    thread.start()
+    _send_buffers(sender, buffers)
+    thread.join(timeout=5)
+    sender.close()
+    receiver.close()
+    assert received == expected
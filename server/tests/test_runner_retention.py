@@ -0,0 +1,107 @@
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+from stimwalker.common.clock import VirtualClock
+from stimwalker.nidaq.mocks import NiDaqLokomatMock
+from stimwalker.rehastim.mocks import RehastimLokomatMock
+from stimwalker.runner.retention import RetentionBuffer
+from stimwalker.runner.runner_tcp import RunnerTcp
+
+
+def test_retention_buffer_since():
+    clock = VirtualClock()
+    nidaq = NiDaqLokomatMock(time_between_samples=0.1, clock=clock)
+    rehastim = RehastimLokomatMock(port="NoPort", clock=clock)
+    retention = RetentionBuffer(nidaq=nidaq, rehastim=rehastim, size=8)
+    retention.start()
+    assert retention.last_sequence == -1
+
+    nidaq.connect()
+    clock.advance(0.35)
+    rehastim.start_stimulation(duration=0.1)
+    clock.advance(0.2)
+    nidaq.wait_for_data_ready_callbacks(timeout=1.0)
+    t0 = datetime.now()
+
+    # Everything (5 blocks, the start of the stimulation and its stop after 0.1 s), then only what is new
+    first, last, data = retention.since(-1, t0=t0)
+    assert (first, last) == (0, 6)
+    assert len(data.nidaq) == 5
+    assert len(data.rehastim) == 2
+    assert [duration for _, duration, _ in data.rehastim._data] == [0.1, 0]
+    first, last, data = retention.since(last, t0=t0)
+    assert (first, last) == (7, 6)
+    assert not data.nidaq.has_data
+
+    # A cursor in the middle resumes right after it
+    first, last, data = retention.since(2, t0=t0)
+    assert (first, last) == (3, 6)
+    times = np.concatenate([data.nidaq.sample_block(i)[0] for i in range(len(data.nidaq))])
+    assert np.all(np.diff(times) > 0)
+
+    # Only the last items are retained (of the 12: 10 blocks and the 2 events)
+    clock.advance(0.5)
+    nidaq.wait_for_data_ready_callbacks(timeout=1.0)
+    assert (retention.first_sequence, retention.last_sequence) == (4, 11)
+    first, last, data = retention.since(0, t0=t0)
+    assert (first, last) == (4, 11)
+    assert len(data.nidaq) + len(data.rehastim) == 8
+
+    with pytest.raises(ValueError):
+        retention.since(12, t0=t0)
+
+    retention.stop()
+    nidaq.disconnect()
+    rehastim.dispose()
+
+
+def test_retention_buffer_is_bounded_in_bytes():
+    clock = VirtualClock()
+    nidaq = NiDaqLokomatMock(time_between_samples=0.1, clock=clock)
+    rehastim = RehastimLokomatMock(port="NoPort", clock=clock)
+    block_bytes = 100 * 8 + nidaq.num_channels * 100 * 8  # The times and the samples of a block of 100 samples
+    retention = RetentionBuffer(nidaq=nidaq, rehastim=rehastim, size=1000, max_bytes=3 * block_bytes)
+    retention.start()
+
+    nidaq.connect()
+    clock.advance(0.55)
+    nidaq.wait_for_data_ready_callbacks(timeout=1.0)
+    assert (retention.first_sequence, retention.last_sequence) == (2, 4)
+    assert retention.nbytes == 3 * block_bytes
+    first, last, data = retention.since(-1, t0=datetime.now())
+    assert (first, last) == (2, 4)
+    assert len(data.nidaq) == 3
+
+    # A block larger than the bound is still retained, alone
+    retention._max_bytes = 1
+    clock.advance(0.1)
+    nidaq.wait_for_data_ready_callbacks(timeout=1.0)
+    assert (retention.first_sequence, retention.last_sequence) == (5, 5)
+
+    with pytest.raises(ValueError):
+        RetentionBuffer(nidaq=nidaq, rehastim=rehastim, max_bytes=0)
+
+    retention.stop()
+    nidaq.disconnect()
+    rehastim.dispose()
+
+
+def test_retention_buffer_runs_with_the_runner():
+    nidaq = NiDaqLokomatMock(time_between_samples=0.1, clock=VirtualClock())
+    rehastim = RehastimLokomatMock(port="NoPort")
+    runner = RunnerTcp(rehastim=rehastim, nidaq=nidaq, commandPort=0, dataPort=0)
+
+    def subscribers() -> int:
+        return len(nidaq.data_ready_statistics["subscriptions"])
+
+    before = subscribers()
+    serving = []
+    runner._serve = lambda: serving.append(subscribers())
+    runner._exec()
+    assert serving == [before + 1]
+    assert subscribers() == before
+
+    runner._scheduler.dispose()
+    rehastim.dispose()
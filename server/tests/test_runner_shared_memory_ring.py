@@ -0,0 +1,81 @@
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+from stimwalker.common.clock import VirtualClock
+from stimwalker.nidaq.mocks import NiDaqLokomatMock
+from stimwalker.runner import SharedMemoryRingReader, SharedMemoryRingWriter
+
+
+def _acquire(nidaq: NiDaqLokomatMock, clock: VirtualClock, duration: float) -> tuple[np.ndarray, np.ndarray]:
+    """Acquire for [duration] seconds, and get all that was acquired"""
+    t, data = [], []
+    nidaq.register_to_data_ready(lambda t_block, data_block: (t.append(t_block), data.append(data_block.copy())))
+    clock.advance(duration)
+    nidaq.wait_for_data_ready_callbacks(timeout=1.0)
+    return np.concatenate(t), np.concatenate(data, axis=1)
+
+
+def test_shared_memory_ring_read_and_wrap_around():
+    clock = VirtualClock()
+    nidaq = NiDaqLokomatMock(time_between_samples=0.01, clock=clock)
+    writer = SharedMemoryRingWriter(nidaq=nidaq, duration=0.5, dtype=np.dtype("<f8"))
+    writer.start()
+    nidaq.connect()
+
+    with SharedMemoryRingReader(writer.name) as reader:
+        assert reader.num_channels == nidaq.num_channels
+        assert reader.capacity == writer.capacity
+        t, data, first, cursor = reader.read()
+        assert (t.size, first, cursor) == (0, 0, 0)
+
+        expected_t, expected_data = _acquire(nidaq, clock, 0.305)
+        t, data, first, cursor = reader.read()
+        assert (first, cursor) == (0, expected_t.size)
+        np.testing.assert_array_equal(t, expected_t)
+        np.testing.assert_array_equal(data, expected_data)
+
+        # Only the new samples, then only the last samples once the ring wrapped around
+        more_t, more_data = _acquire(nidaq, clock, 0.5)
+        t, data, first, new_cursor = reader.read(since=cursor, max_samples=10)
+        assert (first, new_cursor) == (cursor + more_t.size - 10, cursor + more_t.size)
+        np.testing.assert_array_equal(t, more_t[-10:])
+        t, data, first, _ = reader.read(since=cursor)
+        assert first == new_cursor - reader.capacity  # The oldest were overwritten
+        np.testing.assert_array_equal(t, more_t[-reader.capacity :])
+        np.testing.assert_array_equal(data, more_data[:, -reader.capacity :])
+        assert reader.blocks_written == 80
+
+    nidaq.disconnect()
+    writer.stop()
+    with pytest.raises(FileNotFoundError):
+        SharedMemoryRingReader(writer.name or "stimwalker_test_removed_ring")
+
+
+def test_shared_memory_ring_from_another_process():
+    clock = VirtualClock()
+    nidaq = NiDaqLokomatMock(time_between_samples=0.01, clock=clock)
+    writer = SharedMemoryRingWriter(nidaq=nidaq)
+    writer.start()
+    nidaq.connect()
+    expected_t, _ = _acquire(nidaq, clock, 0.105)
+
+    script = (
+        "from stimwalker.runner import SharedMemoryRingReader\n"
+        f"with SharedMemoryRingReader({writer.name!r}) as reader:\n"
+        "    t, data, first, cursor = reader.read()\n"
+        "    print(cursor, data.shape[0], t[-1])\n"
+    )
+    output = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True).stdout.split()
+    assert int(output[0]) == expected_t.size
+    assert int(output[1]) == nidaq.num_channels
+    assert float(output[2]) == expected_t[-1]
+
+    # The reader exiting did not remove the ring
+    with SharedMemoryRingReader(writer.name) as reader:
+        assert reader.samples_written == expected_t.size
+
+    nidaq.disconnect()
+    writer.stop()
@@ -0,0 +1,82 @@
+from datetime import datetime
+
+from stimwalker.common.clock import VirtualClock
+from stimwalker.common.data import Data
+from stimwalker.common.metrics import metrics
+from stimwalker.common.tracing import tracer
+from stimwalker.scheduler.scheduler import Scheduler
+
+
+class _Runner:
+    """The part of a runner the scheduler sends its commands to"""
+
+    nb_channels_rehastim = 2
+
+    def __init__(self) -> None:
+        self.commands = []
+
+    def set_stimulation_pulse_amplitude(self, amplitudes: list[float | None]) -> None:
+        self.commands.append(list(amplitudes))
+
+    def start_stimulation(self) -> None:
+        pass
+
+
+class _EveryTenthTickRule:
+    """Change the amplitude of the first channel (alternately 5 and 10 mA) once every ten ticks"""
+
+    def __init__(self) -> None:
+        self._ticks = 0
+
+    def stimulation_amplitudes(self, current_time: float, data: Data, amplitude_out: list[float | None]) -> None:
+        self._ticks += 1
+        if self._ticks % 10 == 0:
+            amplitude_out[0] = 10.0 if self._ticks % 20 == 0 else 5.0
+
+
+def _scheduler(clock: VirtualClock) -> tuple[Scheduler, _Runner]:
+    runner = _Runner()
+    scheduler = Scheduler(runner, Data(t0=datetime.fromtimestamp(clock.now())), clock=clock, virtual_tick_period=0.001)
+    scheduler.add(_EveryTenthTickRule())
+    return scheduler, runner
+
+
+def test_only_the_ticks_sending_a_command_are_traced():
+    clock = VirtualClock()
+    scheduler, runner = _scheduler(clock)
+    tracer.clear()
+    tracer.enable()
+    try:
+        clock.advance(0.1005)  # 100 ticks
+    finally:
+        tracer.disable()
+        scheduler.dispose()
+
+    ticks = [span for span in tracer.spans if span["name"] == "scheduler.tick"]
+    tracer.clear()
+    assert len(runner.commands) == 10
+    assert len(ticks) == 10
+    assert all(span["category"] == "scheduler" for span in ticks)
+
+
+class _StopRule:
+    """Ask for the first channel to be at 0 mA at every tick"""
+
+    def stimulation_amplitudes(self, current_time: float, data: Data, amplitude_out: list[float | None]) -> None:
+        amplitude_out[0] = 0.0
+
+
+def test_every_command_is_sent_and_counted():
+    clock = VirtualClock()
+    runner = _Runner()
+    scheduler = Scheduler(runner, Data(t0=datetime.fromtimestamp(clock.now())), clock=clock, virtual_tick_period=0.001)
+    scheduler.add(_StopRule())
+    sent = metrics.get("stimwalker_stimulation_commands_sent_total")
+    sent_before = sent.value
+
+    clock.advance(0.0105)  # 10 ticks
+    scheduler.dispose()
+
+    # Stopping channels already stopped is sent too, the scheduler does not second-guess the rules
+    assert runner.commands == [[0.0, None]] * 10
+    assert sent.value - sent_before == 10